@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from typing import Callable, Optional
+
+from formula import Formula
+
+import cdcl
+import cube
+import dimacs_parser
+import drat
+import helpers
+import sls
+import validate
+
+
+TESTDIR = "tests/"
+INFOBASENAME = "info.json"
+
+
+def get_levels() -> list[str]:
+    with open(os.path.join(TESTDIR, "in", INFOBASENAME)) as fin:
+        return json.load(fin)["levels"]
+
+
+def get_level_info(level: str) -> dict:
+    with open(os.path.join(TESTDIR, "in", level, INFOBASENAME)) as fin:
+        return json.load(fin)
+
+
+def get_level_files(level: str) -> list[str]:
+    levelpath = os.path.join(TESTDIR, "in", level)
+    tests = get_level_info(level)["tests"]
+    return [os.path.join(levelpath, test) for test in tests]
+
+
+def parse_formula(path: str) -> Formula:
+    parser = dimacs_parser.FormulaParser()
+    parser.set_path(path)
+    phi = parser.parse()
+    assert phi is not None, f"Failed to parse {path}!"
+    return phi
+
+
+def best_time(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def bench_parse(levels: list[str], repeat: int) -> None:
+    print(f"{'level':<14} {'files':>5} {'legacy (ms)':>12} {'fast (ms)':>10} "
+          f"{'speedup':>8}")
+    for level in levels:
+        files = get_level_files(level)
+        legacy_total, fast_total = 0.0, 0.0
+        for path in files:
+            parser = dimacs_parser.FormulaParser()
+            parser.set_path(path)
+            legacy_total += best_time(
+                lambda: parser.parse_lines(parser.open_and_read()), repeat)
+            fast_total += best_time(parser.parse, repeat)
+
+        legacy_ms = 1000 * legacy_total / len(files)
+        fast_ms = 1000 * fast_total / len(files)
+        print(f"{level:<14} {len(files):>5} {legacy_ms:>12.3f} "
+              f"{fast_ms:>10.3f} {legacy_ms / fast_ms:>7.2f}x")
+
+
+def bench_cdcl(levels: list[str], max_tests: Optional[int]) -> None:
+    """Check the reference verdicts with the CDCL engine, within the level
+    timeouts. Tests it runs out of time on are left unchecked, which from
+    uf200/uuf200 up is a growing share of them."""
+    print(f"{'level':<14} {'tests':>5} {'solved':>6} {'wrong':>5} "
+          f"{'TLE':>4} {'mean (s)':>9} {'max (s)':>8} {'conflicts/s':>12}")
+    unchecked = []
+    for level in levels:
+        info = get_level_info(level)
+        timeout = info["timeout"]
+        tests = list(info["tests"].items())[:max_tests]
+        solved, wrong = 0, 0
+        total_time, max_time, conflicts = 0.0, 0.0, 0
+        for test, ref_verdict in tests:
+            path = os.path.join(TESTDIR, "in", level, test)
+            phi = parse_formula(path)
+
+            start = time.perf_counter()
+            solver = cdcl.Solver(phi)
+            answer = solver.solve(time_limit=timeout)
+            elapsed = time.perf_counter() - start
+
+            total_time += elapsed
+            max_time = max(max_time, elapsed)
+            conflicts += solver.conflicts
+            if answer is None:
+                continue
+
+            verdict, model = answer
+            solved += 1
+            if verdict != ref_verdict or \
+                    (verdict and not validate.validate_model(phi, model)):
+                print(f"Wrong answer for {path}!")
+                wrong += 1
+
+        ntests = len(tests)
+        tles = ntests - solved
+        if tles:
+            unchecked.append(f"{level} ({tles}/{ntests})")
+        print(f"{level:<14} {ntests:>5} {solved:>6} {wrong:>5} {tles:>4} "
+              f"{total_time / ntests:>9.3f} {max_time:>8.3f} "
+              f"{conflicts / total_time:>12.0f}")
+
+    if unchecked:
+        print(f"\nNot checked, the engine timed out: {', '.join(unchecked)}")
+
+
+def bench_sls(levels: list[str], algorithm: str) -> None:
+    """Find models of the satisfiable tests with local search, within the
+    level timeouts"""
+    print(f"{'level':<14} {'tests':>5} {'solved':>6} {'wrong':>5} "
+          f"{'mean (s)':>9} {'max (s)':>8} {'flips/s':>10}")
+    for level in levels:
+        info = get_level_info(level)
+        timeout = info["timeout"]
+        tests = [test for test, ref_verdict in info["tests"].items()
+                 if ref_verdict]
+        if not tests:
+            continue
+
+        solved, wrong = 0, 0
+        total_time, max_time, flips = 0.0, 0.0, 0
+        for test in tests:
+            path = os.path.join(TESTDIR, "in", level, test)
+            phi = parse_formula(path)
+
+            start = time.perf_counter()
+            answer, test_flips = sls.solve(phi, algorithm=algorithm,
+                                           time_limit=timeout)
+            elapsed = time.perf_counter() - start
+
+            total_time += elapsed
+            max_time = max(max_time, elapsed)
+            flips += test_flips
+            if answer is None:
+                continue
+
+            solved += 1
+            if not validate.validate_model(phi, answer[1]):
+                print(f"Wrong answer for {path}!")
+                wrong += 1
+
+        print(f"{level:<14} {len(tests):>5} {solved:>6} {wrong:>5} "
+              f"{total_time / len(tests):>9.3f} {max_time:>8.3f} "
+              f"{flips / total_time:>10.0f}")
+
+
+def bench_drat(levels: list[str], binary: bool,
+               max_tests: Optional[int]) -> None:
+    """Refute the unsatisfiable tests with the CDCL engine writing a DRAT
+    proof, then check the proof"""
+    print(f"{'level':<14} {'tests':>5} {'checked':>7} {'solve (s)':>10} "
+          f"{'check (s)':>10} {'ratio':>6} {'proof (KiB)':>12}")
+    for level in levels:
+        info = get_level_info(level)
+        tests = [test for test, ref_verdict in info["tests"].items()
+                 if not ref_verdict][:max_tests]
+        if not tests:
+            continue
+
+        checked = 0
+        solve_time, check_time, proof_size = 0.0, 0.0, 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            proofpath = os.path.join(tmpdir, "proof")
+            for test in tests:
+                path = os.path.join(TESTDIR, "in", level, test)
+                phi = parse_formula(path)
+
+                start = time.perf_counter()
+                with open(proofpath, "wb") as fproof:
+                    cdcl.solve(phi, drat.ProofWriter(fproof, binary))
+                solve_time += time.perf_counter() - start
+                proof_size += os.path.getsize(proofpath)
+
+                start = time.perf_counter()
+                if drat.check_proof(phi, proofpath):
+                    checked += 1
+                else:
+                    print(f"Proof of {path} doesn't check!")
+                check_time += time.perf_counter() - start
+
+        print(f"{level:<14} {len(tests):>5} {checked:>7} "
+              f"{solve_time / len(tests):>10.3f} "
+              f"{check_time / len(tests):>10.3f} "
+              f"{check_time / solve_time:>6.2f} "
+              f"{proof_size / len(tests) / 1024:>12.1f}")
+
+
+def bench_cube(levels: list[str], depths: list[int], jobs: list[int],
+               max_tests: Optional[int]) -> None:
+    """Cube-and-conquer with the main binary at every cube depth and number
+    of parallel solvers; the speedup is against the first depth and number
+    of jobs. Unsolved tests count as the level timeout."""
+    subprocess.run(["make", "build"], check=True, capture_output=True)
+    configs = [(depth, njobs) for depth in depths for njobs in jobs]
+    print(f"{'level':<14} {'tests':>5} {'depth':>5} {'jobs':>4} "
+          f"{'solved':>6} {'mean (s)':>9} {'speedup':>8}")
+    for level in levels:
+        info = get_level_info(level)
+        timeout = info["timeout"]
+        tests = list(info["tests"].items())[:max_tests]
+        walls = {config: 0.0 for config in configs}
+        solved = {config: 0 for config in configs}
+        for test, ref_verdict in tests:
+            path = os.path.join(TESTDIR, "in", level, test)
+            phi = parse_formula(path)
+            for depth, njobs in configs:
+                start = time.perf_counter()
+                answer = cube.solve(phi, depth, jobs=njobs, timeout=timeout)
+                elapsed = time.perf_counter() - start
+
+                if answer is not None and answer[0] != ref_verdict:
+                    print(f"Wrong answer for {path}!")
+                if answer is None or answer[0] != ref_verdict:
+                    elapsed = max(elapsed, timeout)
+                else:
+                    solved[depth, njobs] += 1
+                walls[depth, njobs] += elapsed
+
+        for depth, njobs in configs:
+            print(f"{level:<14} {len(tests):>5} {depth:>5} {njobs:>4} "
+                  f"{solved[depth, njobs]:>6} "
+                  f"{walls[depth, njobs] / len(tests):>9.3f} "
+                  f"{walls[configs[0]] / walls[depth, njobs]:>7.2f}x")
+
+
+def main() -> None:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--levels", nargs="+",
+                        help="Levels to benchmark (default: all levels in "
+                             "the tests directory)")
+    common.add_argument("--repeat", type=int, default=3,
+                        help="Runs per measurement, the best one is kept "
+                             "(default: %(default)s)")
+
+    argparser = argparse.ArgumentParser(description="Benchmarks over the "
+                                                    "test levels")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="WARN",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+    subparsers = argparser.add_subparsers(dest="benchmark", required=True)
+    subparsers.add_parser("parse", parents=[common],
+                          help="Bulk DIMACS tokenizer against the "
+                               "line-by-line parser")
+
+    cdclparser = subparsers.add_parser("cdcl", parents=[common],
+                                       help="Check the reference verdicts "
+                                            "with the CDCL engine (too slow "
+                                            "for much of uf200/uuf200 and "
+                                            "up)")
+    cdclparser.add_argument("--max-tests", type=int,
+                            help="Tests per level (default: all)")
+
+    slsparser = subparsers.add_parser("sls", parents=[common],
+                                      help="Find models of the satisfiable "
+                                           "tests by local search")
+    slsparser.add_argument("--algorithm", choices=["probsat", "walksat"],
+                           default="probsat",
+                           help="Variable selection (default: %(default)s)")
+
+    dratparser = subparsers.add_parser("drat", parents=[common],
+                                       help="Check the DRAT proofs of the "
+                                            "CDCL engine on the "
+                                            "unsatisfiable tests")
+    dratparser.add_argument("--binary", action="store_true",
+                            help="Write binary proofs instead of text ones")
+    dratparser.add_argument("--max-tests", type=int,
+                            help="Tests per level (default: all)")
+
+    cubeparser = subparsers.add_parser("cube", parents=[common],
+                                       help="Speedup of cube-and-conquer "
+                                            "against cube depth and number "
+                                            "of parallel solvers")
+    cubeparser.add_argument("--depths", type=int, nargs="+",
+                            default=[0, 2, 4, 6],
+                            help="Cube depths (default: %(default)s)")
+    cubeparser.add_argument("--jobs", type=int, nargs="+",
+                            default=sorted({1, os.cpu_count() or 1}),
+                            help="Numbers of parallel solvers (default: "
+                                 "%(default)s)")
+    cubeparser.add_argument("--max-tests", type=int,
+                            help="Tests per level (default: all)")
+
+    args = argparser.parse_args()
+    helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+    levels = args.levels or get_levels()
+
+    if args.benchmark == "parse":
+        bench_parse(levels, args.repeat)
+    elif args.benchmark == "cdcl":
+        bench_cdcl(levels, args.max_tests)
+    elif args.benchmark == "sls":
+        bench_sls(levels, args.algorithm)
+    elif args.benchmark == "drat":
+        bench_drat(levels, args.binary, args.max_tests)
+    elif args.benchmark == "cube":
+        bench_cube(levels, args.depths, args.jobs, args.max_tests)
+
+
+if __name__ == "__main__":
+    main()
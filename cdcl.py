@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import time
+from typing import Optional
+
+import dimacs_parser
+import drat
+import helpers
+from dimacs_parser import Answer
+from formula import Formula
+
+
+# A reference engine for cross-checking answers, not a trusted oracle for
+# the whole test suite: at a few thousand conflicts per second it settles
+# the levels up to uf175/uuf175 within their timeouts, but from uf200/uuf200
+# up it times out on a growing share of the satisfiable tests and on nearly
+# all the unsatisfiable ones (uuf250-01 takes about a minute), whose
+# reference verdicts it leaves unchecked.
+
+# Literals are encoded as 2 * var + sign, so the negation of a literal is
+# lit ^ 1 and its variable is lit >> 1. Truth values are kept per literal:
+# 1 if true, -1 if false and 0 if unassigned.
+TRUE, FALSE, UNASSIGNED = 1, -1, 0
+
+RESTART_UNIT = 100
+FIRST_REDUCE = 500
+REDUCE_INCREMENT = 300
+VAR_DECAY = 0.95
+CLAUSE_DECAY = 0.999
+RESCALE_LIMIT = 1e100
+# The decision heap holds stale entries; it's rebuilt when it outgrows the
+# number of variables by this factor
+HEAP_SLACK = 8
+# How many conflicts go by between checks of the time limit
+DEADLINE_CHECK = 64
+
+
+def encode(lit: int) -> int:
+    return 2 * lit if lit > 0 else 2 * -lit + 1
+
+
+def luby(i: int) -> int:
+    """i-th element (from 1) of the Luby sequence 1 1 2 1 1 2 4 ..."""
+    size, seq = 1, 0
+    while size < i + 1:
+        seq += 1
+        size = 2 * size + 1
+
+    while size - 1 != i:
+        size = (size - 1) >> 1
+        seq -= 1
+        i %= size
+
+    return 1 << seq
+
+
+class Solver:
+    def __init__(self, phi: Formula,
+                 proof: Optional[drat.ProofWriter] = None) -> None:
+        self.nvars = phi.nvars
+        # Learned clauses are added to the proof and the ones reduce_db drops
+        # are deleted; an unsatisfiable verdict ends it with the empty clause
+        self.proof = proof
+        nlits = 2 * (self.nvars + 1)
+
+        self.value: list[int] = [UNASSIGNED] * nlits
+        self.level: list[int] = [0] * (self.nvars + 1)
+        self.reason: list[Optional[list[int]]] = [None] * (self.nvars + 1)
+        self.watches: list[list[list[int]]] = [[] for _ in range(nlits)]
+        self.trail: list[int] = []
+        self.trail_lim: list[int] = []
+        self.qhead = 0
+
+        self.activity: list[float] = [0.0] * (self.nvars + 1)
+        self.var_inc = 1.0
+        self.heap: list[tuple[float, int]] = [(0.0, v) for v in
+                                              range(1, self.nvars + 1)]
+        # Saved phases, decisions start out negative
+        self.phase: list[int] = [1] * (self.nvars + 1)
+        self.seen: list[bool] = [False] * (self.nvars + 1)
+
+        self.learnts: list[list[int]] = []
+        # LBD and activity of the learned clauses, keyed by id()
+        self.lbd: dict[int, int] = {}
+        self.cla_activity: dict[int, float] = {}
+        self.cla_inc = 1.0
+        self.max_learnts = max(FIRST_REDUCE, phi.nclauses // 3)
+
+        self.conflicts = 0
+        self.decisions = 0
+        self.propagations = 0
+        self.restarts = 0
+
+        self.ok = self.add_clauses(phi)
+
+    def add_clauses(self, phi: Formula) -> bool:
+        for idx in range(phi.nclauses):
+            lits = set(map(encode, phi.clause(idx)))
+            if any(lit ^ 1 in lits for lit in lits):
+                continue  # Tautology
+
+            clause = sorted(lits)
+            if not clause:
+                return False
+
+            if len(clause) == 1:
+                lit = clause[0]
+                if self.value[lit] == FALSE:
+                    return False
+                if self.value[lit] == UNASSIGNED:
+                    self.assign(lit, None)
+                continue
+
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+
+        return self.propagate() is None
+
+    def assign(self, lit: int, reason: Optional[list[int]]) -> None:
+        var = lit >> 1
+        self.value[lit] = TRUE
+        self.value[lit ^ 1] = FALSE
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(lit)
+
+    def propagate(self) -> Optional[list[int]]:
+        """Return the conflicting clause, if any"""
+        value = self.value
+        watches = self.watches
+        trail = self.trail
+        level = self.level
+        reason = self.reason
+        decision_level = len(self.trail_lim)
+
+        while self.qhead < len(trail):
+            false_lit = trail[self.qhead] ^ 1
+            self.qhead += 1
+            self.propagations += 1
+
+            watchers = watches[false_lit]
+            kept = []
+            for pos, clause in enumerate(watchers):
+                # The other watched literal, checked before touching the
+                # clause at all
+                first = clause[0]
+                if first == false_lit:
+                    first = clause[1]
+                if value[first] == TRUE:
+                    kept.append(clause)
+                    continue
+
+                # Keep the false literal in position 1
+                clause[0] = first
+                clause[1] = false_lit
+                for lit in clause[2:]:
+                    if value[lit] != FALSE:
+                        clause[1] = lit
+                        clause[clause.index(lit, 2)] = false_lit
+                        watches[lit].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if value[first] == FALSE:
+                        kept.extend(watchers[pos + 1:])
+                        watches[false_lit] = kept
+                        return clause
+
+                    # Inlined assign()
+                    var = first >> 1
+                    value[first] = TRUE
+                    value[first ^ 1] = FALSE
+                    level[var] = decision_level
+                    reason[var] = clause
+                    trail.append(first)
+
+            watches[false_lit] = kept
+
+        return None
+
+    def bump_var(self, var: int) -> None:
+        self.activity[var] += self.var_inc
+        if self.activity[var] > RESCALE_LIMIT:
+            for v in range(1, self.nvars + 1):
+                self.activity[v] *= 1 / RESCALE_LIMIT
+            self.var_inc *= 1 / RESCALE_LIMIT
+            self.heap = [(-self.activity[v], v)
+                         for v in range(1, self.nvars + 1)
+                         if self.value[2 * v] == UNASSIGNED]
+            heapq.heapify(self.heap)
+        elif self.value[2 * var] == UNASSIGNED:
+            # Stale entries are skipped when popped
+            heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def bump_clause(self, clause: list[int]) -> None:
+        key = id(clause)
+        self.cla_activity[key] += self.cla_inc
+        if self.cla_activity[key] > RESCALE_LIMIT:
+            for key in self.cla_activity:
+                self.cla_activity[key] *= 1 / RESCALE_LIMIT
+            self.cla_inc *= 1 / RESCALE_LIMIT
+
+    def analyze(self, confl: list[int]) -> tuple[list[int], int]:
+        """Return (first UIP clause with the asserting literal first,
+        backjump level)"""
+        seen = self.seen
+        level = self.level
+        trail = self.trail
+        value = self.value
+        activity = self.activity
+        decision_level = len(self.trail_lim)
+
+        learnt = [0]
+        counter = 0
+        lit = -1
+        idx = len(trail) - 1
+        while True:
+            if id(confl) in self.cla_activity:
+                self.bump_clause(confl)
+
+            # The implied literal of a reason clause is in position 0
+            for q in (confl if lit == -1 else confl[1:]):
+                var = q >> 1
+                if not seen[var] and level[var] > 0:
+                    seen[var] = True
+                    # Inlined bump_var(), unless a rescale is due
+                    activity[var] += self.var_inc
+                    if activity[var] > RESCALE_LIMIT:
+                        activity[var] -= self.var_inc
+                        self.bump_var(var)
+                    elif value[q] == UNASSIGNED:
+                        heapq.heappush(self.heap, (-activity[var], var))
+                    if level[var] >= decision_level:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+
+            while not seen[trail[idx] >> 1]:
+                idx -= 1
+            lit = trail[idx]
+            idx -= 1
+            confl = self.reason[lit >> 1]
+            seen[lit >> 1] = False
+            counter -= 1
+            if counter == 0:
+                break
+
+        learnt[0] = lit ^ 1
+
+        # Drop the literals implied by the rest of the clause
+        levels = {level[q >> 1] for q in learnt[1:]}
+        to_clear = [q >> 1 for q in learnt[1:]]
+        minimized = [learnt[0]]
+        for q in learnt[1:]:
+            if self.reason[q >> 1] is None or \
+                    not self.redundant(q, levels, to_clear):
+                minimized.append(q)
+
+        for var in to_clear:
+            seen[var] = False
+
+        if len(minimized) == 1:
+            return minimized, 0
+
+        # The literal with the highest level becomes the second watch
+        best = max(range(1, len(minimized)),
+                   key=lambda i: level[minimized[i] >> 1])
+        minimized[1], minimized[best] = minimized[best], minimized[1]
+        return minimized, level[minimized[1] >> 1]
+
+    def redundant(self, lit: int, levels: set[int],
+                  to_clear: list[int]) -> bool:
+        """Whether lit is implied by the other literals of the learned clause
+        (which are marked as seen), through a chain of reasons"""
+        seen = self.seen
+        level = self.level
+        stack = [lit]
+        marked = len(to_clear)
+        while stack:
+            reason = self.reason[stack.pop() >> 1]
+            assert reason is not None
+            for q in reason[1:]:
+                var = q >> 1
+                if seen[var] or level[var] == 0:
+                    continue
+
+                # Anything outside the clause's levels can't be implied by it
+                if self.reason[var] is None or level[var] not in levels:
+                    for var in to_clear[marked:]:
+                        seen[var] = False
+                    del to_clear[marked:]
+                    return False
+
+                seen[var] = True
+                to_clear.append(var)
+                stack.append(q)
+
+        return True
+
+    def cancel_until(self, target: int) -> None:
+        if len(self.trail_lim) <= target:
+            return
+
+        value = self.value
+        phase = self.phase
+        heap = self.heap
+        activity = self.activity
+        start = self.trail_lim[target]
+        for lit in self.trail[start:]:
+            var = lit >> 1
+            value[lit] = UNASSIGNED
+            value[lit ^ 1] = UNASSIGNED
+            self.reason[var] = None
+            phase[var] = lit & 1
+            heapq.heappush(heap, (-activity[var], var))
+
+        del self.trail[start:]
+        del self.trail_lim[target:]
+        self.qhead = len(self.trail)
+
+        if len(heap) > HEAP_SLACK * self.nvars:
+            self.heap = [(-activity[v], v) for v in range(1, self.nvars + 1)
+                         if value[2 * v] == UNASSIGNED]
+            heapq.heapify(self.heap)
+
+    def pick_branch_lit(self) -> int:
+        heap = self.heap
+        value = self.value
+        while heap:
+            _, var = heapq.heappop(heap)
+            if value[2 * var] == UNASSIGNED:
+                return 2 * var + self.phase[var]
+
+        return -1
+
+    def reduce_db(self) -> None:
+        def locked(clause: list[int]) -> bool:
+            return self.reason[clause[0] >> 1] is clause and \
+                self.value[clause[0]] == TRUE
+
+        # Glue clauses are kept forever, the worse half of the rest goes
+        self.learnts.sort(key=lambda c: (self.lbd[id(c)],
+                                         -self.cla_activity[id(c)]))
+        keep = []
+        removed = set()
+        limit = len(self.learnts) // 2
+        for i, clause in enumerate(self.learnts):
+            if i >= limit and self.lbd[id(clause)] > 2 and not locked(clause):
+                removed.add(id(clause))
+                if self.proof is not None:
+                    self.proof.delete(clause)
+                del self.lbd[id(clause)]
+                del self.cla_activity[id(clause)]
+            else:
+                keep.append(clause)
+
+        self.learnts = keep
+        for lit, watchers in enumerate(self.watches):
+            self.watches[lit] = [c for c in watchers if id(c) not in removed]
+
+    def learn(self, learnt: list[int]) -> None:
+        if self.proof is not None:
+            self.proof.add(learnt)
+
+        if len(learnt) == 1:
+            self.assign(learnt[0], None)
+            return
+
+        levels = {self.level[lit >> 1] for lit in learnt}
+        self.learnts.append(learnt)
+        self.lbd[id(learnt)] = len(levels)
+        self.cla_activity[id(learnt)] = self.cla_inc
+        self.watches[learnt[0]].append(learnt)
+        self.watches[learnt[1]].append(learnt)
+        self.assign(learnt[0], learnt)
+
+    def search(self, nconflicts: int,
+               deadline: Optional[float] = None) -> Optional[bool]:
+        """Return the verdict, or None if nconflicts or the deadline were
+        reached"""
+        conflicts = 0
+        while True:
+            confl = self.propagate()
+            if confl is not None:
+                self.conflicts += 1
+                conflicts += 1
+                if not self.trail_lim:
+                    return False
+
+                if deadline is not None and \
+                        conflicts % DEADLINE_CHECK == 0 and \
+                        time.monotonic() > deadline:
+                    self.cancel_until(0)
+                    return None
+
+                learnt, backjump = self.analyze(confl)
+                self.cancel_until(backjump)
+                self.learn(learnt)
+                self.var_inc /= VAR_DECAY
+                self.cla_inc /= CLAUSE_DECAY
+                continue
+
+            if conflicts >= nconflicts:
+                self.cancel_until(0)
+                return None
+
+            if len(self.learnts) - len(self.trail) >= self.max_learnts:
+                self.reduce_db()
+                self.max_learnts += REDUCE_INCREMENT
+
+            lit = self.pick_branch_lit()
+            if lit == -1:
+                return True
+
+            self.decisions += 1
+            self.trail_lim.append(len(self.trail))
+            self.assign(lit, None)
+
+    def solve(self, max_conflicts: Optional[int] = None,
+              time_limit: Optional[float] = None) -> Optional[Answer]:
+        """Return the answer, or None if max_conflicts or the time limit (in
+        seconds) were reached"""
+        if not self.ok:
+            self.refuted()
+            return (False, None)
+
+        deadline = None
+        if time_limit is not None:
+            deadline = time.monotonic() + time_limit
+
+        while max_conflicts is None or self.conflicts < max_conflicts:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+
+            nconflicts = RESTART_UNIT * luby(self.restarts)
+            if max_conflicts is not None:
+                nconflicts = min(nconflicts, max_conflicts - self.conflicts)
+
+            verdict = self.search(nconflicts, deadline)
+            if verdict is False:
+                self.ok = False
+                self.refuted()
+                return (False, None)
+
+            if verdict:
+                model = {var: self.value[2 * var] == TRUE
+                         for var in range(1, self.nvars + 1)}
+                self.cancel_until(0)
+                return (True, model)
+
+            self.restarts += 1
+
+        return None
+
+    def refuted(self) -> None:
+        if self.proof is not None:
+            self.proof.add([])
+            self.proof = None
+
+
+def solve(phi: Formula, proof: Optional[drat.ProofWriter] = None) -> Answer:
+    answer = Solver(phi, proof).solve()
+    assert answer is not None
+    return answer
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(
+        description="CDCL SAT solver in pure Python, for cross-checking "
+                    "answers; within the level timeouts it only settles the "
+                    "levels up to uf175/uuf175")
+    argparser.add_argument("input", help="Formula in DIMACS format")
+    argparser.add_argument("output", help="Answer file")
+    argparser.add_argument("proof", nargs="?",
+                           help="Write a DRAT proof of unsatisfiability to "
+                                "this file")
+    argparser.add_argument("--binary-proof", action="store_true",
+                           help="Write the proof in binary DRAT")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+
+    args = argparser.parse_args()
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(args.input)
+    phi = parser.parse()
+    assert phi is not None, "No formula was parsed!"
+
+    if args.proof is None:
+        answer = solve(phi)
+    else:
+        with open(args.proof, "wb") as fproof:
+            answer = solve(phi, drat.ProofWriter(fproof, args.binary_proof))
+
+    with open(args.output, "w") as fout:
+        fout.write(dimacs_parser.answer_to_dimacs(answer))
+
+
+if __name__ == "__main__":
+    main()
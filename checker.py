@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import ctypes
+import hashlib
 import json
 import logging
+import math
+import multiprocessing
 import os
+import resource
+import select
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
 import time
+from collections import deque
+from typing import IO, Iterator, Optional
 
 import requests
 
+import dimacs_parser
+import distributed
+import features
 import helpers
-from result import FinalResult, LevelResult, TestResult
+import profiler
+from formula_cache import FormulaCache, hash_file
+from result import FinalResult, LevelResult, TestResult, Usage, inf_if_none
+from result_store import DEFAULT_STOREDIR, ResultStore, all_records
+import stats
 import validate
 
 
@@ -21,6 +40,52 @@ INFOBASENAME = "info.json"
 
 MAX_TESTNAME_WIDTH = 60
 
+DEFAULT_SOLVER = "./main"
+# Set by --solver
+SOLVER = DEFAULT_SOLVER
+# "direct" execs the solver binary and accounts for it in-process, "make"
+# goes through /usr/bin/time, timeout and make run
+LAUNCHER = "direct"
+# Every test is run WARMUP times without being measured, then REPEAT times
+REPEAT = 1
+WARMUP = 0
+# Share of the memory limit a crashed solver must have had resident for the
+# crash to count as running out of memory (the address space the limit
+# applies to is always larger than what is resident)
+MLE_NEAR_LIMIT = 0.5
+# Fewer samples per side than this give no confidence interval for --compare
+MIN_CI_SAMPLES = 2
+# --compare counts times below this as this, user+sys time of short runs
+# often being reported as 0
+TIMER_RESOLUTION = 0.01
+
+# Results of previous runs of the same binary, reused with --resume unless
+# they fall into one of the REMEASURE categories ("tle", "outliers")
+RESULT_STORE: Optional[ResultStore] = None
+RESUME = False
+REMEASURE: set[str] = set()
+# A stored result is an outlier if its samples are spread over more than this
+# fraction of their median, or if it's a single sample this close to the
+# timeout, where noise alone can turn it into a TLE
+OUTLIER_SPREAD = 0.1
+OUTLIER_NEAR_TIMEOUT = 0.9
+
+# With --schedule, tests are ordered by their runtime as predicted from their
+# features and past timings: longest first on a pool, shortest first in
+# sequential competition runs, so a level that is going to be lost is lost
+# sooner
+COST_MODEL: Optional[features.CostModel] = None
+
+# Compressed tests are decompressed once per run into this directory, so the
+# solver always gets plain DIMACS and decompression is never timed
+DECOMPRESS_DIR: Optional[str] = None
+
+# With --proofs, the solver gets a third argument, the path to write a DRAT
+# proof to (the answer path plus PROOF_SUFFIX), and UNSAT answers only count
+# as correct if the proof checks
+PROOFS = False
+PROOF_SUFFIX = ".drat"
+
 # For the assignment
 MAX_SCORE = 90
 POINTS_PER_TEST = 3
@@ -49,21 +114,196 @@ def run_cmd(cmd: list[str]) -> subprocess.CompletedProcess[bytes]:
     return proc
 
 
-def run_solver(inpath: str, outpath: str, timeout: float) -> float:
-    cmd = ["/usr/bin/time", "--format=\"%U,%S\"",
+def run_solver(inpath: str, outpath: str, timeout: float,
+               solver: Optional[str] = None,
+               memory_limit: Optional[int] = None
+               ) -> tuple[float, Usage, bool]:
+    """Return (user + sys time or inf for a TLE, resource usage, whether the
+    memory limit in KiB was exceeded); the solver defaults to SOLVER"""
+    proofpath = proof_path(outpath)
+    if proofpath is not None and os.path.exists(proofpath):
+        os.remove(proofpath)  # Never check the proof of a previous run
+    if os.path.exists(outpath):
+        os.remove(outpath)  # Nor its answer
+
+    if LAUNCHER == "make":
+        return run_solver_make(inpath, outpath, timeout, memory_limit)
+
+    return run_solver_direct(inpath, outpath, timeout, solver or SOLVER,
+                             memory_limit)
+
+
+def proof_path(outpath: str) -> Optional[str]:
+    return outpath + PROOF_SUFFIX if PROOFS else None
+
+
+def memory_exceeded(inpath: str, usage: Usage,
+                    memory_limit: Optional[int]) -> bool:
+    if memory_limit is None or usage.maxrss <= memory_limit:
+        return False
+
+    logger.info(f"Memory limit ({memory_limit} KiB) exceeded for "
+                f"'{inpath}'!")
+    return True
+
+
+def run_solver_make(inpath: str, outpath: str, timeout: float,
+                    memory_limit: Optional[int] = None
+                    ) -> tuple[float, Usage, bool]:
+    cmd = ["/usr/bin/time", "--format=\"%U,%S,%M,%F,%R,%w,%c\"",
            "timeout", "--signal=KILL", f"{timeout:.3f}",
            "make", "run", f"INPUT={inpath}", f"OUTPUT={outpath}"]
+    if PROOFS:
+        cmd.append(f"PROOF={proof_path(outpath)}")
 
     proc = run_cmd(cmd)
 
+    time_line = proc.stderr.decode("utf-8").splitlines()[-1]
+    utime, stime, *counters = time_line.strip("\"").split(",")
+    usage = Usage(*map(int, counters))
+    profiler.count("cpu", float(utime) + float(stime))
     if proc.returncode == 137:  # timeout sent KILL
         logger.info(f"Time limit ({timeout} s) exceeded for '{inpath}'!")
         time = float("inf")
     else:
-        time_line = proc.stderr.decode("utf-8").splitlines()[-1]
-        time = sum(map(float, time_line.strip("\"").split(",")))
+        time = float(utime) + float(stime)
+
+    # Make can't be given the limit without applying it to itself too, so
+    # it's only checked after the fact here
+    return time, usage, memory_exceeded(inpath, usage, memory_limit)
 
-    return time
+
+def limit_cpu_time(timeout: float) -> None:
+    # Backstop for the wall clock limit below, in case the harness itself
+    # gets stuck; the kernel kills the solver once it burns this much CPU.
+    seconds = math.ceil(timeout) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds))
+
+
+PR_SET_CHILD_SUBREAPER = 36
+subreaper = False
+
+
+def become_subreaper() -> None:
+    global subreaper
+    if subreaper:
+        return
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) != 0:
+        errno = ctypes.get_errno()
+        logger.error(f"Cannot become a subreaper: {os.strerror(errno)}!")
+        sys.exit(1)
+    subreaper = True
+
+
+def spawn_solver(cmd: list[str], ferr: IO[bytes], timeout: float,
+                 memory_limit: Optional[int]) -> tuple[int, int]:
+    """Start the solver, which ends up as our child, and return its PID and
+    a pidfd for it.
+
+    A child inherits the peak RSS of the process it was forked from, and
+    exec doesn't reset it, so forking the solver from here would put the
+    size of the harness into its ru_maxrss. Instead a shell forks it in the
+    background and exits, and the solver gets reparented to us. It's held on
+    a pipe until then, since the shell reaps whatever exits before it does."""
+    become_subreaper()
+    gate_r, gate_w = os.pipe()
+    limits = ""
+    # Allocations past the limit fail (RLIMIT_AS), instead of the OOM killer
+    # stepping in once the whole machine is short on memory
+    if memory_limit is not None:
+        limits = f"ulimit -v {memory_limit}; "
+    # The gate comes in as stdin (dash only takes single digit fds) and is
+    # kept as fd 3 by the background job, whose stdin is /dev/null
+    script = f'exec 3<&0; {{ read _ <&3; {limits}exec "$@" 3<&-; }} ' \
+             '>/dev/null & echo $!'
+
+    try:
+        proc = subprocess.Popen(["/bin/sh", "-c", script, "sh", *cmd],
+                                stdin=gate_r, stdout=subprocess.PIPE,
+                                stderr=ferr,
+                                preexec_fn=lambda: limit_cpu_time(timeout))
+        os.close(gate_r)
+        out, _ = proc.communicate()
+        pid = int(out)
+        pidfd = os.pidfd_open(pid)
+    finally:
+        os.close(gate_w)
+
+    return pid, pidfd
+
+
+def run_solver_direct(inpath: str, outpath: str, timeout: float,
+                      solver: str, memory_limit: Optional[int] = None
+                      ) -> tuple[float, Usage, bool]:
+    cmd = [solver, inpath, outpath]
+    if PROOFS:
+        cmd.append(outpath + PROOF_SUFFIX)
+    cmdstr = " ".join(cmd)
+    logger.debug(f"Running command:\n\t{cmdstr}")
+    if not os.access(solver, os.X_OK):
+        logger.error(f"Solver {solver} is not an executable!")
+        sys.exit(1)
+
+    with tempfile.TemporaryFile() as ferr:
+        try:
+            pid, pidfd = spawn_solver(cmd, ferr, timeout, memory_limit)
+        except Exception as e:
+            estr = helpers.format_exception(e)
+            logger.error(f"Error while running:\n{estr}")
+            sys.exit(1)
+
+        # Wait on a pidfd, so the solver is reaped by wait4 (which hands us
+        # its rusage) and no one else.
+        try:
+            ready, _, _ = select.select([pidfd], [], [], timeout)
+            if not ready:
+                os.kill(pid, signal.SIGKILL)
+        finally:
+            os.close(pidfd)
+
+        _, status, rusage = os.wait4(pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+
+        ferr.seek(0)
+        logger.debug(f"STDERR:\n{ferr.read().decode('utf-8')}")
+
+    usage = Usage.from_rusage(rusage)
+    # Also known for runs that time out, unlike the time returned
+    profiler.count("cpu", rusage.ru_utime + rusage.ru_stime)
+    killed = returncode in (-signal.SIGKILL, -signal.SIGXCPU)
+    if not ready or killed:
+        logger.info(f"Time limit ({timeout} s) exceeded for '{inpath}'!")
+        return float("inf"), usage, False
+
+    time = rusage.ru_utime + rusage.ru_stime
+    # Under RLIMIT_AS the solver sees the limit as a failed allocation, on
+    # which it crashes or bails out. Other crashes stay failures: it only
+    # counts if the solver got near the limit.
+    if returncode != 0 and memory_limit is not None and \
+            usage.maxrss >= MLE_NEAR_LIMIT * memory_limit:
+        logger.info(f"Memory limit ({memory_limit} KiB) exceeded for "
+                    f"'{inpath}' (exit code {returncode})!")
+        return time, usage, True
+
+    if returncode != 0 and memory_limit is not None:
+        # Far from the limit in RSS, but that says little about the address
+        # space (e.g. of an interpreter), so this isn't worth aborting the
+        # run over: the test fails with no answer
+        logger.info(f"Command:\n    {cmdstr}\nfailed with code "
+                    f"{returncode} under a memory limit of {memory_limit} "
+                    "KiB!")
+        if os.path.exists(outpath):
+            os.remove(outpath)  # Whatever it got to write isn't an answer
+        return time, usage, False
+
+    if returncode != 0:
+        logger.error(f"Command:\n    {cmdstr}\nfailed with code "
+                     f"{returncode}!")
+        sys.exit(1)
+
+    return time, usage, memory_exceeded(inpath, usage, memory_limit)
 
 
 def get_level_info(testsubdir: str) -> dict:
@@ -83,42 +323,424 @@ def get_level_info(testsubdir: str) -> dict:
     return info
 
 
-def evaluate_level(testsubdir: str, competition: bool) -> LevelResult:
-    info = get_level_info(testsubdir)
+def get_memory_limit(info: dict) -> Optional[int]:
+    """Return the level's memory limit in KiB (given in MiB in the info
+    file), if it has one"""
+    if "memory_limit" not in info:
+        return None
+
+    return int(info["memory_limit"] * 1024)
+
+
+def pin_worker(cpus: multiprocessing.Queue) -> None:
+    # Every worker grabs its own CPU, so concurrent tests don't steal cycles
+    # from each other and the timings stay comparable to a sequential run.
+    cpu = cpus.get()
+    os.sched_setaffinity(0, {cpu})
+
+
+def make_pool(jobs: int, available: Optional[list[int]] = None
+              ) -> concurrent.futures.ProcessPoolExecutor:
+    available = available or sorted(os.sched_getaffinity(0))
+    if jobs > len(available):
+        logger.warning(f"Only {len(available)} CPUs available, {jobs} workers "
+                       "will share them!")
+
+    cpus: multiprocessing.Queue = multiprocessing.Queue()
+    for i in range(jobs):
+        cpus.put(available[i % len(available)])
+
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                  initializer=pin_worker,
+                                                  initargs=(cpus,))
+
+
+def make_validation_pool(jobs: int) -> concurrent.futures.ProcessPoolExecutor:
+    """Workers validating answers while the solver runs the next test; the
+    checker (and so the solver) is pinned to the first CPU, the workers get
+    the rest"""
+    available = sorted(os.sched_getaffinity(0))
+    if len(available) == 1:
+        logger.warning("Only 1 CPU available, validation will share it with "
+                       "the solver!")
+        return make_pool(jobs, available)
+
+    os.sched_setaffinity(0, available[:1])
+    return make_pool(jobs, available[1:])
+
+
+def solver_input(inpath: str) -> str:
+    """Path of the plain DIMACS version of the test"""
+    if DECOMPRESS_DIR is None or \
+            dimacs_parser.compression_opener(inpath) is None:
+        return inpath
+
+    key = hashlib.sha256(os.path.abspath(inpath).encode()).hexdigest()
+    path = os.path.join(DECOMPRESS_DIR, key)
+    if os.path.exists(path):
+        return path
+
+    # Written under a temporary name, in case another worker gets the same
+    # test at the same time
+    fd, tmppath = tempfile.mkstemp(dir=DECOMPRESS_DIR)
+    with os.fdopen(fd, "wb") as fout, \
+            dimacs_parser.open_binary(inpath) as fin:
+        shutil.copyfileobj(fin, fout, dimacs_parser.CHUNK_SIZE)
+    os.replace(tmppath, path)
+    return path
+
+
+def measure(inpath: str, outpath: str, timeout: float,
+            solver: Optional[str] = None, memory_limit: Optional[int] = None
+            ) -> tuple[list[float], Usage, bool]:
+    for _ in range(WARMUP):
+        run_solver(inpath, outpath, timeout, solver, memory_limit)
+
+    samples = []
+    peak = Usage()
+    mle = False
+    for _ in range(REPEAT):
+        time, usage, mle = run_solver(inpath, outpath, timeout, solver,
+                                      memory_limit)
+        samples.append(time)
+        peak = peak.merge(usage)
+        if time > timeout or mle:  # No point in running out again
+            break
+
+    return samples, peak, mle
+
+
+def make_result(name: str, inpath: str, outpath: str, timeout: float,
+                ref_verdict: bool, samples: list[float], usage: Usage,
+                mle: bool) -> TestResult:
+    if samples[-1] > timeout or mle:
+        time = samples[-1]
+        verdict, valid = False, False  # irrelevant, actually
+    elif not os.path.exists(outpath):  # The solver failed
+        logger.info(f"No answer given for '{inpath}'!")
+        time = stats.median(samples)
+        verdict, valid = False, False
+    else:
+        time = stats.median(samples)
+        with profiler.span("validate", test=name):
+            verdict, valid = validate.validate(inpath, outpath, ref_verdict,
+                                               proof_path(outpath))
+
+    profiler.checkpoint()
+    return TestResult(time, timeout, verdict, ref_verdict, valid, samples,
+                      name, usage, mle)
+
+
+def prepare_and_measure(name: str, inpath: str, outpath: str, timeout: float,
+                        memory_limit: Optional[int] = None
+                        ) -> tuple[str, list[float], Usage, bool]:
+    """Return the path the solver got, followed by what measure returns"""
+    with profiler.span("decompress", test=name):
+        inpath = solver_input(inpath)
+    with profiler.span("solve", test=name):
+        samples, usage, mle = measure(inpath, outpath, timeout,
+                                      memory_limit=memory_limit)
+
+    return inpath, samples, usage, mle
+
+
+def run_test(name: str, inpath: str, outpath: str, timeout: float,
+             ref_verdict: bool,
+             memory_limit: Optional[int] = None) -> TestResult:
+    inpath, samples, usage, mle = prepare_and_measure(name, inpath, outpath,
+                                                      timeout, memory_limit)
+    return make_result(name, inpath, outpath, timeout, ref_verdict, samples,
+                       usage, mle)
+
+
+def is_outlier(result: TestResult) -> bool:
+    if result.tle:
+        return False
+    if len(result.samples) > 1:
+        return stats.iqr(result.samples) > OUTLIER_SPREAD * result.time
+
+    return result.time > OUTLIER_NEAR_TIMEOUT * result.timeout
+
+
+def stored_result(name: str, test_hash: str, timeout: float,
+                  ref_verdict: bool,
+                  memory_limit: Optional[int] = None) -> Optional[TestResult]:
+    """Return the stored result of the test if it can be reused as is"""
+    if RESULT_STORE is None or not RESUME:
+        return None
+
+    result = RESULT_STORE.get(test_hash, timeout, memory_limit)
+    if result is None or result.ref_verdict != ref_verdict:
+        return None
+    if result.tle and "tle" in REMEASURE:
+        return None
+    if "outliers" in REMEASURE and is_outlier(result):
+        return None
+    # Measured with fewer repetitions than asked for now
+    if not result.tle and len(result.samples) < REPEAT:
+        return None
+
+    result.name = name
+    return result
+
+
+def get_level_tests(testsubdir: str,
+                    info: dict) -> list[tuple[str, str, str, bool]]:
     testsubdirpath = os.path.join(TESTDIR, "in", testsubdir)
-    level_result = LevelResult()
-    timeout = info["timeout"]
+    out_subdir = os.path.join(TESTDIR, "out", testsubdir)
+    os.makedirs(out_subdir, exist_ok=True)
+
+    tests = []
     for test, ref_verdict in info["tests"].items():
         stem = os.path.splitext(test)[0]
         answerfile = f"{stem}.answer"
-        out_subdir = os.path.join(TESTDIR, "out", testsubdir)
-        os.makedirs(out_subdir, exist_ok=True)
         inpath = os.path.join(testsubdirpath, test)
         outpath = os.path.join(out_subdir, answerfile)
+        tests.append((test, inpath, outpath, ref_verdict))
+
+    return tests
+
+
+def completed(result: TestResult) -> concurrent.futures.Future:
+    future: concurrent.futures.Future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
 
-        time = run_solver(inpath, outpath, timeout)
-        if time > timeout:
-            verdict, valid = False, False  # irrelevant, actually
-        else:
-            verdict, valid = validate.validate(inpath, outpath, ref_verdict)
 
-        result = TestResult(time, timeout, verdict, ref_verdict, valid)
+def expected_cost(entry: Optional[dict], timeout: float,
+                  memory_limit: Optional[int] = None) -> float:
+    """The test's own timing with this binary if there is one, else the
+    prediction from its features"""
+    assert COST_MODEL is not None
+    if entry is None:  # Unparsable, so it's rejected right away
+        return 0.0
+
+    # Unfitted predictions aren't in seconds
+    if COST_MODEL.weights is not None and RESULT_STORE is not None:
+        stored = RESULT_STORE.get(entry["hash"], timeout, memory_limit)
+        if stored is not None:
+            return stored.time
+
+    return COST_MODEL.predict(entry["features"])
+
+
+def fit_cost_model(competition: bool, storedir: Optional[str]
+                   ) -> features.CostModel:
+    """Cost model fitted on the stored timings of every binary so far"""
+    model = features.CostModel()
+    if storedir is None:
+        return model
+
+    by_hash = {entry["hash"]: entry["features"]
+               for level in get_levels(competition)
+               for entry in features.level_features(level).values()}
+    # TLEs only tell that the test takes at least the timeout
+    samples = [(by_hash[record["test_hash"]],
+                min(inf_if_none(record["time"]), record["timeout"]))
+               for record in all_records(storedir)
+               if record["test_hash"] in by_hash]
+    model.fit(samples)
+    if model.weights is None:
+        logger.info(f"Only {len(samples)} past timings, scheduling by "
+                    "formula size")
+
+    return model
+
+
+class LevelRun:
+    """The tests of a level, all submitted to the pool (if any) up front"""
+
+    def __init__(self, testsubdir: str,
+                 pool: Optional[concurrent.futures.Executor] = None,
+                 validator: Optional[concurrent.futures.Executor] = None,
+                 selected: Optional[set[str]] = None,
+                 competition: bool = False) -> None:
+        self.testsubdir = testsubdir
+        self.started = profiler.now()
+        self.validator = validator
+        self.validations: list[concurrent.futures.Future] = []
+        self.info = get_level_info(testsubdir)
+        self.tests = get_level_tests(testsubdir, self.info)
+        self.timeout = self.info["timeout"]
+        self.memory_limit = get_memory_limit(self.info)
+
+        # Only the tests of this host's shard, if the run is split
+        if selected is not None:
+            self.tests = [test for test in self.tests
+                          if f"{testsubdir}/{test[0]}" in selected]
+
+        self.costs: Optional[list[float]] = None
+        if COST_MODEL is not None:
+            with profiler.span("features", level=testsubdir):
+                index = features.level_features(testsubdir)
+            self.costs = [expected_cost(index.get(test), self.timeout,
+                                        self.memory_limit)
+                          for test, *_ in self.tests]
+            # Only a run that stops at the first lost level gains from it
+            if competition and pool is None:
+                order = sorted(range(len(self.tests)),
+                               key=self.costs.__getitem__)
+                self.tests = [self.tests[i] for i in order]
+                self.costs = [self.costs[i] for i in order]
+        self.names = [f"{testsubdir}/{test}" for test, *_ in self.tests]
+        with profiler.span("hash", level=testsubdir):
+            self.hashes = [hash_file(inpath).hex()
+                           if RESULT_STORE is not None else ""
+                           for _, inpath, _, _ in self.tests]
+        self.stored = [stored_result(name, test_hash, self.timeout,
+                                     ref_verdict, self.memory_limit)
+                       for name, test_hash, (_, _, _, ref_verdict)
+                       in zip(self.names, self.hashes, self.tests)]
+        if RESUME:
+            logger.info(f"Reusing {sum(r is not None for r in self.stored)}/"
+                        f"{len(self.tests)} stored results for {testsubdir}")
+
+        self.futures: list[Optional[concurrent.futures.Future]] = \
+            [None] * len(self.tests)
+        if pool is not None:
+            order = list(range(len(self.tests)))
+            if self.costs is not None:
+                order.sort(key=self.costs.__getitem__, reverse=True)
+            for i in order:
+                _, inpath, outpath, ref_verdict = self.tests[i]
+                if self.stored[i] is None:
+                    self.futures[i] = pool.submit(run_test, self.names[i],
+                                                  inpath, outpath,
+                                                  self.timeout, ref_verdict,
+                                                  self.memory_limit)
+
+    def results(self) -> Iterator[TestResult]:
+        """Results in the test order, so a parallel run stops at (and
+        reports) exactly the same test an unscheduled sequential one would; a
+        scheduled sequential competition run goes cheapest first, so it may
+        stop at a different one"""
+        if self.validator is not None:
+            yield from self.pipelined_results()
+            return
+
+        for name, test_hash, result, future, (_, inpath, outpath,
+                                              ref_verdict) \
+                in zip(self.names, self.hashes, self.stored, self.futures,
+                       self.tests):
+            if result is not None:
+                yield result
+                continue
+
+            if future is not None:
+                result = future.result()
+            else:
+                result = run_test(name, inpath, outpath, self.timeout,
+                                  ref_verdict, self.memory_limit)
+            if RESULT_STORE is not None:
+                with profiler.span("store", test=name):
+                    RESULT_STORE.put(test_hash, result, self.memory_limit)
+            yield result
+
+    def pipelined_results(self) -> Iterator[TestResult]:
+        """Same as results, but the solver runs one test after the other
+        while the answers are validated in the background. Results are
+        handed out, in order, between solver runs, waiting on a validation
+        rather than letting it fall more than one test behind: a wrong answer
+        is noticed at the latest one test after it was given."""
+        assert self.validator is not None
+        # Test hash (None for stored results) and result to come
+        pending: deque[tuple[Optional[str], concurrent.futures.Future]] = \
+            deque()
+        for name, test_hash, result, (_, inpath, outpath, ref_verdict) \
+                in zip(self.names, self.hashes, self.stored, self.tests):
+            if result is not None:
+                pending.append((None, completed(result)))
+            else:
+                pending.append((test_hash, self.run_and_validate(
+                    name, inpath, outpath, ref_verdict)))
+
+            while pending and (pending[0][1].done() or len(pending) > 1):
+                yield self.record(*pending.popleft())
+
+        while pending:
+            yield self.record(*pending.popleft())
+
+    def run_and_validate(self, name: str, inpath: str, outpath: str,
+                         ref_verdict: bool) -> concurrent.futures.Future:
+        assert self.validator is not None
+        inpath, samples, usage, mle = prepare_and_measure(
+            name, inpath, outpath, self.timeout, self.memory_limit)
+        if samples[-1] > self.timeout or mle:  # Nothing to validate
+            return completed(make_result(name, inpath, outpath, self.timeout,
+                                         ref_verdict, samples, usage, mle))
+
+        future = self.validator.submit(make_result, name, inpath, outpath,
+                                       self.timeout, ref_verdict, samples,
+                                       usage, mle)
+        self.validations.append(future)
+        return future
+
+    def record(self, test_hash: Optional[str],
+               future: concurrent.futures.Future) -> TestResult:
+        result = future.result()
+        if RESULT_STORE is not None and test_hash is not None:
+            with profiler.span("store", test=result.name):
+                RESULT_STORE.put(test_hash, result, self.memory_limit)
+        return result
+
+    def cancel(self) -> None:
+        # Tests already running finish in the background; their results are
+        # never looked at
+        for future in self.futures + self.validations:
+            if future is not None:
+                future.cancel()
+
+
+def collect_level(run: LevelRun, competition: bool) -> LevelResult:
+    level_result = LevelResult()
+    allowed = run.info.get("timeouts_allowed", 0)
+    for (test, *_), result in zip(run.tests, run.results()):
         level_result.update(result)
+        # Running out of memory counts against the same allowance as timing
+        # out
+        if level_result.tles + level_result.mles > allowed:
+            level_result.passed = False
+
         if not competition:
             prefix = f"Running {test}"
             ndots = MAX_TESTNAME_WIDTH - len(prefix)
             dots = "." * ndots
             print(f"{prefix}  {dots}  {result}")
-        elif not level_result.passed:
+        elif not level_result.passed or not level_result.valid:
+            # The level is lost, no need to wait for the rest of it
+            run.cancel()
             return level_result
 
-    if level_result.tles > info.get("timeouts_allowed", 0):
-        level_result.passed = False
-
     return level_result
 
 
-def check(competition) -> FinalResult:
+class MergedLevel:
+    """A level whose results were all measured elsewhere (by shards or
+    workers), to go through collect_level just like a local run"""
+
+    def __init__(self, testsubdir: str,
+                 results: dict[str, TestResult]) -> None:
+        self.info = get_level_info(testsubdir)
+        self.tests = [(test,) for test in self.info["tests"]]
+        self.names = [f"{testsubdir}/{test}" for test in self.info["tests"]]
+        self.all_results = results
+
+    def results(self) -> Iterator[TestResult]:
+        for name in self.names:
+            yield self.all_results[name]
+
+    def cancel(self) -> None:
+        pass
+
+
+def evaluate_level(testsubdir: str, competition: bool,
+                   pool: Optional[concurrent.futures.Executor] = None
+                   ) -> LevelResult:
+    return collect_level(LevelRun(testsubdir, pool, competition=competition),
+                         competition)
+
+
+def get_levels(competition: bool) -> list[str]:
     testspath = os.path.join(TESTDIR, "in")
     infopath = os.path.join(testspath, INFOBASENAME)
     try:
@@ -128,32 +750,352 @@ def check(competition) -> FinalResult:
         logger.error(f"Missing info file ({infopath}) in tests directory!")
         sys.exit(1)
 
-    final_result = FinalResult()
     if competition:
-        levels = info["levels"]
+        return info["levels"]
     else:
-        levels = [info["levels"][0]]
+        return [info["levels"][0]]
+
+
+def level_stops(level_result: LevelResult, competition: bool) -> bool:
+    """Whether the evaluation ends with this level"""
+    if not competition:
+        return False
+
+    if not level_result.valid:
+        logger.info("Model is disqualified for giving the wrong answer!")
+        return True
+
+    if not level_result.passed:
+        logger.info(f"Too many timeouts ({level_result.tles}) or memory "
+                    f"limit overruns ({level_result.mles})! Evaluation "
+                    "stopped!")
+        return True
+
+    return False
+
+
+def check(competition: bool, jobs: int = 1, speculate: bool = False,
+          validation_jobs: int = 0,
+          selected: Optional[set[str]] = None) -> FinalResult:
+    """Evaluate the solver; a shard (selected tests only) runs all of its
+    tests, since the competition rules can only be applied on the merged
+    results"""
+    final_result = FinalResult()
+    levels = get_levels(competition)
+    stop_early = competition and selected is None
+
+    affinity = os.sched_getaffinity(0)
+    pool = make_pool(jobs) if jobs > 1 else None
+    validator = make_validation_pool(validation_jobs) \
+        if validation_jobs > 0 else None
+    try:
+        run = LevelRun(levels[0], pool, validator, selected, stop_early)
+        for i, level in enumerate(levels):
+            # The pool runs tests in submission order, so the next level only
+            # gets the workers this one has no more tests for
+            next_run = None
+            if speculate and i + 1 < len(levels):
+                next_run = LevelRun(levels[i + 1], pool, validator, selected,
+                                    stop_early)
+
+            level_result = collect_level(run, stop_early)
+            profiler.complete("level", run.started, profiler.LEVEL,
+                              level=level, slots=min(jobs, len(affinity)))
+            profiler.snapshot(level)
+            final_result.batch_update(level_result.test_results)
+            final_result.level_reached += 1
+            if stop_early and level_stops(level_result, competition):
+                if next_run is not None:
+                    next_run.cancel()
+                return final_result
+
+            if i + 1 < len(levels):
+                run = next_run or LevelRun(levels[i + 1], pool, validator,
+                                           selected, stop_early)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if validator is not None:
+            validator.shutdown(cancel_futures=True)
+            os.sched_setaffinity(0, affinity)
+
+    return final_result
+
+
+def run_all(competition: bool, jobs: int = 1,
+            storedir: Optional[str] = None,
+            speculate: bool = False, validation_jobs: int = 0,
+            selected: Optional[set[str]] = None) -> FinalResult:
+    with profiler.span("build"):
+        run_cmd(["make", "build"])
+
+    # Keyed by the freshly built binary, so a rebuild that changes nothing
+    # keeps its results
+    global RESULT_STORE
+    if storedir is not None:
+        RESULT_STORE = ResultStore(SOLVER, storedir, PROOFS)
+    try:
+        final_result = check(competition, jobs, speculate, validation_jobs,
+                             selected)
+    finally:
+        if RESULT_STORE is not None:
+            RESULT_STORE.close()
+
+    return final_result
+
+
+def get_tasks(competition: bool) -> list[distributed.Task]:
+    """Every test of the run, as arguments of run_test"""
+    tasks = []
+    for level in get_levels(competition):
+        info = get_level_info(level)
+        memory_limit = get_memory_limit(info)
+        for test, inpath, outpath, ref_verdict in get_level_tests(level, info):
+            tasks.append({"name": f"{level}/{test}", "inpath": inpath,
+                          "outpath": outpath, "timeout": info["timeout"],
+                          "ref_verdict": ref_verdict,
+                          "memory_limit": memory_limit})
 
-    for level in levels:
-        level_result = evaluate_level(level, competition)
+    return tasks
+
+
+def select_shard(tasks: list[distributed.Task], shard: int,
+                 nshards: int) -> list[distributed.Task]:
+    """The tests of shard (counting from 1) out of nshards. Tests are dealt
+    out largest first, each to the shard with the least work so far, the
+    cost of a test being the size of its input (the same on every host) in
+    timeouts' worth"""
+    def cost(task: distributed.Task) -> tuple[float, str]:
+        return os.path.getsize(task["inpath"]) * task["timeout"], task["name"]
+
+    loads = [0.0] * nshards
+    selected = []
+    for task in sorted(tasks, key=lambda task: (-cost(task)[0], task["name"])):
+        target = loads.index(min(loads))
+        loads[target] += cost(task)[0]
+        if target == shard - 1:
+            selected.append(task)
+
+    return selected
+
+
+def parse_shard(spec: str) -> Optional[tuple[int, int]]:
+    try:
+        shard, nshards = map(int, spec.split("/"))
+    except ValueError:
+        return None
+
+    if not 1 <= shard <= nshards:
+        return None
+
+    return shard, nshards
+
+
+def replay(competition: bool, results: dict[str, TestResult]) -> FinalResult:
+    """The result a single host would have reached with these test results"""
+    final_result = FinalResult()
+    for level in get_levels(competition):
+        level_result = collect_level(MergedLevel(level, results), competition)
         final_result.batch_update(level_result.test_results)
         final_result.level_reached += 1
-        if competition and not level_result.valid:
-            logger.info("Model is disqualified for giving the wrong answer!")
-            return final_result
+        if level_stops(level_result, competition):
+            break
+
+    return final_result
+
 
-        if competition and not level_result.passed:
-            logger.info(f"Too many timeouts ({level_result.tles})! Evaluation "
-                        "stopped!")
-            return final_result
+def merge(competition: bool, paths: list[str]) -> FinalResult:
+    """Combine the --json exports of the shards of a run"""
+    results = {}
+    for path in paths:
+        with open(path) as fin:
+            for record in json.load(fin)["tests"]:
+                result = TestResult.fromJSON(record)
+                if result.name in results:
+                    logger.warning(f"{result.name} is in more than one "
+                                   f"shard, keeping the result from {path}")
+                results[result.name] = result
 
+    missing = [task["name"] for task in get_tasks(competition)
+               if task["name"] not in results]
+    if missing:
+        logger.error(f"No result for {len(missing)} tests, e.g. "
+                     f"{missing[0]}! Are all the shards there?")
+        sys.exit(1)
+
+    return replay(competition, results)
+
+
+def serve(competition: bool, address: tuple[str, int],
+          selected: Optional[set[str]] = None) -> FinalResult:
+    """Have the workers that connect run the tests; a shard's results are
+    left for merge, like those of a local shard run"""
+    tasks = [task for task in get_tasks(competition)
+             if selected is None or task["name"] in selected]
+    if COST_MODEL is not None:
+        # Longest expected first, as on a local pool
+        indexes = {level: features.level_features(level)
+                   for level in get_levels(competition)}
+
+        def cost(task: distributed.Task) -> float:
+            level, test = task["name"].split("/", 1)
+            return expected_cost(indexes[level].get(test), task["timeout"])
+
+        tasks.sort(key=cost, reverse=True)
+    results = distributed.Coordinator(address, tasks).run()
+    if selected is None:
+        return replay(competition, results)
+
+    final_result = FinalResult()
+    final_result.batch_update([results[task["name"]] for task in tasks])
     return final_result
 
 
-def run_all(competition: bool) -> FinalResult:
+def work(address: tuple[str, int]) -> None:
     run_cmd(["make", "build"])
-    final_result = check(competition)
-    return final_result
+    ran = distributed.work(address, run_test)
+    logger.info(f"Ran {ran} tests")
+
+
+def prepare_solver(spec: str, workdir: str, worktrees: list[str]) -> str:
+    """Return the path of the solver binary given either as a path or as a
+    git revision, which gets checked out (into worktrees, as soon as it
+    exists) and built inside workdir"""
+    if os.path.isfile(spec):
+        return os.path.abspath(spec)
+
+    builddir = os.path.join(workdir, spec.replace("/", "_"))
+    run_cmd(["git", "worktree", "add", "--detach", builddir, spec])
+    worktrees.append(builddir)
+    run_cmd(["make", "-C", builddir, "build"])
+    return os.path.join(builddir, "main")
+
+
+def compare_test(name: str, inpath: str, outdir: str, timeout: float,
+                 ref_verdict: bool, solvers: tuple[str, str],
+                 memory_limit: Optional[int] = None
+                 ) -> tuple[TestResult, TestResult]:
+    outpaths = [os.path.join(outdir, f"{name.replace('/', '_')}.{side}")
+                for side in ("a", "b")]
+    inpath = solver_input(inpath)
+    for _ in range(WARMUP):
+        for solver, outpath in zip(solvers, outpaths):
+            run_solver(inpath, outpath, timeout, solver, memory_limit)
+
+    # Runs are interleaved, alternating which solver goes first, so that
+    # drift in the machine's load hits both of them alike
+    samples: list[list[float]] = [[], []]
+    usages = [Usage(), Usage()]
+    mles = [False, False]
+    for i in range(REPEAT):
+        order = (0, 1) if i % 2 == 0 else (1, 0)
+        for side in order:
+            if mles[side] or samples[side] and samples[side][-1] > timeout:
+                continue
+            time, usage, mles[side] = run_solver(inpath, outpaths[side],
+                                                 timeout, solvers[side],
+                                                 memory_limit)
+            samples[side].append(time)
+            usages[side] = usages[side].merge(usage)
+
+    results = tuple(make_result(name, inpath, outpath, timeout, ref_verdict,
+                                side_samples, usage, mle)
+                    for outpath, side_samples, usage, mle
+                    in zip(outpaths, samples, usages, mles))
+    return results[0], results[1]
+
+
+def comparison_record(a: TestResult, b: TestResult) -> dict:
+    record = {"name": a.name, "a": a.toJSON(), "b": b.toJSON()}
+    if not a.correct or not b.correct:
+        return record
+
+    record["speedup"] = stats.ratio(max(a.time, TIMER_RESOLUTION),
+                                    max(b.time, TIMER_RESOLUTION))
+    if min(len(a.samples), len(b.samples)) < MIN_CI_SAMPLES:
+        return record
+
+    lo, hi = stats.bootstrap_ratio_ci(
+        [max(time, TIMER_RESOLUTION) for time in a.samples],
+        [max(time, TIMER_RESOLUTION) for time in b.samples])
+    record["ci"] = [lo, hi]
+    # The interval has to exclude "no change" for the speedup to count
+    record["significant"] = lo > 1 or hi < 1
+    return record
+
+
+def compare(competition: bool, specs: tuple[str, str],
+            jobs: int = 1) -> list[dict]:
+    """Time two solvers (binaries or git revisions) on the same tests"""
+    records = []
+    worktrees: list[str] = []
+    pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            solvers = (prepare_solver(specs[0], os.path.join(workdir, "a"),
+                                      worktrees),
+                       prepare_solver(specs[1], os.path.join(workdir, "b"),
+                                      worktrees))
+            outdir = os.path.join(workdir, "out")
+            os.makedirs(outdir)
+
+            pool = make_pool(jobs) if jobs > 1 else None
+            for level in get_levels(competition):
+                info = get_level_info(level)
+                args = [(f"{level}/{test}", inpath, outdir, info["timeout"],
+                         ref_verdict, solvers, get_memory_limit(info))
+                        for test, inpath, _, ref_verdict
+                        in get_level_tests(level, info)]
+                if pool is None:
+                    pairs = (compare_test(*arg) for arg in args)
+                else:
+                    futures = [pool.submit(compare_test, *arg)
+                               for arg in args]
+                    pairs = (future.result() for future in futures)
+
+                for a, b in pairs:
+                    record = comparison_record(a, b)
+                    records.append(record)
+                    print_comparison(record, a, b)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            for worktree in worktrees:
+                run_cmd(["git", "worktree", "remove", "--force", worktree])
+
+    print_comparison_summary(records)
+    return records
+
+
+def print_comparison(record: dict, a: TestResult, b: TestResult) -> None:
+    prefix = f"Comparing {record['name']}"
+    ndots = MAX_TESTNAME_WIDTH - len(prefix)
+    dots = "." * ndots
+    if "speedup" not in record:
+        print(f"{prefix}  {dots}  A: {a}  B: {b}")
+        return
+
+    interval = ""
+    if "ci" in record:
+        lo, hi = record["ci"]
+        flag = " *" if record["significant"] else ""
+        interval = f" [{lo:.2f}, {hi:.2f}]{flag}"
+    print(f"{prefix}  {dots}  A: {a.time:.3f}  B: {b.time:.3f}  "
+          f"{record['speedup']:.2f}x{interval}")
+
+
+def print_comparison_summary(records: list[dict]) -> None:
+    speedups = [record["speedup"] for record in records
+                if "speedup" in record and 0 < record["speedup"] < math.inf]
+    faster = sum(record.get("significant", False) and record["speedup"] > 1
+                 for record in records)
+    slower = sum(record.get("significant", False) and record["speedup"] < 1
+                 for record in records)
+    print(f"\nCompared: {len(speedups)}/{len(records)} tests")
+    if speedups:
+        print(f"Geometric mean speedup of B over A: "
+              f"{stats.geometric_mean(speedups):.3f}x")
+    print(f"Significantly faster: {faster}, significantly slower: {slower}")
 
 
 def submit_result(final_result: FinalResult) -> None:
@@ -193,6 +1135,94 @@ def main():
                            help="Evaluate according to competition rules")
     argparser.add_argument("--submit", action="store_true",
                            help="Submit the result to the server")
+    argparser.add_argument("--jobs", type=int, default=1,
+                           help="Number of tests to run concurrently, each "
+                                "pinned to its own CPU (default: "
+                                "%(default)s)")
+    argparser.add_argument("--speculate", action="store_true",
+                           help="In competition mode, start on the next "
+                                "level's tests on the workers the current "
+                                "level leaves idle")
+    argparser.add_argument("--validation-jobs", type=int, default=0,
+                           help="Validate answers in this many background "
+                                "processes while the solver moves on to the "
+                                "next test (sequential runs only; default: "
+                                "validate before the next test)")
+    argparser.add_argument("--shard", type=str, metavar="I/N",
+                           help="Only run the I-th of N shards of the tests, "
+                                "dealt out by size; save them with --json "
+                                "and combine the shards with --merge")
+    argparser.add_argument("--merge", nargs="+", metavar="JSON",
+                           help="Compute the result of a run from the "
+                                "--json exports of its shards")
+    argparser.add_argument("--serve", type=str, metavar="[HOST:]PORT",
+                           help="Hand the tests out to the workers that "
+                                "connect on this address")
+    argparser.add_argument("--worker", type=str, metavar="[HOST:]PORT",
+                           help="Run the tests handed out by the "
+                                "coordinator on this address")
+    argparser.add_argument("--schedule", action="store_true",
+                           help="Order the tests by the runtime predicted "
+                                "from their features and past timings: "
+                                "longest first with --jobs or --serve, "
+                                "shortest first in sequential --competition "
+                                "runs")
+    argparser.add_argument("--launcher", choices=["direct", "make"],
+                           default="direct",
+                           help="Exec the solver binary directly, or go "
+                                "through make run (default: %(default)s)")
+    argparser.add_argument("--solver", type=str, default=DEFAULT_SOLVER,
+                           help="Solver the direct launcher runs, as "
+                                "\"solver input output [proof]\" (default: "
+                                "%(default)s)")
+    argparser.add_argument("--repeat", type=int, default=1,
+                           help="Times each test is measured; the reported "
+                                "time is the median (default: %(default)s)")
+    argparser.add_argument("--warmup", type=int, default=0,
+                           help="Unmeasured runs before the measured ones "
+                                "(default: %(default)s)")
+    argparser.add_argument("--compare", nargs=2, metavar=("A", "B"),
+                           help="Compare two solvers, given as binaries or "
+                                "git revisions, test by test")
+    argparser.add_argument("--json", type=str,
+                           help="Export the full per-test records to this "
+                                "file")
+    argparser.add_argument("--result-store", type=str,
+                           default=DEFAULT_STOREDIR,
+                           help="Directory of the persistent test results, "
+                                "kept per solver binary (default: "
+                                "%(default)s)")
+    argparser.add_argument("--resume", action="store_true",
+                           help="Skip the tests that already have a stored "
+                                "result for the current binary")
+    argparser.add_argument("--remeasure", nargs="+", default=[],
+                           choices=["tle", "outliers"],
+                           help="With --resume, run these stored results "
+                                "again: TLEs, and noisy or near-timeout "
+                                "measurements")
+    argparser.add_argument("--proofs", action="store_true",
+                           help="Have the solver write a DRAT proof next to "
+                                "every answer and only accept UNSAT answers "
+                                "whose proof checks; needs a --solver that "
+                                "writes them, e.g. ./cdcl.py")
+    argparser.add_argument("--profile", type=str, metavar="DIR",
+                           help="Time every phase of every test and save a "
+                                "Chrome trace of the run to this directory, "
+                                "then print the harness overhead per level")
+    argparser.add_argument("--profile-python", action="store_true",
+                           help="With --profile, also save the cProfile "
+                                "stats of the checker and its workers")
+    argparser.add_argument("--profile-memory", action="store_true",
+                           help="With --profile, also trace the memory "
+                                "allocations of the checker and its workers "
+                                "and save a snapshot after every level")
+    argparser.add_argument("--formula-cache", type=str,
+                           help="Directory of the on-disk cache of parsed "
+                                "formulas (by default formulas are parsed "
+                                "on every run)")
+    argparser.add_argument("--formula-cache-size", type=int, default=256,
+                           help="Formula cache size bound in MiB (default: "
+                                "%(default)s)")
     argparser.add_argument("--logdir", type=str, default="logs",
                            help="Name of the log directory (default: "
                                 "%(default)s)")
@@ -205,6 +1235,7 @@ def main():
     args = argparser.parse_args()
     global logger
     logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+    distributed.logger = logger
 
     if args.submit:
         global LEADERBOARD_URL, LEADERBOARD_AUTH_TOKEN
@@ -222,8 +1253,133 @@ def main():
         # Prevent intentional or accidental leakage
         del os.environ["LEADERBOARD_AUTH_TOKEN"]
 
-    final_result = run_all(args.competition)
-    if args.competition:
+    if args.jobs < 1:
+        logger.error("The number of jobs must be at least 1!")
+        sys.exit(1)
+
+    if args.repeat < 1 or args.warmup < 0:
+        logger.error("Invalid number of repetitions!")
+        sys.exit(1)
+
+    if args.compare and args.launcher != "direct":
+        logger.error("Solvers can only be compared with the direct "
+                     "launcher!")
+        sys.exit(1)
+
+    if args.speculate and (not args.competition or args.jobs < 2):
+        logger.error("Speculative scheduling needs --competition and more "
+                     "than one job!")
+        sys.exit(1)
+
+    if args.validation_jobs < 0 or (args.validation_jobs and args.jobs > 1):
+        logger.error("Background validation needs sequential runs (--jobs "
+                     "1)!")
+        sys.exit(1)
+
+    selected = None
+    if args.shard:
+        shard = parse_shard(args.shard)
+        if shard is None:
+            logger.error(f"Invalid shard {args.shard}, expected I/N with "
+                         "1 <= I <= N!")
+            sys.exit(1)
+
+        if not args.json:
+            logger.error("The results of a shard need to be saved with "
+                         "--json!")
+            sys.exit(1)
+
+        selected = {task["name"] for task
+                    in select_shard(get_tasks(args.competition), *shard)}
+
+    if sum(map(bool, (args.merge, args.serve, args.worker,
+                      args.compare))) > 1:
+        logger.error("--merge, --serve, --worker and --compare are separate "
+                     "modes!")
+        sys.exit(1)
+
+    if args.solver != DEFAULT_SOLVER and args.launcher != "direct":
+        logger.error("make run always runs ./main, --solver needs the direct "
+                     "launcher!")
+        sys.exit(1)
+
+    if args.proofs and args.solver == DEFAULT_SOLVER:
+        logger.error(f"{DEFAULT_SOLVER} doesn't write proofs, --proofs needs "
+                     "a --solver that does (e.g. ./cdcl.py)!")
+        sys.exit(1)
+
+    if args.remeasure and not args.resume:
+        logger.error("--remeasure only makes sense with --resume!")
+        sys.exit(1)
+
+    if (args.profile_python or args.profile_memory) and not args.profile:
+        logger.error("--profile-python and --profile-memory need --profile!")
+        sys.exit(1)
+
+    if args.profile and (args.merge or args.serve or args.worker or
+                         args.compare):
+        logger.error("--profile only applies to runs on this host!")
+        sys.exit(1)
+
+    global SOLVER, LAUNCHER, REPEAT, WARMUP, RESUME, REMEASURE, PROOFS
+    SOLVER = args.solver
+    LAUNCHER = args.launcher
+    REPEAT = args.repeat
+    WARMUP = args.warmup
+    RESUME = args.resume
+    REMEASURE = set(args.remeasure)
+    PROOFS = args.proofs
+
+    global DECOMPRESS_DIR
+    decompressed = tempfile.TemporaryDirectory(prefix="checker-")
+    DECOMPRESS_DIR = decompressed.name
+
+    if args.profile:
+        profiler.logger = logger
+        profiler.instrument_logging(logger)
+        profiler.enable(args.profile, args.profile_python,
+                        args.profile_memory)
+
+    if args.formula_cache:
+        validate.cache = FormulaCache(args.formula_cache,
+                                      args.formula_cache_size * 1024 * 1024,
+                                      logger)
+
+    if args.compare:
+        records = compare(args.competition, tuple(args.compare), args.jobs)
+        if args.json:
+            with open(args.json, "w") as fout:
+                json.dump({"comparison": records}, fout, indent=4,
+                          allow_nan=False)
+        return
+
+    if args.schedule:
+        global COST_MODEL
+        COST_MODEL = fit_cost_model(args.competition, args.result_store)
+
+    if args.worker:
+        work(distributed.parse_address(args.worker))
+        return
+
+    if args.merge:
+        final_result = merge(args.competition, args.merge)
+    elif args.serve:
+        final_result = serve(args.competition,
+                             distributed.parse_address(args.serve), selected)
+    else:
+        final_result = run_all(args.competition, args.jobs, args.result_store,
+                               args.speculate, args.validation_jobs, selected)
+    if args.json:
+        with open(args.json, "w") as fout:
+            json.dump({"result": final_result.toJSON(),
+                       "tests": [result.toJSON()
+                                 for result in final_result.test_results]},
+                      fout, indent=4, allow_nan=False)
+
+    if selected is not None:
+        logger.info(f"Shard {args.shard} done, {final_result.tests_run} "
+                    f"tests saved to {args.json}")
+    elif args.competition:
         logger.info("Result:")
         print(final_result)
 
@@ -237,6 +1393,11 @@ def main():
 
         print(f"\nTotal: {score}/{MAX_SCORE}")
 
+    if args.profile:
+        events = profiler.finish()
+        print(f"\nHarness overhead (trace in {args.profile}):")
+        print(profiler.summary(events))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import defaultdict
+from typing import Optional
+
+import dimacs_parser
+import helpers
+import validate
+from dimacs_parser import Answer
+from formula import Formula
+from model import Model
+
+
+logger = logging.getLogger(__name__)
+
+SOLVER = "./main"
+# Components with fewer clauses than this are solved (and validated)
+# together, rather than each by its own solver process
+MIN_COMPONENT_CLAUSES = 64
+
+
+class Component:
+    """A part of a formula sharing no variable with the rest, with its
+    variables renumbered densely"""
+
+    def __init__(self, phi: Formula, mapping: list[int],
+                 clauses: array) -> None:
+        self.phi = phi
+        # Original variable of every variable of the component (mapping[0]
+        # is unused)
+        self.mapping = mapping
+        # Indices of its clauses in the original formula
+        self.clauses = clauses
+
+    def restrict(self, model: Model) -> Model:
+        """The part of a model of the original formula for the component;
+        variables the model has no value for stay missing, so validation
+        rejects it as it would the whole model"""
+        return {var: model[orig] for var, orig in enumerate(self.mapping)
+                if var and orig in model}
+
+
+def find(parent: list[int], var: int) -> int:
+    while parent[var] != var:
+        # Path halving
+        parent[var] = parent[parent[var]]
+        var = parent[var]
+
+    return var
+
+
+def variable_roots(phi: Formula) -> list[int]:
+    """Union-find over the variables of every clause; the root of every
+    variable (itself when it occurs nowhere)"""
+    parent = list(range(phi.nvars + 1))
+    size = [1] * (phi.nvars + 1)
+    lits, offsets = phi.lits, phi.offsets
+    for idx in range(phi.nclauses):
+        start, end = offsets[idx], offsets[idx + 1]
+        if end - start < 2:
+            continue
+
+        root = find(parent, abs(lits[start]))
+        for pos in range(start + 1, end):
+            other = find(parent, abs(lits[pos]))
+            if other == root:
+                continue
+            # Union by size keeps the trees shallow
+            if size[other] > size[root]:
+                root, other = other, root
+            parent[other] = root
+            size[root] += size[other]
+
+    return [find(parent, var) for var in range(phi.nvars + 1)]
+
+
+def split(phi: Formula,
+          min_clauses: int = MIN_COMPONENT_CLAUSES) -> list[Component]:
+    """The variable-disjoint components of the formula, largest first; those
+    under min_clauses clauses are pooled into one. An empty clause makes a
+    component of its own. Variables that occur in no clause are left out."""
+    roots = variable_roots(phi)
+    lits, offsets = phi.lits, phi.offsets
+    # Root of every clause (0 for empty clauses) and the clauses of every root
+    groups: dict[int, array] = defaultdict(lambda: array("q"))
+    for idx in range(phi.nclauses):
+        start = offsets[idx]
+        root = roots[abs(lits[start])] if offsets[idx + 1] > start else 0
+        groups[root].append(idx)
+
+    small = [root for root, clauses in groups.items()
+             if root and len(clauses) < min_clauses]
+    if len(small) > 1:
+        pooled = array("q", sorted(idx for root in small
+                                   for idx in groups.pop(root)))
+        groups[small[0]] = pooled
+
+    # Dense numbering of the variables within their component
+    local = [0] * (phi.nvars + 1)
+    components = []
+    for root, clauses in sorted(groups.items(), key=lambda group:
+                                -len(group[1])):
+        mapping = [0]
+        sub_lits = array("i")
+        sub_offsets = array("q", [0])
+        for idx in clauses:
+            for pos in range(offsets[idx], offsets[idx + 1]):
+                lit = lits[pos]
+                var = abs(lit)
+                if not local[var]:
+                    local[var] = len(mapping)
+                    mapping.append(var)
+                sub_lits.append(local[var] if lit > 0 else -local[var])
+            sub_offsets.append(len(sub_lits))
+
+        components.append(Component(
+            Formula.from_buffers(sub_lits, sub_offsets, len(mapping) - 1),
+            mapping, clauses))
+
+    return components
+
+
+def merge_models(nvars: int, components: list[Component],
+                 models: list[Model]) -> Model:
+    """One model of the original formula from models of all its components;
+    variables that occur nowhere are false"""
+    values = [False] * (nvars + 1)
+    for component, model in zip(components, models):
+        for var, orig in enumerate(component.mapping):
+            if var:
+                values[orig] = model.get(var, False)
+
+    return {var: values[var] for var in range(1, nvars + 1)}
+
+
+class Runner:
+    """Runs a solver binary (called as "solver input output") on parts of a
+    formula, each in its own process; stop kills the ones still running"""
+
+    def __init__(self, solver: str, workdir: str,
+                 deadline: Optional[float] = None) -> None:
+        self.solver = solver
+        self.workdir = workdir
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.running: dict[int, subprocess.Popen] = {}
+        self.stopped = False
+
+    def run(self, idx: int, phi: Formula) -> Optional[Answer]:
+        """The answer for the part, or None on timeout, failure or stop"""
+        inpath = os.path.join(self.workdir, f"part-{idx}.cnf")
+        outpath = inpath + ".answer"
+        with open(inpath, "w") as fout:
+            fout.write(phi.to_dimacs())
+
+        with self.lock:
+            if self.stopped:
+                return None
+            proc = subprocess.Popen([self.solver, inpath, outpath],
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+            self.running[idx] = proc
+
+        try:
+            timeout = None if self.deadline is None \
+                else max(self.deadline - time.monotonic(), 0)
+            returncode = proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            return None
+        finally:
+            with self.lock:
+                del self.running[idx]
+
+        if returncode != 0:
+            if not self.stopped:
+                logger.error(f"Solver failed on part {idx} (exit code "
+                             f"{returncode})!")
+            return None
+
+        parser = dimacs_parser.AnswerParser(logger)
+        parser.set_path(outpath)
+        return parser.parse()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+            for proc in self.running.values():
+                proc.kill()
+
+
+def solve(phi: Formula, solver: str = SOLVER, jobs: int = 1,
+          timeout: Optional[float] = None) -> Optional[Answer]:
+    """Solve the components in parallel, largest first, and merge their
+    models; the first UNSAT component settles it. None if a component timed
+    out or the solver failed."""
+    components = split(phi)
+    if any(c.phi.nvars == 0 and c.phi.nclauses for c in components):
+        return (False, None)  # An empty clause
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    models: list[Optional[Model]] = [None] * len(components)
+    with tempfile.TemporaryDirectory(prefix="components-") as workdir, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        runner = Runner(solver, workdir, deadline)
+        futures = {pool.submit(runner.run, idx, component.phi): idx
+                   for idx, component in enumerate(components)}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                answer = future.result()
+                if answer is None:
+                    return None
+
+                verdict, model = answer
+                if not verdict:
+                    logger.info(f"Component {futures[future]} "
+                                f"({components[futures[future]].phi.nclauses}"
+                                " clauses) is unsatisfiable")
+                    return (False, None)
+                models[futures[future]] = model
+        finally:
+            runner.stop()
+            for future in futures:
+                future.cancel()
+
+    return (True, merge_models(phi.nvars, components, models))
+
+
+def check_component(phi: Formula, model: Model) -> bool:
+    return validate.validate_model(phi, model)
+
+
+def validate_model(phi: Formula, model: Model, jobs: int = 1) -> bool:
+    """validate.validate_model, component by component in parallel"""
+    components = split(phi)
+    if jobs == 1 or len(components) == 1:
+        return validate.validate_model(phi, model)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(check_component, component.phi,
+                               component.restrict(model))
+                   for component in components]
+        for future in concurrent.futures.as_completed(futures):
+            if not future.result():
+                pool.shutdown(cancel_futures=True)
+                return False
+
+    return True
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Split formulas into "
+                                                    "variable-disjoint "
+                                                    "components")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+
+    infoparser = subparsers.add_parser("info", help="Print the size of every "
+                                                    "component")
+    infoparser.add_argument("formula")
+
+    solveparser = subparsers.add_parser("solve", help="Solve the components "
+                                                      "in parallel")
+    solveparser.add_argument("input", help="Formula in DIMACS format")
+    solveparser.add_argument("output", help="Answer file")
+    solveparser.add_argument("--solver", type=str, default=SOLVER,
+                             help="Solver binary, called as \"solver input "
+                                  "output\" (default: %(default)s)")
+    solveparser.add_argument("--timeout", type=float,
+                             help="Give up after this many seconds")
+
+    validateparser = subparsers.add_parser("validate", help="Check a model "
+                                                            "component by "
+                                                            "component")
+    validateparser.add_argument("formula")
+    validateparser.add_argument("answer")
+
+    for subparser in (solveparser, validateparser):
+        subparser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                               help="Components handled in parallel "
+                                    "(default: %(default)s)")
+
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(args.input if args.command == "solve" else args.formula)
+    phi = parser.parse()
+    if phi is None:
+        logger.error("Failed to parse the formula file!")
+        sys.exit(1)
+
+    if args.command == "info":
+        components = split(phi, min_clauses=0)
+        print(f"{len(components)} components")
+        for component in components:
+            print(f"{component.phi.nvars:>8} vars {component.phi.nclauses:>8} "
+                  "clauses")
+    elif args.command == "solve":
+        answer = solve(phi, args.solver, args.jobs, args.timeout)
+        if answer is None:
+            logger.error("A component timed out or the solver failed!")
+            sys.exit(1)
+
+        with open(args.output, "w") as fout:
+            fout.write(dimacs_parser.answer_to_dimacs(answer))
+    elif args.command == "validate":
+        ans_parser = dimacs_parser.AnswerParser(logger)
+        ans_parser.set_path(args.answer)
+        answer = ans_parser.parse()
+        if answer is None or not answer[0]:
+            logger.error("No model to check!")
+            sys.exit(1)
+
+        valid = validate_model(phi, answer[1], args.jobs)
+        print("Model is correct!" if valid else "Model is incorrect!")
+        if not valid:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
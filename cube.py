@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+from array import array
+from typing import Optional
+
+import components
+import dimacs_parser
+import helpers
+import validate
+from dimacs_parser import Answer
+from formula import Formula
+
+
+logger = logging.getLogger(__name__)
+
+SOLVER = components.SOLVER
+DEPTH = 4
+# Unassigned variables (the ones in the most clauses) the lookahead tries at
+# every node of the cube tree
+CANDIDATES = 16
+
+
+class Lookahead:
+    """Unit propagation over the formula, to score branching variables by
+    how much they simplify it"""
+
+    def __init__(self, phi: Formula) -> None:
+        self.phi = phi
+        self.occurrences = phi.occurrences()
+        # 1 if true, -1 if false, 0 if unassigned
+        self.value = [0] * (phi.nvars + 1)
+        self.trail: list[int] = []
+
+    def lit_value(self, lit: int) -> int:
+        value = self.value[abs(lit)]
+        return value if lit > 0 else -value
+
+    def propagate(self, lit: int) -> Optional[int]:
+        """Assign the literal and propagate it; the number of clauses this
+        shortened without satisfying, or None on a conflict. The assignments
+        stay on the trail either way."""
+        queue = [lit]
+        reduced = 0
+        while queue:
+            lit = queue.pop()
+            value = self.lit_value(lit)
+            if value:
+                if value < 0:
+                    return None
+                continue
+
+            self.value[abs(lit)] = 1 if lit > 0 else -1
+            self.trail.append(abs(lit))
+            for idx in self.occurrences.clauses(abs(lit)):
+                free, unit = 0, 0
+                for other in self.phi.clause(idx):
+                    value = self.lit_value(other)
+                    if value > 0:
+                        break
+                    if value == 0:
+                        free += 1
+                        unit = other
+                else:
+                    if free == 0:
+                        return None
+                    reduced += 1
+                    if free == 1:
+                        queue.append(unit)
+
+        return reduced
+
+    def undo(self, mark: int) -> None:
+        while len(self.trail) > mark:
+            self.value[self.trail.pop()] = 0
+
+    def try_lit(self, lit: int) -> Optional[int]:
+        mark = len(self.trail)
+        reduced = self.propagate(lit)
+        self.undo(mark)
+        return reduced
+
+
+def make_cubes(phi: Formula, depth: int = DEPTH,
+               candidates: int = CANDIDATES) -> list[list[int]]:
+    """At most 2^depth cubes covering every assignment the lookahead doesn't
+    refute. Every node branches on the candidate whose two sides shorten the
+    most clauses (the product of the counts, as march does); a side that
+    propagates to a conflict is refuted and dropped. No cubes means UNSAT."""
+    look = Lookahead(phi)
+    for idx in range(phi.nclauses):
+        clause = phi.clause(idx)
+        if len(clause) == 0:
+            return []
+        if len(clause) == 1 and look.propagate(clause[0]) is None:
+            return []
+
+    order = sorted(range(1, phi.nvars + 1),
+                   key=lambda var: -len(look.occurrences.clauses(var)))
+    cubes: list[list[int]] = []
+
+    def split(cube: list[int]) -> None:
+        if len(cube) == depth:
+            cubes.append(cube)
+            return
+
+        best, best_score = 0, -1
+        free = (var for var in order if not look.value[var])
+        for var in itertools.islice(free, candidates):
+            pos, neg = look.try_lit(var), look.try_lit(-var)
+            if pos is None or neg is None:
+                # A failed literal: at most one side is left, so branching
+                # on it costs nothing
+                best = var
+                break
+            if (pos + 1) * (neg + 1) > best_score:
+                best, best_score = var, (pos + 1) * (neg + 1)
+
+        if not best:  # Everything is assigned
+            cubes.append(cube)
+            return
+
+        for lit in (best, -best):
+            mark = len(look.trail)
+            if look.propagate(lit) is not None:
+                split(cube + [lit])
+            look.undo(mark)
+
+    split([])
+    return cubes
+
+
+def with_cube(phi: Formula, cube: list[int]) -> Formula:
+    """The formula with the literals of the cube as unit clauses"""
+    lits = array("i", phi.lits)
+    offsets = array("q", phi.offsets)
+    for lit in cube:
+        lits.append(lit)
+        offsets.append(len(lits))
+
+    return Formula.from_buffers(lits, offsets, phi.nvars)
+
+
+def solve(phi: Formula, depth: int = DEPTH, solver: str = SOLVER,
+          jobs: int = 1, timeout: Optional[float] = None) -> Optional[Answer]:
+    """Run the solver on the cubes in parallel; the first checked model
+    settles it, UNSAT takes every cube refuted. None if a cube timed out or
+    the solver failed without a model found elsewhere."""
+    cubes = make_cubes(phi, depth)
+    logger.debug(f"{len(cubes)} cubes of depth {depth}")
+    if not cubes:
+        return (False, None)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    unknown = False
+    with tempfile.TemporaryDirectory(prefix="cubes-") as workdir, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        runner = components.Runner(solver, workdir, deadline)
+        # Each sub-instance is built when its task starts, rather than all
+        # 2^depth copies of the formula up front
+        futures = [pool.submit(lambda i, c: runner.run(i, with_cube(phi, c)),
+                               idx, cube)
+                   for idx, cube in enumerate(cubes)]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                answer = future.result()
+                if answer is None:
+                    unknown = True
+                    continue
+
+                verdict, model = answer
+                if not verdict:
+                    continue
+                if model is not None and validate.validate_model(phi, model):
+                    return (True, model)
+
+                logger.error("The solver gave a wrong model for a cube!")
+                unknown = True
+        finally:
+            runner.stop()
+            for future in futures:
+                future.cancel()
+
+    return None if unknown else (False, None)
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Cube-and-conquer: split "
+                                                    "a formula into cubes by "
+                                                    "lookahead and solve them "
+                                                    "in parallel")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--depth", type=int, default=DEPTH,
+                        help="Split into at most 2^depth cubes (default: "
+                             "%(default)s)")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+
+    splitparser = subparsers.add_parser("split", parents=[common],
+                                        help="Write every cube as a DIMACS "
+                                             "sub-instance")
+    splitparser.add_argument("input", help="Formula in DIMACS format")
+    splitparser.add_argument("outdir")
+
+    solveparser = subparsers.add_parser("solve", parents=[common],
+                                        help="Solve the cubes in parallel")
+    solveparser.add_argument("input", help="Formula in DIMACS format")
+    solveparser.add_argument("output", help="Answer file")
+    solveparser.add_argument("--solver", type=str, default=SOLVER,
+                             help="Solver binary, called as \"solver input "
+                                  "output\" (default: %(default)s)")
+    solveparser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                             help="Cubes solved in parallel (default: "
+                                  "%(default)s)")
+    solveparser.add_argument("--timeout", type=float,
+                             help="Give up after this many seconds")
+
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+    components.logger = logger
+
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(args.input)
+    phi = parser.parse()
+    if phi is None:
+        logger.error("Failed to parse the formula file!")
+        sys.exit(1)
+
+    if args.command == "split":
+        cubes = make_cubes(phi, args.depth)
+        os.makedirs(args.outdir, exist_ok=True)
+        for idx, cube in enumerate(cubes):
+            with open(os.path.join(args.outdir, f"cube-{idx}.cnf"), "w") \
+                    as fout:
+                fout.write(with_cube(phi, cube).to_dimacs())
+        logger.info(f"{len(cubes)} cubes written to {args.outdir}")
+    elif args.command == "solve":
+        answer = solve(phi, args.depth, args.solver, args.jobs, args.timeout)
+        if answer is None:
+            logger.error("A cube timed out or the solver failed!")
+            sys.exit(1)
+
+        with open(args.output, "w") as fout:
+            fout.write(dimacs_parser.answer_to_dimacs(answer))
+
+
+if __name__ == "__main__":
+    main()
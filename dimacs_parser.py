@@ -1,17 +1,93 @@
+import bz2
+import gzip
 import string
 import logging
-from typing import Optional
+import lzma
+import mmap
+import operator
+import os
+import re
+from array import array
+from collections.abc import Iterator
+from itertools import compress, count, repeat
+from typing import IO, Optional
 
 from model import Model
-from var import Var
-from literal import Literal
-from clause import Clause
 from formula import Formula
 
 
 Answer = tuple[bool, Optional[Model]]
 
 
+COMMENT_LINE_RE = re.compile(rb"^c[^\n]*\n?", re.MULTILINE)
+END_MARKER_RE = re.compile(rb"^%\r?$", re.MULTILINE)
+LITERAL_CHARS = b"0123456789- \t\n\r\v\f"
+# Literals are stored as int32
+MAX_VARIABLE = 2 ** 31 - 1
+
+# Compressed files are recognized by their magic bytes, whatever their name
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": gzip.open,
+    b"BZh": bz2.open,
+    b"\xfd7zXZ\x00": lzma.open,
+}
+# Streams are parsed in chunks of about this many bytes (cut at lines)
+CHUNK_SIZE = 1 << 20
+# Plain files larger than this are streamed too: parse holds every value as a
+# Python int, which takes about 15 times the size of the file
+STREAM_THRESHOLD = 32 * 1024 * 1024
+
+
+def compression_opener(path: str):
+    """The open function of the compression format of the file, if any"""
+    with open(path, "rb") as fin:
+        head = fin.read(max(map(len, COMPRESSION_MAGIC)))
+
+    for magic, opener in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return opener
+
+    return None
+
+
+def open_binary(path: str) -> IO[bytes]:
+    """Open the file for reading, decompressing it on the fly if needed"""
+    opener = compression_opener(path)
+    if opener is None:
+        return open(path, "rb")
+
+    return opener(path, "rb")
+
+
+def read_chunks(fin: IO[bytes],
+                chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """The stream in chunks of whole lines, about chunk_size bytes each"""
+    carry = b""
+    while chunk := fin.read(chunk_size):
+        chunk = carry + chunk
+        cut = chunk.rfind(b"\n") + 1
+        if cut == 0:  # A single line longer than the chunk
+            carry = chunk
+            continue
+
+        carry = chunk[cut:]
+        yield chunk[:cut]
+
+    if carry:
+        yield carry
+
+
+def answer_to_dimacs(answer: Answer) -> str:
+    """Answer file contents, in the format the C solver writes"""
+    verdict, model = answer
+    if not verdict:
+        return "s UNSATISFIABLE\n"
+
+    assert model is not None
+    values = (idx if model[idx] else -idx for idx in sorted(model))
+    return "s SATISFIABLE\nv " + " ".join(map(str, values)) + " 0\n"
+
+
 class DummyLogger:
     def __getattr__(self, name):
         return lambda *args, **kwargs: None
@@ -29,10 +105,33 @@ class Parser:
         if self.path is None:
             raise Exception("No path set! Call \"set_path\" first!")
 
-        with open(self.path, "rt") as fin:
-            text = fin.read()
+        if compression_opener(self.path) is None:
+            with open(self.path, "rt") as fin:
+                return fin.read()
+
+        with open_binary(self.path) as fbin:
+            return fbin.read().decode()
+
+    def should_stream(self) -> bool:
+        """Whether the file can't simply be mapped: it's either compressed or
+        too big to hold in memory next to its parsed form"""
+        if self.path is None:
+            raise Exception("No path set! Call \"set_path\" first!")
+
+        return compression_opener(self.path) is not None or \
+            os.path.getsize(self.path) > STREAM_THRESHOLD
 
-        return text
+    def open_and_map(self) -> bytes:
+        """Return the file contents with all comment lines stripped"""
+        if self.path is None:
+            raise Exception("No path set! Call \"set_path\" first!")
+
+        with open(self.path, "rb") as fin:
+            try:
+                with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return COMMENT_LINE_RE.sub(b"", mm)
+            except ValueError:  # Empty files can't be mapped
+                return b""
 
     def get_non_comment_lines(self, text: str) -> list[tuple[int, str]]:
         origlines = enumerate(text.splitlines())
@@ -40,13 +139,210 @@ class Parser:
         lines = [line for line in origlines if not line[1].startswith("c")]
         return lines
 
+    def read_non_comment_lines(self) -> Iterator[tuple[int, str]]:
+        """Same as get_non_comment_lines on the whole file, read a chunk at a
+        time"""
+        if self.path is None:
+            raise Exception("No path set! Call \"set_path\" first!")
+
+        lineno = 0
+        with open_binary(self.path) as fin:
+            for chunk in read_chunks(fin):
+                lines = chunk.decode().splitlines()
+                for number, line in enumerate(lines, start=lineno):
+                    if not line.startswith("c"):
+                        yield number, line
+                lineno += len(lines)
+
 
 class FormulaParser(Parser):
     def __init__(self, logger: Optional[logging.Logger] = None) -> None:
         super().__init__(logger)
 
     def parse(self) -> Optional[Formula]:
-        text = self.open_and_read()
+        if self.should_stream():
+            with open_binary(self.path) as fin:
+                return self.parse_stream(read_chunks(fin))
+
+        data = self.open_and_map()
+        firstline, _, body = data.partition(b"\n")
+        if not firstline and not body:
+            self.logger.error(f"[{self.path}] Empty formula file!")
+            return None
+
+        nvars = None
+        nclauses = None
+        if firstline.startswith(b"p cnf "):
+            _, _, vs, cs = firstline.split()
+            nvars = int(vs)
+            nclauses = int(cs)
+        else:
+            body = data
+
+        marker = END_MARKER_RE.search(body)
+        if marker is not None:
+            body = body[:marker.start()]
+
+        # Everything is validated in bulk; only when something is wrong do we
+        # fall back to the line-by-line parser, which locates the offending
+        # line for the error message. Stray characters are caught by the
+        # translate() and misplaced dashes by int() itself.
+        if body.translate(None, LITERAL_CHARS):
+            return self.parse_lines(self.open_and_read())
+
+        try:
+            values = list(map(int, body.split()))
+        except ValueError:
+            return self.parse_lines(self.open_and_read())
+
+        limit = MAX_VARIABLE if nvars is None else min(nvars, MAX_VARIABLE)
+        if values and max(max(values), -min(values)) > limit:
+            return self.parse_lines(self.open_and_read())
+
+        # The k-th terminating zero (counting from 0) has exactly k zeros
+        # before it, so its position minus k is where the next clause starts
+        zeros = list(compress(count(), map(operator.not_, values)))
+        offsets = array("q", [0])
+        offsets.extend(map(operator.sub, zeros, count()))
+
+        if nclauses is not None and len(offsets) - 1 != nclauses:
+            self.logger.error(f"[{self.path}] Number of clauses "
+                              f"explicitly mentioned as {nclauses}, but "
+                              f"there are {len(offsets) - 1} clauses present!")
+            return None
+
+        # Literals after the last "0" don't form a clause
+        end = zeros[-1] if zeros else 0
+        lits = array("i", filter(None, values[:end]))
+        return Formula.from_buffers(lits, offsets)
+
+    def parse_stream(self, chunks: Iterator[bytes]) -> Optional[Formula]:
+        """Same as parse, a chunk of whole lines at a time, so only the
+        parsed formula and the current chunk are ever in memory"""
+        nvars = None
+        nclauses = None
+        header_pending = True
+        lits = array("i")
+        offsets = array("q", [0])
+        # Number of the first line of the chunk, as parse_lines counts them
+        lineno = 0
+        for chunk in chunks:
+            body = COMMENT_LINE_RE.sub(b"", chunk)
+            header = header_pending
+            if header_pending:
+                if not body:
+                    lineno += chunk.count(b"\n")
+                    continue
+
+                header_pending = False
+                firstline, _, rest = body.partition(b"\n")
+                if firstline.startswith(b"p cnf "):
+                    _, _, vs, cs = firstline.split()
+                    nvars = int(vs)
+                    nclauses = int(cs)
+                    body = rest
+
+            marker = END_MARKER_RE.search(body)
+            if marker is not None:
+                body = body[:marker.start()]
+
+            # On error, the chunk is gone through line by line for where
+            if body.translate(None, LITERAL_CHARS):
+                self.report_chunk_error(chunk, lineno, nvars, header)
+                return None
+
+            try:
+                values = array("i", map(int, body.split()))
+            except (ValueError, OverflowError):
+                self.report_chunk_error(chunk, lineno, nvars, header)
+                return None
+
+            if nvars is not None and values and \
+                    max(max(values), -min(values)) > nvars:
+                self.report_chunk_error(chunk, lineno, nvars, header)
+                return None
+
+            # Same as in parse, shifted by the literals of the previous chunks
+            base = len(lits)
+            zeros = compress(count(), map(operator.not_, values))
+            offsets.extend(map(operator.add, map(operator.sub, zeros, count()),
+                               repeat(base)))
+            lits.extend(filter(None, values))
+
+            if marker is not None:
+                break
+            lineno += chunk.count(b"\n")
+
+        if header_pending:
+            self.logger.error(f"[{self.path}] Empty formula file!")
+            return None
+
+        if nclauses is not None and len(offsets) - 1 != nclauses:
+            self.logger.error(f"[{self.path}] Number of clauses "
+                              f"explicitly mentioned as {nclauses}, but "
+                              f"there are {len(offsets) - 1} clauses present!")
+            return None
+
+        # Literals after the last "0" don't form a clause
+        del lits[offsets[-1]:]
+        return Formula.from_buffers(lits, offsets)
+
+    def report_chunk_error(self, chunk: bytes, lineno: int,
+                           nvars: Optional[int], header: bool) -> None:
+        """Log the first malformed literal of a chunk parse_stream rejected,
+        the chunk starting at line lineno (and with the p cnf line, if
+        header)"""
+        lines = chunk.decode(errors="replace").split("\n")
+        for number, line in enumerate(lines, start=lineno):
+            if line.startswith("c"):
+                continue
+            if header and line.startswith("p cnf "):
+                header = False
+                continue
+            if line.rstrip("\r") == "%":
+                break
+
+            for literal in line.split():
+                if literal != "0" and \
+                        self.parse_literal(literal, number, nvars) is None:
+                    return
+
+        self.logger.error(f"[{self.path}:{lineno}] Invalid formula!")
+
+    def parse_literal(self, number: str, lineno: int,
+                      nvars: Optional[int]) -> Optional[int]:
+        """The literal, or None (logged) if it's malformed or out of range"""
+        if number[0] not in "-" + string.digits or number == "-":
+            self.logger.error(f"[{self.path}:{lineno}] Invalid "
+                              f"literal {number}!")
+            return None
+
+        for d in number[1:]:
+            if d not in string.digits:
+                self.logger.error(f"[{self.path}:{lineno}] Invalid "
+                                  f"literal {number}!")
+                return None
+
+        pos: bool = number[0] != "-"
+        varidx: int = int(number if pos else number[1:])
+
+        # It can't be lower than 1 at this point, because we explicitly
+        # check that it's made of digits and that it's not 0.
+        if nvars is not None and varidx > nvars:
+            self.logger.error(f"[{self.path}:{lineno}] Number of "
+                              f"variables explicitly mentioned as "
+                              f"{nvars}, but literal {number} refers "
+                              f"to a larger number!")
+            return None
+
+        if varidx > MAX_VARIABLE:
+            self.logger.error(f"[{self.path}:{lineno}] Invalid "
+                              f"literal {number}!")
+            return None
+
+        return varidx if pos else -varidx
+
+    def parse_lines(self, text: str) -> Optional[Formula]:
         lines = self.get_non_comment_lines(text)
 
         nvars = None
@@ -58,8 +354,9 @@ class FormulaParser(Parser):
             nclauses = int(cs)
             lines = lines[1:]
 
-        literals: list[Literal] = []
-        clauses: list[Clause] = []
+        # Flat literal buffer plus the offset at which every clause starts
+        lits = array("i")
+        offsets = array("q", [0])
 
         # We want to accept the very permissive DIMACS format, in which a
         # single clause can be spread on multiple lines.
@@ -70,45 +367,24 @@ class FormulaParser(Parser):
 
             for number in line.split():
                 if number == "0":
-                    newclause = Clause(literals)
-                    clauses.append(newclause)
-                    literals = []
+                    offsets.append(len(lits))
                     continue
 
-                if number[0] not in "-" + string.digits:
-                    self.logger.error(f"[{self.path}:{lineno}] Invalid "
-                                      f"literal {number}!")
+                lit = self.parse_literal(number, lineno, nvars)
+                if lit is None:
                     return None
 
-                for d in number[1:]:
-                    if d not in string.digits:
-                        self.logger.error(f"[{self.path}:{lineno}] Invalid "
-                                          f"literal {number}!")
-                        return None
-
-                pos: bool = number[0] != "-"
-                varidx: int = int(number if pos else number[1:])
+                lits.append(lit)
 
-                # It can't be lower than 1 at this point, because we explicitly
-                # check that it's made of digits and that it's not 0.
-                if nvars is not None and varidx > nvars:
-                    self.logger.error(f"[{self.path}:{lineno}] Number of "
-                                      f"variables explicitly mentioned as "
-                                      f"{nvars}, but literal {number} refers "
-                                      f"to a larger number!")
-                    return None
-
-                newvar = Var(varidx)
-                newliteral = Literal(newvar, pos)
-                literals.append(newliteral)
-
-        if nclauses is not None and len(clauses) != nclauses:
+        # Literals after the last "0" don't form a clause
+        del lits[offsets[-1]:]
+        if nclauses is not None and len(offsets) - 1 != nclauses:
             self.logger.error(f"[{self.path}] Number of clauses "
                               f"explicitly mentioned as {nclauses}, but "
-                              f"there are {len(clauses)} clauses present!")
+                              f"there are {len(offsets) - 1} clauses present!")
             return None
 
-        phi = Formula(clauses)
+        phi = Formula.from_buffers(lits, offsets)
         return phi
 
 
@@ -117,12 +393,18 @@ class AnswerParser(Parser):
         super().__init__(logger)
 
     def parse(self) -> Optional[Answer]:
-        text = self.open_and_read()
-        lines = self.get_non_comment_lines(text)
-
         model = {}
         encountered_answer_line = False
-        for lineno, line in lines:
+        unsatisfiable = False
+        nlines = 0
+        for lineno, line in self.read_non_comment_lines():
+            nlines += 1
+            if unsatisfiable:
+                self.logger.error(f"[{self.path}] Invalid answer file, "
+                                  "UNSATISFIABLE answer followed by more "
+                                  "lines!")
+                return None
+
             if line.startswith("s "):
                 if encountered_answer_line:
                     self.logger.error(f"[{self.path}:{lineno}] Multiple "
@@ -132,13 +414,14 @@ class AnswerParser(Parser):
                 encountered_answer_line = True
                 _, answer = line.split()
                 if answer == "UNSATISFIABLE":
-                    if len(lines) != 1:
+                    if nlines != 1:
                         self.logger.error(f"[{self.path}] Invalid answer "
                                           "file, UNSATISFIABLE answer "
-                                          "followed by more lines!")
+                                          "after other lines!")
                         return None
 
-                    return (False, None)
+                    unsatisfiable = True
+                    continue
 
                 if answer != "SATISFIABLE":
                     self.logger.error(f"[{self.path}] Invalid answer file, "
@@ -175,6 +458,9 @@ class AnswerParser(Parser):
                                   "line!")
                 return None
 
+        if unsatisfiable:
+            return (False, None)
+
         for idx in range(1, len(model.keys()) + 1):
             if idx not in model:
                 self.logger.error(f"[{self.path}] Model does not "
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import json
+import logging
 import os
 import subprocess
 import tempfile
+import time
 import shutil
+import sys
+from collections.abc import Iterator
+from typing import IO, Optional
 
 import dimacs_parser
 import helpers
+from formula import Formula
+from literal import Literal
 
-TEMPLATE = r"""
+
+logger = logging.getLogger(__name__)
+
+INFOBASENAME = "info.json"
+
+PREAMBLE = r"""
 \documentclass{article}
 \usepackage{amsmath}  % For enhanced math functionality
 \usepackage{breqn}    % For automatic equation wrapping
@@ -16,34 +30,198 @@ TEMPLATE = r"""
 
 \begin{document}
 
-% Start the equation wrapped using dmath from breqn
-\begin{dmath}
-<FORMULA>
-\end{dmath}
+"""
 
+END = r"""
 \end{document}
 """
 
+# breqn's line breaking gets superlinear in the length of the equation, so
+# the formula is wrapped in dmath blocks of bounded size
+DEFAULT_CLAUSES_PER_BLOCK = 64
+# Formulas are converted and written out this many blocks at a time
+BLOCKS_PER_WRITE = 16
+
+
+def clause_blocks(phi: Formula, start: int, end: int,
+                  clauses_per_block: int) -> Iterator[str]:
+    """LaTeX of clauses [start, end), one dmath block at a time; same output
+    as Formula.to_latex, except for the block boundaries"""
+    literals: dict[int, str] = {}
+
+    def clause_latex(idx: int) -> str:
+        lits = []
+        for lit in phi.clause(idx):
+            if lit not in literals:
+                literals[lit] = Literal.from_int(lit).to_latex()
+            lits.append(literals[lit])
+        return "(" + " \\lor ".join(lits) + ")"
+
+    for block_start in range(start, end, clauses_per_block):
+        block_end = min(block_start + clauses_per_block, end)
+        body = " \\land ".join(map(clause_latex,
+                                   range(block_start, block_end)))
+        # Continued blocks start with the conjunction they were split at
+        prefix = "\\land " if block_start > start else ""
+        yield f"\\begin{{dmath*}}\n{prefix}{body}\n\\end{{dmath*}}\n"
+
+
+def write_latex(phi: Formula, fout: IO[str], start: int, end: int,
+                clauses_per_block: int, blocks_per_page: int) -> None:
+    fout.write(PREAMBLE)
+    chunk = []
+    for i, block in enumerate(clause_blocks(phi, start, end,
+                                            clauses_per_block)):
+        if blocks_per_page and i and i % blocks_per_page == 0:
+            chunk.append("\\clearpage\n")
+        chunk.append(block)
+        if len(chunk) >= BLOCKS_PER_WRITE:
+            fout.write("".join(chunk))
+            chunk.clear()
+
+    fout.write("".join(chunk))
+    fout.write(END)
+
+
+def run_pdflatex(latex_path: str, pdf_path: str) -> bool:
+    tempdir = os.path.dirname(latex_path)
+    proc = subprocess.run(["pdflatex", "-interaction=nonstopmode",
+                           "-output-directory", tempdir,
+                           "-jobname", "temp",
+                           latex_path],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    pdf = os.path.join(tempdir, "temp.pdf")
+    if proc.returncode != 0 or not os.path.exists(pdf):
+        logger.debug(proc.stdout.decode("utf-8", errors="replace"))
+        logger.error(f"pdflatex failed for {pdf_path}!")
+        return False
+
+    shutil.move(pdf, pdf_path)
+    return True
+
+
+def part_paths(pdf_path: str, nparts: int) -> list[str]:
+    if nparts == 1:
+        return [pdf_path]
+
+    stem, ext = os.path.splitext(pdf_path)
+    return [f"{stem}-{i + 1:03d}{ext}" for i in range(nparts)]
+
 
-def build_pdf(latex_code: str, pdf_path: str) -> None:
+def build_pdf(phi: Formula, pdf_path: str,
+              clauses_per_block: int = DEFAULT_CLAUSES_PER_BLOCK,
+              blocks_per_page: int = 0,
+              clauses_per_file: Optional[int] = None,
+              latex_only: bool = False) -> dict:
+    """Convert the formula, split into several PDFs of at most
+    clauses_per_file clauses if given; returns the time spent on every step"""
+    per_file = clauses_per_file or max(phi.nclauses, 1)
+    starts = list(range(0, max(phi.nclauses, 1), per_file))
+    paths = part_paths(pdf_path, len(starts))
+    timing = {"latex": 0.0, "pdflatex": 0.0, "ok": True}
     with tempfile.TemporaryDirectory() as tempdir:
         latex_path = os.path.join(tempdir, "main.tex")
-        with open(latex_path, "w") as f:
-            f.write(latex_code)
+        for start, path in zip(starts, paths):
+            begin = time.perf_counter()
+            with open(latex_path, "w") as f:
+                write_latex(phi, f, start, min(start + per_file, phi.nclauses),
+                            clauses_per_block, blocks_per_page)
+            timing["latex"] += time.perf_counter() - begin
 
-        subprocess.run(["pdflatex",
-                        "-output-directory", tempdir,
-                        "-jobname", "temp",
-                        latex_path])
-        shutil.move(os.path.join(tempdir, "temp.pdf"), pdf_path)
+            if latex_only:
+                shutil.copy(latex_path, os.path.splitext(path)[0] + ".tex")
+                continue
+
+            begin = time.perf_counter()
+            timing["ok"] &= run_pdflatex(latex_path, path)
+            timing["pdflatex"] += time.perf_counter() - begin
+
+    return timing
+
+
+def convert(inpath: str, pdf_path: str, clauses_per_block: int,
+            blocks_per_page: int, clauses_per_file: Optional[int],
+            latex_only: bool) -> dict:
+    begin = time.perf_counter()
+    parser = dimacs_parser.FormulaParser(logger=logger)
+    parser.set_path(inpath)
+    phi = parser.parse()
+    if phi is None:
+        logger.error(f"Failed to parse {inpath}!")
+        return {"parse": 0.0, "latex": 0.0, "pdflatex": 0.0, "ok": False,
+                "clauses": 0}
+
+    elapsed = time.perf_counter() - begin
+    timing = build_pdf(phi, pdf_path, clauses_per_block, blocks_per_page,
+                       clauses_per_file, latex_only)
+    timing["parse"] = elapsed
+    timing["clauses"] = phi.nclauses
+    return timing
+
+
+def get_dir_tests(testdir: str) -> list[str]:
+    """The tests listed in the directory's info file, or every file in it"""
+    try:
+        with open(os.path.join(testdir, INFOBASENAME)) as fin:
+            return list(json.load(fin)["tests"])
+    except FileNotFoundError:
+        return sorted(name for name in os.listdir(testdir)
+                      if os.path.isfile(os.path.join(testdir, name)))
+
+
+def convert_batch(testdir: str, outdir: str, jobs: int,
+                  clauses_per_block: int, blocks_per_page: int,
+                  clauses_per_file: Optional[int],
+                  latex_only: bool) -> None:
+    os.makedirs(outdir, exist_ok=True)
+    tests = get_dir_tests(testdir)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            test: pool.submit(convert, os.path.join(testdir, test),
+                              os.path.join(outdir,
+                                           os.path.splitext(test)[0] + ".pdf"),
+                              clauses_per_block, blocks_per_page,
+                              clauses_per_file, latex_only)
+            for test in tests
+        }
+        for test, future in futures.items():
+            print_timing(test, future.result())
+
+
+def print_timing(name: str, timing: dict) -> None:
+    status = "OK" if timing["ok"] else "FAILED"
+    print(f"{name}: {status} ({timing['clauses']} clauses, parse "
+          f"{timing['parse']:.3f} s, LaTeX {timing['latex']:.3f} s, "
+          f"pdflatex {timing['pdflatex']:.3f} s)")
 
 
 def main() -> None:
     argparser = argparse.ArgumentParser(description="Convert a DIMACS file to "
                                                     "a PDF")
     argparser.add_argument("input", help="File containing an input formula "
-                                         "in DIMACS format")
-    argparser.add_argument("output", help="Output PDF file")
+                                         "in DIMACS format (a test directory "
+                                         "with --batch)")
+    argparser.add_argument("output", help="Output PDF file (a directory with "
+                                          "--batch)")
+    argparser.add_argument("--batch", action="store_true",
+                           help="Convert every test in the input directory")
+    argparser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                           help="Parallel conversions with --batch (default: "
+                                "%(default)s)")
+    argparser.add_argument("--clauses-per-block", type=int,
+                           default=DEFAULT_CLAUSES_PER_BLOCK,
+                           help="Clauses per equation block (default: "
+                                "%(default)s)")
+    argparser.add_argument("--blocks-per-page", type=int, default=0,
+                           help="Start a new page after this many blocks "
+                                "(default: let LaTeX break pages)")
+    argparser.add_argument("--clauses-per-file", type=int,
+                           help="Split the formula into several PDFs of at "
+                                "most this many clauses, numbered -001, "
+                                "-002, ...")
+    argparser.add_argument("--latex-only", action="store_true",
+                           help="Write the .tex files next to the outputs "
+                                "instead of running pdflatex")
     argparser.add_argument("--logdir", type=str,
                            help="Name of the log directory (by default no "
                            "logs are saved)")
@@ -54,15 +232,28 @@ def main() -> None:
                            help="Suppress printing to stderr")
 
     args = argparser.parse_args()
+    global logger
     logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
 
-    parser = dimacs_parser.FormulaParser(logger=logger)
-    parser.set_path(args.input)
-    phi = parser.parse()
-    assert phi is not None, "No formula was parsed!"
+    if args.clauses_per_block < 1 or (args.clauses_per_file is not None and
+                                      args.clauses_per_file < 1):
+        logger.error("Blocks and files need at least one clause!")
+        sys.exit(1)
+
+    if not args.latex_only and shutil.which("pdflatex") is None:
+        logger.error("pdflatex not found, install it or use --latex-only!")
+        sys.exit(1)
+
+    if args.batch:
+        convert_batch(args.input, args.output, args.jobs,
+                      args.clauses_per_block, args.blocks_per_page,
+                      args.clauses_per_file, args.latex_only)
+        return
 
-    latex_code = TEMPLATE.replace("<FORMULA>", phi.to_latex())
-    build_pdf(latex_code, args.output)
+    timing = convert(args.input, args.output, args.clauses_per_block,
+                     args.blocks_per_page, args.clauses_per_file,
+                     args.latex_only)
+    print_timing(args.input, timing)
 
 
 if __name__ == "__main__":
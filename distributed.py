@@ -0,0 +1,147 @@
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+from typing import IO, Callable
+
+from result import TestResult
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+# Workers started before the coordinator keep trying to connect this long
+CONNECT_TIMEOUT = 30.0
+# How often idle connections check whether the run is over
+POLL_INTERVAL = 0.5
+
+# A test to run, as the keyword arguments of checker.run_test
+Task = dict
+
+
+def parse_address(spec: str) -> tuple[str, int]:
+    """[HOST:]PORT"""
+    host, _, port = spec.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+def send(fout: IO[bytes], message: dict) -> None:
+    fout.write(json.dumps(message, allow_nan=False).encode() + b"\n")
+    fout.flush()
+
+
+class Coordinator:
+    """Hands the tests out to the workers that connect, one test at a time
+    per connection, and gathers their results. Tests in the hands of a worker
+    that goes away are handed out again."""
+
+    def __init__(self, address: tuple[str, int], tasks: list[Task]) -> None:
+        self.tasks: queue.Queue[Task] = queue.Queue()
+        for task in tasks:
+            self.tasks.put(task)
+
+        self.results: dict[str, TestResult] = {}
+        self.remaining = len(tasks)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        if not tasks:
+            self.done.set()
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                coordinator.serve_worker(self.rfile, self.wfile,
+                                         self.client_address)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(address, Handler)
+        self.server.daemon_threads = True
+
+    def serve_worker(self, rfile: IO[bytes], wfile: IO[bytes],
+                     peer: tuple[str, int]) -> None:
+        logger.info(f"Worker {peer[0]}:{peer[1]} connected")
+        while not self.done.is_set():
+            try:
+                task = self.tasks.get(timeout=POLL_INTERVAL)
+            except queue.Empty:  # Tests may still come back from lost workers
+                continue
+
+            try:
+                send(wfile, {"task": task})
+                line = rfile.readline()
+                if not line:
+                    raise ConnectionError("connection closed")
+                result = TestResult.fromJSON(json.loads(line)["result"])
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Lost worker {peer[0]}:{peer[1]} while it "
+                               f"ran {task['name']} ({e}), handing the test "
+                               "out again")
+                self.tasks.put(task)
+                return
+
+            self.record(result)
+
+        try:
+            send(wfile, {"done": True})
+        except OSError:
+            pass
+
+    def record(self, result: TestResult) -> None:
+        with self.lock:
+            if result.name in self.results:
+                return
+            self.results[result.name] = result
+            self.remaining -= 1
+            logger.info(f"{result.name}: {result} ({self.remaining} left)")
+            if self.remaining == 0:
+                self.done.set()
+
+    def run(self) -> dict[str, TestResult]:
+        host, port = self.server.server_address[:2]
+        logger.info(f"Serving {self.tasks.qsize()} tests on {host}:{port}")
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        try:
+            self.done.wait()
+            # Let the idle connections tell their workers to stop
+            time.sleep(POLL_INTERVAL)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+        return self.results
+
+
+def connect(address: tuple[str, int]) -> socket.socket:
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while True:
+        try:
+            return socket.create_connection(address)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(POLL_INTERVAL)
+
+
+def work(address: tuple[str, int], run: Callable[..., TestResult]) -> int:
+    """Run the tests the coordinator hands out until it has no more; returns
+    how many were run"""
+    ran = 0
+    with connect(address) as sock, sock.makefile("rb") as rfile, \
+            sock.makefile("wb") as wfile:
+        # The coordinator going away also ends the run
+        for line in rfile:
+            message = json.loads(line)
+            if "task" not in message:
+                break
+
+            result = run(**message["task"])
+            send(wfile, {"result": result.toJSON()})
+            ran += 1
+
+    return ran
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import sys
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+from typing import IO, Optional
+
+import dimacs_parser
+import helpers
+from formula import Formula
+
+
+logger = logging.getLogger(__name__)
+
+# Literals are encoded as 2 * var + sign, as in cdcl and in binary DRAT, so
+# the negation of a literal is lit ^ 1 and its variable is lit >> 1
+TRUE, FALSE, UNASSIGNED = 1, -1, 0
+NO_REASON = -1
+
+# Binary DRAT steps start with one of these, followed by the literals as
+# variable-length integers and a terminating zero byte
+BINARY_ADD, BINARY_DELETE = ord("a"), ord("d")
+
+
+def encode(lit: int) -> int:
+    return 2 * lit if lit > 0 else 2 * -lit + 1
+
+
+def decode(lit: int) -> int:
+    return -(lit >> 1) if lit & 1 else lit >> 1
+
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class ProofWriter:
+    """DRAT proof output of a solver, in text or binary format"""
+
+    def __init__(self, fout: IO[bytes], binary: bool = False) -> None:
+        self.fout = fout
+        self.binary = binary
+
+    def write(self, prefix: bytes, lits: Iterable[int]) -> None:
+        if self.binary:
+            self.fout.write(prefix + b"".join(map(varint, lits)) + b"\0")
+        else:
+            text = " ".join(map(str, map(decode, lits)))
+            self.fout.write(prefix + f"{text} 0\n".lstrip().encode())
+
+    def add(self, lits: Iterable[int]) -> None:
+        self.write(b"a" if self.binary else b"", lits)
+
+    def delete(self, lits: Iterable[int]) -> None:
+        self.write(b"d" if self.binary else b"d ", lits)
+
+
+def is_binary(head: bytes) -> bool:
+    """Text proofs start with a literal, a comment or "d "; binary ones with
+    an "a", or a "d" right followed by a literal"""
+    if not head:
+        return False
+
+    return head[0] == BINARY_ADD or \
+        (head[0] == BINARY_DELETE and head[1:2] not in (b" ", b""))
+
+
+def read_text(chunks: Iterator[bytes]) -> Iterator[tuple[bool, list[int]]]:
+    """(deletion, encoded literals) of every proof step"""
+    lits: list[int] = []
+    deletion = False
+    for chunk in chunks:
+        for token in dimacs_parser.COMMENT_LINE_RE.sub(b"", chunk).split():
+            if token == b"d":
+                deletion = True
+                continue
+
+            lit = int(token)
+            if lit == 0:
+                yield deletion, lits
+                lits = []
+                deletion = False
+            else:
+                lits.append(encode(lit))
+
+
+def read_binary(fin: IO[bytes]) -> Iterator[tuple[bool, list[int]]]:
+    lits: list[int] = []
+    deletion: Optional[bool] = None
+    value, shift = 0, 0
+    while chunk := fin.read(dimacs_parser.CHUNK_SIZE):
+        for byte in chunk:
+            if deletion is None:
+                if byte not in (BINARY_ADD, BINARY_DELETE):
+                    raise ValueError(f"invalid binary DRAT step {byte:#x}")
+                deletion = byte == BINARY_DELETE
+                continue
+
+            value |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+                continue
+
+            if value == 0:
+                yield deletion, lits
+                lits = []
+                deletion = None
+            else:
+                lits.append(value)
+            value, shift = 0, 0
+
+
+def read_proof(fin: IO[bytes]) -> Iterator[tuple[bool, list[int]]]:
+    """The steps of the proof, read as they are needed"""
+    head = fin.peek(2)[:2] if hasattr(fin, "peek") else b""
+    if is_binary(head):
+        return read_binary(fin)
+
+    return read_text(dimacs_parser.read_chunks(fin))
+
+
+class Checker:
+    """Backward DRAT checker. A forward pass adds the lemmas and applies the
+    deletions, propagating at the top level, until the first conflict; the
+    proof is read no further. The backward pass then undoes the steps one by
+    one and only checks the lemmas marked as used by the final conflict or
+    by the lemmas checked so far (core-first propagation, which prefers
+    clauses already marked, keeps that set small). The formula clauses left
+    marked at the end form an unsatisfiable core.
+
+    All the clauses sit in one flat literal buffer; the two watched literals
+    of a clause are its first two."""
+
+    def __init__(self, phi: Formula) -> None:
+        self.lits = array("i")
+        self.starts = array("q", [0])
+        self.pivots = array("i")
+        self.core = bytearray()
+        self.active = bytearray()
+        # Clause ids by the hash of their sorted literals, to find deleted ones
+        self.keys: dict[int, list[int]] = {}
+
+        # Indexed by literal (value, watches) or by variable, 0 unused
+        self.nvars = 0
+        self.value = [UNASSIGNED] * 2
+        self.reason = [NO_REASON]
+        self.position = [0]
+        self.watches: list[list[int]] = [[], []]
+        self.grow(phi.nvars)
+
+        self.trail: list[int] = []
+        self.head = 0
+        self.head_core = 0
+
+        # Clause id of every step, ~id for deletions, and the trail length
+        # before it
+        self.steps = array("q")
+        self.trail_at = array("q")
+        self.conflict: Optional[int] = None
+        self.ignored_deletions = 0
+        self.missing_deletions = 0
+
+        for idx in range(phi.nclauses):
+            # Duplicate literals would break the watches
+            self.add_clause(list(dict.fromkeys(map(encode, phi.clause(idx)))))
+        self.nformula = len(self.starts) - 1
+
+    def grow(self, nvars: int) -> None:
+        """Make room for variables up to nvars (RAT lemmas may add some)"""
+        if nvars <= self.nvars:
+            return
+
+        extra = nvars - self.nvars
+        self.value.extend([UNASSIGNED] * 2 * extra)
+        self.reason.extend([NO_REASON] * extra)
+        self.position.extend([0] * extra)
+        self.watches.extend([] for _ in range(2 * extra))
+        self.nvars = nvars
+
+    def add_clause(self, lits: list[int]) -> int:
+        cid = len(self.starts) - 1
+        self.lits.extend(lits)
+        self.starts.append(len(self.lits))
+        self.pivots.append(lits[0] if lits else 0)
+        self.core.append(0)
+        self.active.append(0)
+        self.keys.setdefault(hash(tuple(sorted(lits))), []).append(cid)
+        return cid
+
+    def clause(self, cid: int) -> array:
+        return self.lits[self.starts[cid]:self.starts[cid + 1]]
+
+    def find(self, lits: list[int]) -> Optional[int]:
+        key = sorted(lits)
+        candidates = self.keys.get(hash(tuple(key)), [])
+        for i, cid in enumerate(candidates):
+            if self.active[cid] and sorted(self.clause(cid)) == key:
+                del candidates[i]
+                return cid
+
+        return None
+
+    def assign(self, lit: int, reason: int) -> None:
+        var = lit >> 1
+        self.value[lit] = TRUE
+        self.value[lit ^ 1] = FALSE
+        self.reason[var] = reason
+        self.position[var] = len(self.trail)
+        self.trail.append(lit)
+
+    def unassign_to(self, length: int) -> None:
+        value, reason = self.value, self.reason
+        for lit in self.trail[length:]:
+            value[lit] = UNASSIGNED
+            value[lit ^ 1] = UNASSIGNED
+            reason[lit >> 1] = NO_REASON
+        del self.trail[length:]
+        self.head = min(self.head, length)
+        self.head_core = min(self.head_core, length)
+
+    def watch_rank(self, lit: int) -> tuple[bool, bool, int]:
+        """Non-false literals first, true ones foremost; among false ones,
+        the last assigned, which are the first to be unassigned again"""
+        value = self.value[lit]
+        return value != FALSE, value == TRUE, \
+            self.position[lit >> 1] if value == FALSE else 0
+
+    def attach(self, cid: int) -> None:
+        self.active[cid] = 1
+        s, e = self.starts[cid], self.starts[cid + 1]
+        if e - s < 2:
+            return
+
+        ordered = sorted(self.lits[s:e], key=self.watch_rank, reverse=True)
+        self.lits[s:e] = array("i", ordered)
+        self.watches[ordered[0]].append(cid)
+        self.watches[ordered[1]].append(cid)
+
+    def detach(self, cid: int) -> None:
+        self.active[cid] = 0
+        s, e = self.starts[cid], self.starts[cid + 1]
+        if e - s >= 2:
+            self.watches[self.lits[s]].remove(cid)
+            self.watches[self.lits[s + 1]].remove(cid)
+
+    def add(self, cid: int) -> Optional[int]:
+        """Attach a new clause and propagate what it implies; return the
+        conflicting clause, if any"""
+        self.attach(cid)
+        s, e = self.starts[cid], self.starts[cid + 1]
+        if s == e:
+            return cid
+
+        first = self.lits[s]
+        if self.value[first] == FALSE:
+            return cid
+        if self.value[first] == UNASSIGNED and \
+                (e - s == 1 or self.value[self.lits[s + 1]] == FALSE):
+            self.assign(first, cid)
+
+        return self.propagate(False)
+
+    def is_reason(self, cid: int) -> bool:
+        s, e = self.starts[cid], self.starts[cid + 1]
+        if s == e:
+            return False
+
+        first = self.lits[s]
+        return self.reason[first >> 1] == cid and self.value[first] == TRUE
+
+    def visit(self, false_lit: int, cls: Optional[int]) -> Optional[int]:
+        """Process the clauses watching a literal that just became false,
+        only the core (cls = 1) or non-core (cls = 0) ones if given"""
+        ws = self.watches[false_lit]
+        lits, starts, value, core = self.lits, self.starts, self.value, \
+            self.core
+        i = j = 0
+        n = len(ws)
+        while i < n:
+            cid = ws[i]
+            i += 1
+            if cls is not None and core[cid] != cls:
+                ws[j] = cid
+                j += 1
+                continue
+
+            s = starts[cid]
+            if lits[s] == false_lit:
+                lits[s] = lits[s + 1]
+                lits[s + 1] = false_lit
+            first = lits[s]
+            if value[first] == TRUE:
+                ws[j] = cid
+                j += 1
+                continue
+
+            for k in range(s + 2, starts[cid + 1]):
+                lit = lits[k]
+                if value[lit] != FALSE:
+                    lits[s + 1] = lit
+                    lits[k] = false_lit
+                    self.watches[lit].append(cid)
+                    break
+            else:
+                ws[j] = cid
+                j += 1
+                if value[first] == FALSE:
+                    ws[j:] = ws[i:]
+                    return cid
+                self.assign(first, cid)
+
+        del ws[j:]
+        return None
+
+    def propagate(self, core_first: bool) -> Optional[int]:
+        """Return the conflicting clause, if any. With core_first, a non-core
+        clause only propagates when the core ones have nothing left to."""
+        trail = self.trail
+        while True:
+            if core_first:
+                while self.head_core < len(trail):
+                    lit = trail[self.head_core]
+                    self.head_core += 1
+                    confl = self.visit(lit ^ 1, 1)
+                    if confl is not None:
+                        return confl
+
+            if self.head == len(trail):
+                return None
+
+            lit = trail[self.head]
+            self.head += 1
+            confl = self.visit(lit ^ 1, 0 if core_first else None)
+            if confl is not None:
+                return confl
+
+    def mark(self, cids: list[int], variables: Iterable[int] = ()) -> None:
+        """Mark the clauses, and the reasons of the assignments they (and the
+        given variables) depend on, as core"""
+        stack = list(cids)
+        stack.extend(self.reason[var] for var in variables
+                     if self.reason[var] != NO_REASON)
+        seen_vars: set[int] = set()
+        seen: set[int] = set()
+        lits, starts, value, reason = self.lits, self.starts, self.value, \
+            self.reason
+        while stack:
+            cid = stack.pop()
+            if cid in seen:
+                continue
+            seen.add(cid)
+            self.core[cid] = 1
+            for k in range(starts[cid], starts[cid + 1]):
+                var = lits[k] >> 1
+                if var in seen_vars or value[lits[k]] == UNASSIGNED:
+                    continue
+                seen_vars.add(var)
+                if reason[var] != NO_REASON:
+                    stack.append(reason[var])
+
+    def assume_negation(self, lits: Iterable[int]) -> Optional[int]:
+        """Assign the negations of the literals; return the variable of one
+        that is already true, if any"""
+        for lit in lits:
+            value = self.value[lit]
+            if value == TRUE:
+                return lit >> 1
+            if value == UNASSIGNED:
+                self.assign(lit ^ 1, NO_REASON)
+
+        return None
+
+    def has_rup(self, lits: Iterable[int]) -> bool:
+        """Whether the negation of the clause propagates to a conflict; the
+        assignments are left in place"""
+        satisfied = self.assume_negation(lits)
+        if satisfied is not None:
+            self.mark([], [satisfied])
+            return True
+
+        confl = self.propagate(True)
+        if confl is None:
+            return False
+
+        self.mark([confl])
+        return True
+
+    def verify(self, cid: int) -> bool:
+        """RUP, or else RAT on the lemma's first literal"""
+        saved = len(self.trail)
+        lemma = list(self.clause(cid))
+        if self.has_rup(lemma):
+            self.unassign_to(saved)
+            return True
+
+        ok = bool(lemma) and self.has_rat(cid, self.pivots[cid] ^ 1)
+        self.unassign_to(saved)
+        return ok
+
+    def has_rat(self, cid: int, negated_pivot: int) -> bool:
+        # The negation of the lemma stays assigned; every resolvent on the
+        # pivot only adds the negation of the other clause
+        for other in range(len(self.starts) - 1):
+            if not self.active[other] or other == cid:
+                continue
+
+            lits = self.clause(other)
+            if negated_pivot not in lits:
+                continue
+
+            saved = len(self.trail)
+            if not self.has_rup(lit for lit in lits if lit != negated_pivot):
+                return False
+            self.core[other] = 1
+            self.unassign_to(saved)
+
+        return True
+
+    def forward(self, steps: Iterator[tuple[bool, list[int]]]) -> bool:
+        """Apply the formula and the proof up to the first conflict; return
+        whether there was one"""
+        for cid in range(self.nformula):
+            confl = self.add(cid)
+            if confl is not None:
+                self.conflict = confl
+                return True
+
+        for deletion, lits in steps:
+            if deletion:
+                cid = self.find(lits)
+                if cid is None:
+                    self.missing_deletions += 1
+                    continue
+                # Unit clauses and reasons stay, as in drat-trim
+                if len(lits) <= 1 or self.is_reason(cid):
+                    self.ignored_deletions += 1
+                    self.keys[hash(tuple(sorted(lits)))].append(cid)
+                    continue
+
+                self.steps.append(~cid)
+                self.trail_at.append(len(self.trail))
+                self.detach(cid)
+                continue
+
+            if lits:
+                self.grow(max(lits) >> 1)
+            cid = self.add_clause(lits)
+            self.steps.append(cid)
+            self.trail_at.append(len(self.trail))
+            confl = self.add(cid)
+            if confl is not None:
+                self.conflict = confl
+                return True
+
+        return False
+
+    def backward(self) -> Optional[int]:
+        """Check the marked lemmas; return the index of the first (from the
+        end) that doesn't hold, if any"""
+        assert self.conflict is not None
+        self.head = self.head_core = len(self.trail)
+        self.mark([self.conflict])
+        for step in reversed(range(len(self.steps))):
+            cid = self.steps[step]
+            if cid < 0:
+                self.attach(~cid)
+                continue
+
+            if self.active[cid]:
+                self.detach(cid)
+            self.unassign_to(self.trail_at[step])
+            if self.core[cid] and not self.verify(cid):
+                return step
+
+        return None
+
+    def core_clauses(self) -> Iterator[list[int]]:
+        for cid in range(self.nformula):
+            if self.core[cid]:
+                yield list(map(decode, self.clause(cid)))
+
+
+def write_core(checker: Checker, nvars: int, fout: IO[str]) -> None:
+    clauses = list(checker.core_clauses())
+    fout.write(f"p cnf {nvars} {len(clauses)}\n")
+    for clause in clauses:
+        fout.write(" ".join(map(str, clause)) + " 0\n")
+
+
+def check_proof(phi: Formula, proofpath: str,
+                corepath: Optional[str] = None) -> bool:
+    """Whether the DRAT proof (text or binary, possibly compressed) refutes
+    the formula; the unsatisfiable core it uses is written to corepath"""
+    checker = Checker(phi)
+    try:
+        with dimacs_parser.open_binary(proofpath) as fin:
+            refuted = checker.forward(read_proof(fin))
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to read the proof: {e}")
+        return False
+
+    if checker.missing_deletions:
+        logger.warning(f"Ignored {checker.missing_deletions} deletions of "
+                       "clauses that aren't there")
+    if not refuted:
+        logger.error("The proof never leads to a conflict!")
+        return False
+
+    failed = checker.backward()
+    if failed is not None:
+        lemma = list(map(decode, checker.clause(checker.steps[failed])))
+        logger.error(f"Lemma {lemma} (step {failed + 1}) is neither RUP nor "
+                     "RAT!")
+        return False
+
+    nlemmas = sum(cid >= 0 for cid in checker.steps)
+    core_lemmas = sum(checker.core[cid] for cid in checker.steps if cid >= 0)
+    core = sum(checker.core[:checker.nformula])
+    logger.info(f"Verified with {core_lemmas}/{nlemmas} lemmas and "
+                f"{core}/{checker.nformula} formula clauses")
+    if corepath is not None:
+        with open(corepath, "w") as fout:
+            write_core(checker, phi.nvars, fout)
+
+    return True
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Backward DRAT proof "
+                                                    "checker")
+    argparser.add_argument("formula", help="Formula in DIMACS format")
+    argparser.add_argument("proof", help="DRAT proof, text or binary")
+    argparser.add_argument("--core", type=str,
+                           help="Write the unsatisfiable core used by the "
+                                "proof to this file, in DIMACS format")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(args.formula)
+    phi = parser.parse()
+    if phi is None:
+        logger.error("Failed to parse the formula file!")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    verified = check_proof(phi, args.proof, args.core)
+    logger.info(f"Checked in {time.perf_counter() - start:.3f} s")
+    print("s VERIFIED" if verified else "s NOT VERIFIED")
+    if not verified:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import json
+import logging
+import math
+import operator
+import os
+import statistics
+import tempfile
+from collections import Counter
+from collections.abc import Sequence
+from itertools import islice
+from typing import Optional
+
+import dimacs_parser
+import helpers
+from formula import Formula
+from formula_cache import hash_file
+
+
+logger = logging.getLogger(__name__)
+
+TESTDIR = "tests/"
+INFOBASENAME = "info.json"
+# The index of a level sits next to its info file
+FEATURESBASENAME = "features.json"
+
+VERSION = 1
+
+
+def extract(phi: Formula) -> dict:
+    """Structural features of the formula, all computed in bulk over the flat
+    clause buffers"""
+    lengths = list(map(operator.sub, islice(phi.offsets, 1, None),
+                       phi.offsets))
+    histogram = Counter(lengths)
+
+    # Occurrences of every literal, then of both polarities of every variable
+    counts = Counter(phi.lits)
+    variables = range(1, phi.nvars + 1)
+    pos = list(map(counts.__getitem__, variables))
+    neg = list(map(counts.__getitem__, map(operator.neg, variables)))
+    occurrences = list(map(operator.add, pos, neg))
+    used = [occ for occ in occurrences if occ]
+    # 0 when a variable occurs as often negated as not, 1 when it's pure
+    imbalance = [abs(p - n) / (p + n) for p, n in zip(pos, neg) if p + n]
+
+    return {
+        "nvars": phi.nvars,
+        "nclauses": phi.nclauses,
+        "nlits": len(phi.lits),
+        "ratio": phi.nclauses / phi.nvars,
+        "clause_lengths": {str(length): histogram[length]
+                           for length in sorted(histogram)},
+        "mean_clause_length": len(phi.lits) / max(phi.nclauses, 1),
+        "unused_vars": len(occurrences) - len(used),
+        "occurrences": {
+            "min": min(used, default=0),
+            "max": max(used, default=0),
+            "mean": statistics.fmean(used) if used else 0.0,
+            "stdev": statistics.pstdev(used) if used else 0.0,
+        },
+        "polarity_imbalance": statistics.fmean(imbalance)
+        if imbalance else 0.0,
+        "pure_vars": imbalance.count(1.0),
+    }
+
+
+def extract_file(path: str) -> Optional[dict]:
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(path)
+    phi = parser.parse()
+    if phi is None:
+        return None
+
+    return extract(phi)
+
+
+def index_entry(path: str) -> Optional[dict]:
+    features = extract_file(path)
+    if features is None:
+        return None
+
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "hash": hash_file(path).hex(), "features": features}
+
+
+def is_fresh(entry: Optional[dict], path: str) -> bool:
+    if entry is None:
+        return False
+
+    st = os.stat(path)
+    return entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+
+
+def get_levels() -> list[str]:
+    with open(os.path.join(TESTDIR, "in", INFOBASENAME)) as fin:
+        return json.load(fin)["levels"]
+
+
+def load_index(level: str) -> dict[str, dict]:
+    path = os.path.join(TESTDIR, "in", level, FEATURESBASENAME)
+    try:
+        with open(path) as fin:
+            index = json.load(fin)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if index.get("version") != VERSION:
+        return {}
+
+    return index["tests"]
+
+
+def save_index(level: str, entries: dict[str, dict]) -> None:
+    levelpath = os.path.join(TESTDIR, "in", level)
+    fd, tmppath = tempfile.mkstemp(dir=levelpath, suffix=".tmp")
+    with os.fdopen(fd, "w") as fout:
+        json.dump({"version": VERSION, "tests": entries}, fout, indent=4)
+    os.replace(tmppath, os.path.join(levelpath, FEATURESBASENAME))
+
+
+def level_features(level: str,
+                   pool: Optional[concurrent.futures.Executor] = None
+                   ) -> dict[str, dict]:
+    """Index entries of the tests of the level, (re)computing the missing and
+    stale ones and saving the index if any were"""
+    levelpath = os.path.join(TESTDIR, "in", level)
+    with open(os.path.join(levelpath, INFOBASENAME)) as fin:
+        tests = list(json.load(fin)["tests"])
+
+    index = load_index(level)
+    entries = {test: index[test] for test in tests
+               if is_fresh(index.get(test), os.path.join(levelpath, test))}
+    stale = [test for test in tests if test not in entries]
+    if not stale:
+        return entries
+
+    paths = [os.path.join(levelpath, test) for test in stale]
+    computed = pool.map(index_entry, paths) if pool is not None \
+        else map(index_entry, paths)
+    for test, path, entry in zip(stale, paths, computed):
+        if entry is None:
+            logger.error(f"Failed to parse {path}!")
+            continue
+        entries[test] = entry
+
+    save_index(level, entries)
+    return entries
+
+
+class CostModel:
+    """Runtime predicted from the features, by least squares on the log of
+    past timings. Until it has seen enough timings, the cost is the number
+    of literals: only the order of the tests matters for scheduling."""
+
+    # Ridge term, keeping the fit stable when the levels hardly vary in some
+    # feature (e.g. the clause length of random 3-SAT)
+    REGULARIZATION = 1e-3
+    # Timings needed per fitted weight before the fit is trusted
+    SAMPLES_PER_WEIGHT = 2
+
+    def __init__(self) -> None:
+        self.weights: Optional[list[float]] = None
+
+    @staticmethod
+    def regressors(features: dict) -> list[float]:
+        return [1.0, math.log(features["nclauses"] + 1),
+                math.log(features["nvars"] + 1), features["ratio"],
+                features["mean_clause_length"],
+                features["polarity_imbalance"]]
+
+    def fit(self, samples: Sequence[tuple[dict, float]]) -> None:
+        rows = [self.regressors(features) for features, _ in samples]
+        k = len(rows[0]) if rows else 0
+        if len(rows) < self.SAMPLES_PER_WEIGHT * k:
+            return
+
+        targets = [math.log(max(time, 1e-4)) for _, time in samples]
+        # Normal equations, (X^T X + rI) w = X^T y
+        a = [[sum(row[i] * row[j] for row in rows) +
+              (self.REGULARIZATION if i == j else 0.0)
+              for j in range(k)] for i in range(k)]
+        b = [sum(row[i] * y for row, y in zip(rows, targets))
+             for i in range(k)]
+        self.weights = solve(a, b)
+
+    def predict(self, features: dict) -> float:
+        if self.weights is None:
+            return float(features["nlits"])
+
+        x = self.regressors(features)
+        return math.exp(sum(map(operator.mul, self.weights, x)))
+
+
+def solve(a: list[list[float]], b: list[float]) -> Optional[list[float]]:
+    """Gaussian elimination with partial pivoting; None if singular"""
+    n = len(b)
+    m = [row[:] + [rhs] for row, rhs in zip(a, b)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(col + 1, n):
+            factor = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= factor * m[col][c]
+
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c]
+                              for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Structural features of "
+                                                    "the test instances")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    buildparser = subparsers.add_parser("build", help="Compute the feature "
+                                                      "index of every level")
+    buildparser.add_argument("--levels", nargs="+",
+                             help="Levels to index (default: all levels in "
+                                  "the tests directory)")
+    buildparser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                             help="Number of parallel workers (default: "
+                                  "%(default)s)")
+    showparser = subparsers.add_parser("show", help="Print the features of "
+                                                    "a level's tests")
+    showparser.add_argument("level")
+
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    if args.command == "build":
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.jobs) as pool:
+            for level in args.levels or get_levels():
+                entries = level_features(level, pool)
+                logger.info(f"{level}: {len(entries)} tests indexed")
+    elif args.command == "show":
+        print(f"{'test':<40} {'vars':>6} {'clauses':>8} {'ratio':>6} "
+              f"{'len':>5} {'occ':>7} {'imbal':>6}")
+        for test, entry in level_features(args.level).items():
+            f = entry["features"]
+            print(f"{test:<40} {f['nvars']:>6} {f['nclauses']:>8} "
+                  f"{f['ratio']:>6.2f} {f['mean_clause_length']:>5.2f} "
+                  f"{f['occurrences']['mean']:>7.2f} "
+                  f"{f['polarity_imbalance']:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
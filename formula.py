@@ -1,20 +1,118 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from itertools import repeat
+from typing import Optional, Union
+
 from clause import Clause
+from literal import Literal
+
+
+class ClauseView(Sequence):
+    """Lazy sequence of Clause objects over the flat literal buffer"""
+
+    def __init__(self, lits: Sequence[int], offsets: Sequence[int]) -> None:
+        self.lits = lits
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("clause index out of range")
+
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return Clause([Literal.from_int(lit) for lit in self.lits[start:end]])
+
+
+class LiteralView(Sequence):
+    """Lazy sequence of Literal objects over the flat literal buffer"""
+
+    def __init__(self, lits: Sequence[int]) -> None:
+        self.lits = lits
+
+    def __len__(self) -> int:
+        return len(self.lits)
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            return [Literal.from_int(lit) for lit in self.lits[idx]]
+
+        return Literal.from_int(self.lits[idx])
+
+
+class OccurrenceIndex:
+    """Clauses in which every variable occurs, laid out like the formula
+    itself: a flat buffer of clause indices plus nvars + 2 start offsets"""
+
+    def __init__(self, lits: Sequence[int], offsets: Sequence[int],
+                 nvars: int) -> None:
+        clause_of = array("q")
+        for idx, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            clause_of.extend(repeat(idx, end - start))
+
+        # A clause is listed once per variable, however many times it has it
+        pairs = sorted(set(zip(map(abs, lits), clause_of)))
+        self.clause_idxs = array("q", [idx for _, idx in pairs])
+        variables = [var for var, _ in pairs]
+        self.offsets = array("q", [bisect_left(variables, var)
+                                   for var in range(nvars + 2)])
+
+    def clauses(self, var: int) -> Sequence[int]:
+        return self.clause_idxs[self.offsets[var]:self.offsets[var + 1]]
 
 
 class Formula:
     def __init__(self, clauses: list[Clause]):
-        self.clauses = clauses
-        self.nclauses = len(self.clauses)
-        self.count_vars()
+        lits = array("i")
+        offsets = array("q", [0])
+        for cl in clauses:
+            lits.extend(lit.to_int() for lit in cl.literals)
+            offsets.append(len(lits))
 
-    def count_vars(self) -> None:
-        max_idx = 1
-        for cl in self.clauses:
-            for lit in cl.literals:
-                if lit.var.idx > max_idx:
-                    max_idx = lit.var.idx
+        self.set_buffers(lits, offsets)
+
+    @classmethod
+    def from_buffers(cls, lits: Sequence[int], offsets: Sequence[int],
+                     nvars: Optional[int] = None) -> "Formula":
+        """Build a formula straight from the flat DIMACS literals (without
+        the terminating zeros) and the nclauses + 1 clause start offsets"""
+        phi = cls.__new__(cls)
+        phi.set_buffers(lits, offsets, nvars)
+        return phi
 
-        self.nvars = max_idx
+    def set_buffers(self, lits: Sequence[int], offsets: Sequence[int],
+                    nvars: Optional[int] = None) -> None:
+        self.lits = lits
+        self.offsets = offsets
+        self.nclauses = len(self.offsets) - 1
+        if nvars is None:
+            self.count_vars()
+        else:
+            self.nvars = nvars
+
+    @property
+    def clauses(self) -> ClauseView:
+        return ClauseView(self.lits, self.offsets)
+
+    @property
+    def literals(self) -> LiteralView:
+        return LiteralView(self.lits)
+
+    def clause(self, idx: int) -> Sequence[int]:
+        return self.lits[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def occurrences(self) -> OccurrenceIndex:
+        return OccurrenceIndex(self.lits, self.offsets, self.nvars)
+
+    def count_vars(self) -> None:
+        self.nvars = max(max(map(abs, self.lits), default=1), 1)
 
     def __str__(self) -> str:
         return " ∧ ".join(str(clause) for clause in self.clauses)
@@ -24,5 +122,6 @@ class Formula:
 
     def to_dimacs(self) -> str:
         firstline = f"p cnf {self.nvars} {self.nclauses}\n"
-        clstrs = (cl.to_dimacs() for cl in self.clauses)
+        clstrs = (" ".join(map(str, self.clause(i))) + " 0"
+                  for i in range(self.nclauses))
         return firstline + "\n".join(clstrs) + "\n"
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from typing import Optional
+
+import dimacs_parser
+import helpers
+from formula import Formula
+
+
+logger = logging.getLogger(__name__)
+
+TESTDIR = "tests/"
+INFOBASENAME = "info.json"
+
+DEFAULT_CACHEDIR = ".formula_cache"
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+MAGIC = b"SATF"
+VERSION = 1
+# magic, version, source size, source mtime (ns), source sha256, nvars,
+# nclauses, nlits; followed by the int64 offsets and the int32 literals, both
+# in native byte order (the cache is local to the machine).
+HEADER = struct.Struct("=4sIqq32sqqq")
+
+
+def hash_file(path: str) -> bytes:
+    with open(path, "rb") as fin:
+        return hashlib.file_digest(fin, "sha256").digest()
+
+
+class FormulaCache:
+    def __init__(self, cachedir: str = DEFAULT_CACHEDIR,
+                 max_size: int = DEFAULT_MAX_SIZE,
+                 logger: Optional[logging.Logger] = None) -> None:
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.logger = logger or dimacs_parser.DummyLogger()
+        # Total size of the entries, scanned on the first store
+        self.size: Optional[int] = None
+        os.makedirs(self.cachedir, exist_ok=True)
+
+    def entry_path(self, path: str) -> str:
+        key = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.cachedir, f"{key}.formula")
+
+    def load(self, path: str) -> Optional[Formula]:
+        """Return the formula in path, parsing it only if the cache has no
+        up-to-date entry for it"""
+        st = os.stat(path)
+        entry = self.entry_path(path)
+        digest = None
+        try:
+            phi, digest = self.lookup(path, entry, st)
+        except (OSError, ValueError, struct.error) as e:
+            self.logger.debug(f"No usable cache entry for {path}: {e}")
+            phi = None
+
+        if phi is not None:
+            return phi
+
+        parser = dimacs_parser.FormulaParser(self.logger)
+        parser.set_path(path)
+        phi = parser.parse()
+        if phi is not None:
+            self.store(entry, phi, st, digest or hash_file(path))
+
+        return phi
+
+    def lookup(self, path: str, entry: str,
+               st: os.stat_result) -> tuple[Optional[Formula],
+                                            Optional[bytes]]:
+        """Return (cached formula or None if stale, source hash if it had to
+        be computed)"""
+        with open(entry, "rb") as fin:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, size, mtime, digest, nvars, nclauses, nlits = \
+            HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("bad cache entry header")
+        if len(mm) != HEADER.size + 8 * (nclauses + 1) + 4 * nlits:
+            raise ValueError("truncated cache entry")
+
+        # Size and mtime are only a shortcut; a touched but otherwise
+        # unchanged file still hits the cache through its content hash.
+        computed = None
+        if size != st.st_size or mtime != st.st_mtime_ns:
+            computed = hash_file(path)
+            if computed != digest:
+                return None, computed
+
+            self.write_header(entry, st, digest, nvars, nclauses, nlits)
+
+        offsets_start = HEADER.size
+        lits_start = offsets_start + 8 * (nclauses + 1)
+        view = memoryview(mm)
+        offsets = view[offsets_start:lits_start].cast("q")
+        lits = view[lits_start:lits_start + 4 * nlits].cast("i")
+
+        # Entries are evicted least recently used first
+        os.utime(entry)
+        return Formula.from_buffers(lits, offsets, nvars), computed
+
+    def write_header(self, entry: str, st: os.stat_result, digest: bytes,
+                     nvars: int, nclauses: int, nlits: int) -> None:
+        with open(entry, "r+b") as fout:
+            fout.write(HEADER.pack(MAGIC, VERSION, st.st_size,
+                                   st.st_mtime_ns, digest, nvars, nclauses,
+                                   nlits))
+
+    def store(self, entry: str, phi: Formula, st: os.stat_result,
+              digest: bytes) -> None:
+        fd, tmppath = tempfile.mkstemp(dir=self.cachedir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fout:
+            fout.write(HEADER.pack(MAGIC, VERSION, st.st_size,
+                                   st.st_mtime_ns, digest, phi.nvars,
+                                   phi.nclauses, len(phi.lits)))
+            fout.write(memoryview(phi.offsets).cast("B"))
+            fout.write(memoryview(phi.lits).cast("B"))
+
+        # Readers never see a half-written entry
+        os.replace(tmppath, entry)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += os.path.getsize(entry)
+        if self.size > self.max_size:
+            self.evict()
+
+    def entries(self) -> list[tuple[int, int, str]]:
+        """Return (mtime, size, path) of every entry, oldest first"""
+        entries = []
+        for dirent in os.scandir(self.cachedir):
+            if dirent.name.endswith(".formula"):
+                try:
+                    st = dirent.stat()
+                except FileNotFoundError:  # Evicted by another process
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, dirent.path))
+
+        entries.sort()
+        return entries
+
+    def evict(self) -> None:
+        entries = self.entries()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            os.remove(path)
+        self.size = 0
+
+
+worker_cache: Optional[FormulaCache] = None
+
+
+def init_warm_worker(cachedir: str, max_size: int) -> None:
+    global worker_cache
+    worker_cache = FormulaCache(cachedir, max_size, logger)
+
+
+def warm_one(path: str) -> bool:
+    assert worker_cache is not None
+    return worker_cache.load(path) is not None
+
+
+def warm(cache: FormulaCache, levels: list[str], jobs: int) -> None:
+    paths = []
+    for level in levels:
+        levelpath = os.path.join(TESTDIR, "in", level)
+        with open(os.path.join(levelpath, INFOBASENAME)) as fin:
+            tests = json.load(fin)["tests"]
+        paths.extend(os.path.join(levelpath, test) for test in tests)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_warm_worker,
+            initargs=(cache.cachedir, cache.max_size)) as pool:
+        loaded = pool.map(warm_one, paths, chunksize=16)
+        for path, ok in zip(paths, loaded):
+            if not ok:
+                logger.error(f"Failed to parse {path}!")
+
+    # Workers only see their own stores, so the bound is enforced here
+    cache.evict()
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Manage the cache of "
+                                                    "parsed formulas")
+    argparser.add_argument("--cachedir", type=str, default=DEFAULT_CACHEDIR,
+                           help="Cache directory (default: %(default)s)")
+    argparser.add_argument("--max-size", type=int,
+                           default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                           help="Cache size bound in MiB (default: "
+                                "%(default)s)")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    warmparser = subparsers.add_parser("warm", help="Parse and cache every "
+                                                    "test formula")
+    warmparser.add_argument("--levels", nargs="+",
+                            help="Levels to warm (default: all levels in the "
+                                 "tests directory)")
+    warmparser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                            help="Number of parallel workers (default: "
+                                 "%(default)s)")
+    subparsers.add_parser("clear", help="Remove every cache entry")
+
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+    cache = FormulaCache(args.cachedir, args.max_size * 1024 * 1024, logger)
+
+    if args.command == "warm":
+        levels = args.levels
+        if levels is None:
+            with open(os.path.join(TESTDIR, "in", INFOBASENAME)) as fin:
+                levels = json.load(fin)["levels"]
+        warm(cache, levels, args.jobs)
+    elif args.command == "clear":
+        cache.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+import argparse
+import bz2
+import gzip
+import json
+import logging
+import lzma
+import operator
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from collections.abc import Iterator
+from itertools import combinations, compress, count, repeat
+from typing import IO, Optional
+
+import cdcl
+import checker
+import dimacs_parser
+import helpers
+import native
+import validate
+from formula import Formula
+
+
+logger = logging.getLogger(__name__)
+
+TESTDIR = "tests/"
+INFOBASENAME = "info.json"
+
+# Clauses drawn (and written) at a time, bounding the memory of streaming
+CHUNK_CLAUSES = 1 << 16
+# Clause to variable ratio of the satisfiability threshold of random k-SAT
+THRESHOLDS = {2: 1.0, 3: 4.267, 4: 9.931, 5: 21.117, 6: 43.37, 7: 87.79}
+# Instances the labeler fails on are replaced, up to this many times the
+# number asked for
+MAX_ATTEMPTS = 4
+
+# Byte to literal sign, from the lowest bit (0xff is -1 as a signed byte)
+SIGNS = bytes(1 if b & 1 else 0xff for b in range(256))
+COMPRESSORS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def random_lits(rng: random.Random, nvars: int, nclauses: int,
+                k: int) -> array:
+    """Literals of nclauses clauses of k distinct variables each, drawn in
+    bulk from random bytes; the rare clauses that drew a variable twice are
+    drawn again"""
+    size = nclauses * k
+    draws = array("I")
+    draws.frombytes(rng.randbytes(4 * size))
+    # The modulo bias is below nvars / 2^32
+    variables = array("i", map(operator.add,
+                               map(operator.mod, draws, repeat(nvars)),
+                               repeat(1)))
+
+    # Column j holds the j-th variable of every clause
+    columns = [variables[j::k] for j in range(k)]
+    repeated = repeat(False, nclauses)
+    for a, b in combinations(columns, 2):
+        repeated = map(operator.or_, repeated, map(operator.eq, a, b))
+    for idx in compress(count(), list(repeated)):
+        variables[idx * k:(idx + 1) * k] = \
+            array("i", rng.sample(range(1, nvars + 1), k))
+
+    signs = array("b", rng.randbytes(size).translate(SIGNS))
+    return array("i", map(operator.mul, variables, signs))
+
+
+def clause_chunks(nvars: int, nclauses: int, k: int, seed: int,
+                  chunk_clauses: int = CHUNK_CLAUSES) -> Iterator[array]:
+    """The literals of the instance, CHUNK_CLAUSES clauses at a time; the
+    same seed always gives the same instance"""
+    if not 1 <= k <= nvars:
+        raise ValueError(f"can't draw {k} distinct variables out of {nvars}")
+
+    rng = random.Random(seed)
+    for first in range(0, nclauses, chunk_clauses):
+        yield random_lits(rng, nvars, min(chunk_clauses, nclauses - first), k)
+
+
+def generate(nvars: int, nclauses: int, k: int = 3, seed: int = 0) -> Formula:
+    """Uniform random k-SAT formula"""
+    lits = array("i")
+    for chunk in clause_chunks(nvars, nclauses, k, seed):
+        lits.extend(chunk)
+
+    return Formula.from_buffers(lits, array("q", range(0, len(lits) + 1, k)),
+                                nvars)
+
+
+def open_output(path: str) -> IO[str]:
+    """Open for writing, compressed if the extension says so"""
+    opener = COMPRESSORS.get(os.path.splitext(path)[1], open)
+    return opener(path, "wt")
+
+
+def write_random(path: str, nvars: int, nclauses: int, k: int = 3,
+                 seed: int = 0) -> None:
+    """Same instance as generate, streamed to disk one chunk at a time"""
+    line = " ".join(["%d"] * k) + " 0\n"
+    with open_output(path) as fout:
+        fout.write(f"c uniform random {k}-SAT, seed {seed}\n"
+                   f"p cnf {nvars} {nclauses}\n")
+        for lits in clause_chunks(nvars, nclauses, k, seed):
+            fout.write((line * (len(lits) // k)) % tuple(lits))
+
+
+def parse_formula(path: str) -> Optional[Formula]:
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(path)
+    return parser.parse()
+
+
+def label(path: str, timeout: float,
+          labeler: Optional[str] = None) -> Optional[bool]:
+    """Verdict of the instance from the CDCL engine, or from the labeler
+    binary (called as "labeler input output", like the solver); None if it
+    didn't finish in time. Models are always checked."""
+    phi = parse_formula(path)
+    if phi is None:
+        return None
+
+    if labeler is None:
+        answer = cdcl.Solver(phi).solve(time_limit=timeout)
+    else:
+        with tempfile.NamedTemporaryFile(suffix=".answer") as fans:
+            try:
+                subprocess.run([labeler, path, fans.name], timeout=timeout,
+                               check=True, capture_output=True)
+            except subprocess.TimeoutExpired:
+                return None
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Labeler failed on {path} (exit code "
+                             f"{e.returncode})!")
+                return None
+
+            ans_parser = dimacs_parser.AnswerParser(logger)
+            ans_parser.set_path(fans.name)
+            answer = ans_parser.parse()
+
+    if answer is None:
+        return None
+
+    verdict, model = answer
+    if verdict and (model is None or not validate.validate_model(phi, model)):
+        logger.error(f"The labeler gave a wrong model for {path}!")
+        return None
+
+    return verdict
+
+
+def test_name(nvars: int, nclauses: int, k: int, seed: int) -> str:
+    return f"rand{k}-{nvars}-{nclauses}-{seed}.cnf"
+
+
+def labeled_instances(dirpath: str, nvars: int, nclauses: int, k: int,
+                      ntests: int, seed: int, label_timeout: float,
+                      labeler: Optional[str] = None,
+                      verdict: Optional[bool] = None) -> dict[str, bool]:
+    """Write ntests labeled instances (only those with the given verdict, if
+    any) to the directory; return their verdicts by file name"""
+    tests: dict[str, bool] = {}
+    for attempt in range(MAX_ATTEMPTS * ntests):
+        if len(tests) == ntests:
+            break
+
+        name = test_name(nvars, nclauses, k, seed + attempt)
+        path = os.path.join(dirpath, name)
+        write_random(path, nvars, nclauses, k, seed + attempt)
+        test_verdict = label(path, label_timeout, labeler)
+        if test_verdict is None or \
+                (verdict is not None and test_verdict != verdict):
+            os.remove(path)
+            continue
+
+        tests[name] = test_verdict
+
+    if len(tests) < ntests:
+        logger.warning(f"Only {len(tests)}/{ntests} instances with n = "
+                       f"{nvars} could be labeled")
+    return tests
+
+
+def make_level(level: str, nvars: int, nclauses: int, k: int, ntests: int,
+               seed: int, timeout: float, label_timeout: float,
+               labeler: Optional[str] = None, verdict: Optional[bool] = None,
+               register: bool = False) -> dict[str, bool]:
+    """A test level of labeled instances, with its info file; registered
+    as the last level of the tests directory if asked to"""
+    levelpath = os.path.join(TESTDIR, "in", level)
+    os.makedirs(levelpath, exist_ok=True)
+    tests = labeled_instances(levelpath, nvars, nclauses, k, ntests, seed,
+                              label_timeout, labeler, verdict)
+    with open(os.path.join(levelpath, INFOBASENAME), "w") as fout:
+        json.dump({"timeout": timeout, "tests": tests}, fout, indent=4)
+
+    if register:
+        infopath = os.path.join(TESTDIR, "in", INFOBASENAME)
+        with open(infopath) as fin:
+            info = json.load(fin)
+        if level not in info["levels"]:
+            info["levels"].append(level)
+            with open(infopath, "w") as fout:
+                json.dump(info, fout, indent=4)
+
+    return tests
+
+
+def sweep(sizes: list[int], ratio: float, k: int, ntests: int, seed: int,
+          timeout: float, label_timeout: float,
+          labeler: Optional[str] = None,
+          in_process: bool = False) -> list[dict]:
+    """Run the solver through the checker (or, in process, through its
+    library) on labeled instances of every size; return a row of the scaling
+    curves per size"""
+    if in_process:
+        checker.run_cmd(["make", "lib"])
+        worker: Optional[native.Worker] = native.Worker()
+    else:
+        checker.run_cmd(["make", "build"])
+        worker = None
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="sweep-") as tmpdir:
+        for nvars in sizes:
+            nclauses = round(ratio * nvars)
+            tests = labeled_instances(tmpdir, nvars, nclauses, k, ntests,
+                                      seed, label_timeout, labeler)
+            results, walls = [], []
+            for name, ref_verdict in tests.items():
+                path = os.path.join(tmpdir, name)
+                start = time.perf_counter()
+                if worker is None:
+                    results.append(checker.run_test(name, path,
+                                                    path + ".answer",
+                                                    timeout, ref_verdict))
+                else:
+                    # Parsed fine when labeled
+                    phi = parse_formula(path)
+                    assert phi is not None
+                    results.append(native.run_test(worker, name, phi,
+                                                   timeout, ref_verdict))
+                walls.append(time.perf_counter() - start)
+                os.remove(path)
+
+            solved = [result for result in results if result.correct]
+            times = [result.time for result in solved]
+            # The library's worker outlives the tests, no RSS of its own
+            rss = [result.usage.maxrss / 1024 for result in results] \
+                if worker is None else []
+            rows.append({
+                "nvars": nvars, "nclauses": nclauses,
+                "tests": len(results),
+                "sat": sum(tests.values()),
+                "solved": len(solved),
+                "wrong": sum(not result.correct and not result.tle
+                             for result in results),
+                "tles": sum(result.tle for result in results),
+                "median_time": statistics.median(times) if times else None,
+                "max_time": max(times, default=None),
+                "median_rss_mib": statistics.median(rss) if rss else None,
+                # Wall time of the checker per test beyond the solver's
+                "harness_time": statistics.fmean(
+                    wall - min(result.time, result.timeout)
+                    for wall, result in zip(walls, results))
+                if results else None,
+            })
+            print_row(rows[-1], rows[-2] if len(rows) > 1 else None)
+
+    if worker is not None:
+        worker.stop()
+    return rows
+
+
+def print_header() -> None:
+    print(f"{'n':>6} {'m':>7} {'tests':>5} {'sat':>4} {'solved':>6} "
+          f"{'TLE':>4} {'median (s)':>10} {'max (s)':>8} {'growth':>7} "
+          f"{'RSS (MiB)':>9} {'harness (s)':>11}")
+
+
+def print_row(row: dict, previous: Optional[dict]) -> None:
+    def fmt(value: Optional[float], width: int, digits: int = 3) -> str:
+        return f"{'-':>{width}}" if value is None \
+            else f"{value:>{width}.{digits}f}"
+
+    growth = None
+    if previous is not None and previous["median_time"] and \
+            row["median_time"] is not None:
+        growth = row["median_time"] / previous["median_time"]
+    print(f"{row['nvars']:>6} {row['nclauses']:>7} {row['tests']:>5} "
+          f"{row['sat']:>4} {row['solved']:>6} {row['tles']:>4} "
+          f"{fmt(row['median_time'], 10)} {fmt(row['max_time'], 8)} "
+          f"{fmt(growth, 7, 2)} {fmt(row['median_rss_mib'], 9, 1)} "
+          f"{fmt(row['harness_time'], 11)}")
+
+
+def main() -> None:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--logdir", type=str,
+                        help="Name of the log directory (by default no "
+                        "logs are saved)")
+    common.add_argument("--loglevel", type=str, default="INFO",
+                        help="Lowest log level for which to record "
+                        "messages (default: %(default)s)")
+    common.add_argument("--logquiet", action="store_true",
+                        help="Suppress printing to stderr")
+
+    argparser = argparse.ArgumentParser(description="Uniform random k-SAT "
+                                                    "instances, test levels "
+                                                    "and scaling sweeps")
+    shape = argparse.ArgumentParser(add_help=False)
+    shape.add_argument("-k", type=int, default=3,
+                       help="Literals per clause (default: %(default)s)")
+    shape.add_argument("--ratio", type=float,
+                       help="Clauses per variable (default: the "
+                            "satisfiability threshold for k)")
+    shape.add_argument("--seed", type=int, default=0,
+                       help="Seed of the first instance, the others follow "
+                            "(default: %(default)s)")
+    labeling = argparse.ArgumentParser(add_help=False)
+    labeling.add_argument("--labeler", type=str,
+                          help="Solver binary labeling the instances "
+                               "(default: the CDCL engine)")
+    labeling.add_argument("--label-timeout", type=float, default=60.0,
+                          help="Instances not labeled in this many seconds "
+                               "are replaced (default: %(default)s)")
+
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    genparser = subparsers.add_parser("generate", parents=[common, shape],
+                                      help="Write one instance (compressed "
+                                           "if the name ends in .gz, .bz2 "
+                                           "or .xz)")
+    genparser.add_argument("output")
+    genparser.add_argument("-n", type=int, required=True,
+                           help="Number of variables")
+    genparser.add_argument("-m", type=int,
+                           help="Number of clauses (default: from --ratio)")
+
+    levelparser = subparsers.add_parser("level",
+                                        parents=[common, shape, labeling],
+                                        help="Write a labeled test level")
+    levelparser.add_argument("level", help="Name of the level directory")
+    levelparser.add_argument("-n", type=int, required=True,
+                             help="Number of variables")
+    levelparser.add_argument("-m", type=int,
+                             help="Number of clauses (default: from "
+                                  "--ratio)")
+    levelparser.add_argument("--tests", type=int, default=20,
+                             help="Number of instances (default: "
+                                  "%(default)s)")
+    levelparser.add_argument("--timeout", type=float, default=10.0,
+                             help="Timeout of the level (default: "
+                                  "%(default)s)")
+    levelparser.add_argument("--only", choices=["sat", "unsat"],
+                             help="Keep only instances with this verdict, "
+                                  "like the uf/uuf levels")
+    levelparser.add_argument("--register", action="store_true",
+                             help="Add the level to the tests' info file")
+
+    sweepparser = subparsers.add_parser("sweep",
+                                        parents=[common, shape, labeling],
+                                        help="Run the solver on instances of "
+                                             "growing size and print how its "
+                                             "runtime and memory grow")
+    sweepparser.add_argument("--sizes", type=int, nargs="+",
+                             default=[50, 75, 100, 125, 150, 175, 200],
+                             help="Numbers of variables (default: "
+                                  "%(default)s)")
+    sweepparser.add_argument("--tests", type=int, default=10,
+                             help="Instances per size (default: "
+                                  "%(default)s)")
+    sweepparser.add_argument("--timeout", type=float, default=10.0,
+                             help="Solver timeout per instance (default: "
+                                  "%(default)s)")
+    sweepparser.add_argument("--in-process", action="store_true",
+                             help="Call the solver through its shared "
+                                  "library (make lib) rather than run the "
+                                  "main binary")
+    sweepparser.add_argument("--json", type=str,
+                             help="Also save the curves to this file")
+
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+    checker.logger = logger
+
+    ratio = args.ratio if args.ratio is not None else THRESHOLDS.get(args.k)
+    if ratio is None and getattr(args, "m", None) is None:
+        logger.error(f"No known threshold for k = {args.k}, give --ratio!")
+        sys.exit(1)
+
+    smallest = min(args.sizes) if args.command == "sweep" else args.n
+    if not 1 <= args.k <= smallest:
+        logger.error(f"Can't draw {args.k} distinct variables out of "
+                     f"{smallest}!")
+        sys.exit(1)
+
+    if args.command == "generate":
+        nclauses = args.m if args.m is not None else round(ratio * args.n)
+        write_random(args.output, args.n, nclauses, args.k, args.seed)
+    elif args.command == "level":
+        nclauses = args.m if args.m is not None else round(ratio * args.n)
+        verdict = None if args.only is None else args.only == "sat"
+        tests = make_level(args.level, args.n, nclauses, args.k, args.tests,
+                           args.seed, args.timeout, args.label_timeout,
+                           args.labeler, verdict, args.register)
+        logger.info(f"{args.level}: {len(tests)} tests, "
+                    f"{sum(tests.values())} satisfiable")
+    elif args.command == "sweep":
+        print_header()
+        rows = sweep(args.sizes, ratio, args.k, args.tests, args.seed,
+                     args.timeout, args.label_timeout, args.labeler,
+                     args.in_process)
+        if args.json:
+            with open(args.json, "w") as fout:
+                json.dump({"ratio": ratio, "k": args.k, "rows": rows}, fout,
+                          indent=4)
+
+
+if __name__ == "__main__":
+    main()
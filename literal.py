@@ -6,6 +6,10 @@ class Literal:
         self.var: Var = var
         self.pos = pos
 
+    @classmethod
+    def from_int(cls, lit: int) -> "Literal":
+        return cls(Var(abs(lit)), lit > 0)
+
     def __str__(self) -> str:
         prefix = "" if self.pos else "¬"
         return prefix + str(self.var)
@@ -19,3 +23,6 @@ class Literal:
     def to_dimacs(self) -> str:
         prefix = "" if self.pos else "-"
         return prefix + str(self.var.idx)
+
+    def to_int(self) -> int:
+        return self.var.idx if self.pos else -self.var.idx
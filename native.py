@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+import argparse
+import ctypes
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from multiprocessing.connection import Connection
+from typing import Optional, Union
+
+import dimacs_parser
+import helpers
+import validate
+from dimacs_parser import Answer
+from formula import Formula
+from result import TestResult
+
+
+logger = logging.getLogger(__name__)
+
+# Built by make lib, from the same sources as the main binary
+LIBPATH = "./libsolver.so"
+
+# What goes through the pipe: nvars, nclauses and the raw literal and
+# offset buffers
+Request = tuple[int, int, bytes, bytes]
+
+# What Worker.solve returns instead of an answer when there's none
+TIMED_OUT = "timed out"
+CRASHED = "crashed"
+
+
+def load(path: str = LIBPATH) -> ctypes.CDLL:
+    """The solver library; raises OSError if it isn't there"""
+    lib = ctypes.CDLL(os.path.abspath(path))
+    lib.rezolvare.argtypes = [ctypes.c_int, ctypes.c_int,
+                              ctypes.POINTER(ctypes.c_int),
+                              ctypes.POINTER(ctypes.c_longlong),
+                              ctypes.POINTER(ctypes.c_int)]
+    lib.rezolvare.restype = ctypes.c_int
+    return lib
+
+
+def pack(phi: Formula) -> Request:
+    return (phi.nvars, phi.nclauses, memoryview(phi.lits).cast("B").tobytes(),
+            memoryview(phi.offsets).cast("B").tobytes())
+
+
+def call(lib: ctypes.CDLL, request: Request) -> tuple[bool, array]:
+    """Run the solver in this process (nothing stops it before it's done);
+    the verdict and the value of every variable (1, -1 or 0 if free)"""
+    nvars, nclauses, lits_bytes, offsets_bytes = request
+    lits, offsets = array("i"), array("q")
+    lits.frombytes(lits_bytes)
+    offsets.frombytes(offsets_bytes)
+    values = array("i", bytes(4 * nvars))
+
+    # ctypes wants a non-empty buffer even when there's nothing in it
+    lits.append(0)
+    values.append(0)
+    verdict = lib.rezolvare(
+        nvars, nclauses,
+        (ctypes.c_int * len(lits)).from_buffer(lits),
+        (ctypes.c_longlong * len(offsets)).from_buffer(offsets),
+        (ctypes.c_int * len(values)).from_buffer(values))
+    values.pop()
+
+    return bool(verdict), values
+
+
+def to_answer(verdict: bool, values: array) -> Answer:
+    if not verdict:
+        return (False, None)
+
+    # Free variables are written as true, like the main binary does
+    return (True, {var: value != -1
+                   for var, value in enumerate(values, start=1)})
+
+
+def solve_in_process(phi: Formula, path: str = LIBPATH) -> Answer:
+    return to_answer(*call(load(path), pack(phi)))
+
+
+def serve(conn: Connection, path: str) -> None:
+    """Loop of the worker process: solve every formula sent, until the pipe
+    is closed"""
+    lib = load(path)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+
+        start = time.process_time()
+        verdict, values = call(lib, request)
+        conn.send((verdict, values, time.process_time() - start))
+
+
+class Worker:
+    """A process calling the solver library, kept alive across calls and
+    killed (then replaced on the next call) when one runs out of time"""
+
+    def __init__(self, path: str = LIBPATH) -> None:
+        # Fail here rather than in the worker
+        load(path)
+        self.path = path
+        self.proc: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        # CPU time of the last call that finished, like the user + sys time
+        # the checker measures for the binary
+        self.cpu_time = 0.0
+
+    def start(self) -> None:
+        ctx = multiprocessing.get_context("fork")
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=serve, args=(child_conn, self.path),
+                                daemon=True)
+        self.proc.start()
+        child_conn.close()
+
+    def stop(self) -> None:
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.join()
+            self.proc = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def solve(self, phi: Formula,
+              timeout: Optional[float] = None) -> Union[Answer, str]:
+        """The answer, or TIMED_OUT or CRASHED if there's none"""
+        if self.proc is None:
+            self.start()
+        assert self.conn is not None
+
+        self.conn.send(pack(phi))
+        if not self.conn.poll(timeout):
+            logger.info(f"Time limit ({timeout} s) exceeded in the solver "
+                        "library!")
+            self.stop()
+            return TIMED_OUT
+
+        try:
+            verdict, values, self.cpu_time = self.conn.recv()
+        except EOFError:
+            logger.error("The solver library crashed!")
+            self.stop()
+            return CRASHED
+
+        return to_answer(verdict, values)
+
+    def __enter__(self) -> "Worker":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def run_test(worker: Worker, name: str, phi: Formula, timeout: float,
+             ref_verdict: bool) -> TestResult:
+    """checker.run_test through the solver library: no process to spawn, no
+    files to write and parse back"""
+    answer = worker.solve(phi, timeout)
+    if answer == TIMED_OUT:
+        return TestResult(float("inf"), timeout, ref_verdict=ref_verdict,
+                          valid=False, name=name)
+    if answer == CRASHED:
+        # Like a crash of the binary in checker.run_solver_direct
+        logger.error(f"The solver library crashed on {name}!")
+        sys.exit(1)
+
+    assert not isinstance(answer, str)
+    verdict, model = answer
+    valid = verdict == ref_verdict and \
+        (not verdict or validate.validate_model(phi, model))
+    return TestResult(worker.cpu_time, timeout, verdict, ref_verdict, valid,
+                      name=name)
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Run the C solver "
+                                                    "through its shared "
+                                                    "library (make lib)")
+    argparser.add_argument("input", help="Formula in DIMACS format")
+    argparser.add_argument("output", help="Answer file")
+    argparser.add_argument("--lib", type=str, default=LIBPATH,
+                           help="Path of the library (default: %(default)s)")
+    argparser.add_argument("--timeout", type=float,
+                           help="Kill the solver after this many seconds")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+    args = argparser.parse_args()
+    global logger
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(args.input)
+    phi = parser.parse()
+    if phi is None:
+        logger.error("Failed to parse the formula file!")
+        sys.exit(1)
+
+    try:
+        worker = Worker(args.lib)
+    except OSError as e:
+        logger.error(f"Can't load the solver library ({e}), run make lib!")
+        sys.exit(1)
+
+    with worker:
+        answer = worker.solve(phi, args.timeout)
+    if isinstance(answer, str):
+        sys.exit(1)
+
+    with open(args.output, "w") as fout:
+        fout.write(dimacs_parser.answer_to_dimacs(answer))
+
+
+if __name__ == "__main__":
+    main()
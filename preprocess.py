@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import time
+from array import array
+from collections import defaultdict
+from typing import Optional
+
+import cdcl
+import dimacs_parser
+import helpers
+import validate
+from dimacs_parser import Answer
+from formula import Formula
+from model import Model
+
+
+TESTDIR = "tests/"
+INFOBASENAME = "info.json"
+
+# Bounded variable elimination only tries variables with at most this many
+# occurrences, and gives up on one as soon as a resolvent gets longer than
+# BVE_MAX_RESOLVENT or the resolvents outnumber (or outsize) the clauses they
+# replace
+BVE_MAX_OCCURRENCES = 16
+BVE_MAX_RESOLVENT = 16
+# Subsumption skips clauses whose rarest variable occurs in more clauses
+# than this (dense formulas over few variables)
+SUBSUME_MAX_OCCURRENCES = 1000
+# Rounds of subsumption and elimination, each of which can enable the other
+MAX_ROUNDS = 3
+
+
+class Reconstruction:
+    """Maps models of a simplified formula back to models of the original.
+
+    The stack holds (witness literal, clause) pairs, in the order the
+    clauses were removed: units and pure literals as unit clauses, and every
+    clause of an eliminated variable. Going through it backwards, a clause
+    that isn't satisfied yet gets its witness set to true."""
+
+    def __init__(self, nvars: int, mapping: list[int],
+                 stack: list[tuple[int, list[int]]], unsat: bool = False):
+        self.nvars = nvars
+        # Original variable of every variable of the simplified formula
+        # (mapping[0] is unused)
+        self.mapping = mapping
+        self.stack = stack
+        # The preprocessing derived the empty clause
+        self.unsat = unsat
+
+    def extend(self, model: Model) -> Model:
+        values = {self.mapping[var]: value for var, value in model.items()
+                  if 0 < var < len(self.mapping)}
+        for witness, clause in reversed(self.stack):
+            # Variables without a value end up false, so they count as such
+            if not any(values.get(abs(lit), False) == (lit > 0)
+                       for lit in clause):
+                values[abs(witness)] = witness > 0
+
+        return {var: values.get(var, False)
+                for var in range(1, self.nvars + 1)}
+
+    def extend_answer(self, answer: Answer) -> Answer:
+        verdict, model = answer
+        if not verdict:
+            return answer
+
+        assert model is not None
+        return (True, self.extend(model))
+
+    def toJSON(self) -> dict:
+        return {
+            "nvars": self.nvars,
+            "mapping": self.mapping,
+            "stack": self.stack,
+            "unsat": self.unsat,
+        }
+
+    @classmethod
+    def fromJSON(cls, record: dict) -> "Reconstruction":
+        stack = [(witness, clause) for witness, clause in record["stack"]]
+        return cls(record["nvars"], record["mapping"], stack,
+                   record["unsat"])
+
+
+class Preprocessor:
+    def __init__(self, phi: Formula) -> None:
+        self.nvars = phi.nvars
+        # Removed clauses are set to None, so clause ids stay valid
+        self.clauses: list[Optional[list[int]]] = []
+        self.occurs: defaultdict[int, set[int]] = defaultdict(set)
+        self.stack: list[tuple[int, list[int]]] = []
+        # Variables fixed by units or pure literals, or eliminated
+        self.removed: set[int] = set()
+        self.units: list[int] = []
+        # Clauses added or strengthened since the last subsumption pass
+        self.touched: set[int] = set()
+        self.unsat = False
+
+        for i in range(phi.nclauses):
+            self.add_clause(phi.clause(i))
+
+    def add_clause(self, lits) -> None:
+        clause = list(dict.fromkeys(lits))  # Duplicate literals
+        if any(-lit in clause for lit in clause):  # Tautologies
+            return
+        if not clause:
+            self.unsat = True
+            return
+        if len(clause) == 1:
+            self.units.append(clause[0])
+
+        cid = len(self.clauses)
+        self.clauses.append(clause)
+        for lit in clause:
+            self.occurs[lit].add(cid)
+        self.touched.add(cid)
+
+    def remove_clause(self, cid: int) -> None:
+        clause = self.clauses[cid]
+        assert clause is not None
+        for lit in clause:
+            self.occurs[lit].discard(cid)
+        self.clauses[cid] = None
+        self.touched.discard(cid)
+
+    def strengthen(self, cid: int, lit: int) -> None:
+        """Remove lit from the clause"""
+        clause = self.clauses[cid]
+        assert clause is not None
+        clause.remove(lit)
+        self.occurs[lit].discard(cid)
+        self.touched.add(cid)
+        if not clause:
+            self.unsat = True
+        elif len(clause) == 1:
+            self.units.append(clause[0])
+
+    def fix(self, lit: int) -> None:
+        """Make lit true for good; its clauses go away"""
+        self.removed.add(abs(lit))
+        self.stack.append((lit, [lit]))
+        for cid in list(self.occurs[lit]):
+            self.remove_clause(cid)
+
+    def propagate(self) -> None:
+        while self.units and not self.unsat:
+            lit = self.units.pop()
+            if abs(lit) in self.removed:
+                # Either already fixed this way, or to the opposite value, in
+                # which case its negation would have emptied a clause
+                continue
+
+            self.fix(lit)
+            for cid in list(self.occurs[-lit]):
+                self.strengthen(cid, -lit)
+
+    def eliminate_pure_literals(self) -> None:
+        candidates = set(range(1, self.nvars + 1)) - self.removed
+        while candidates:
+            var = candidates.pop()
+            if var in self.removed:
+                continue
+
+            pos, neg = self.occurs[var], self.occurs[-var]
+            if pos and neg or not pos and not neg:
+                continue
+
+            lit = var if pos else -var
+            # Removing its clauses may leave their other literals pure
+            candidates.update(abs(other) for cid in self.occurs[lit]
+                              for other in self.clauses[cid])
+            candidates -= self.removed | {var}
+            self.fix(lit)
+
+    def subsume(self) -> None:
+        """Backward subsumption and self-subsuming resolution, from every
+        clause added or strengthened since the last pass"""
+        while self.touched and not self.unsat:
+            # Shorter clauses first, they subsume the most
+            batch = sorted(self.touched,
+                           key=lambda cid: len(self.clauses[cid]))
+            self.touched = set()
+            for cid in batch:
+                if self.unsat:
+                    return
+                if self.clauses[cid] is not None:
+                    self.subsume_with(cid)
+                    self.propagate()
+
+    def subsume_with(self, cid: int) -> None:
+        clause = self.clauses[cid]
+        assert clause is not None
+
+        def occurrences(var: int) -> int:
+            return len(self.occurs[var]) + len(self.occurs[-var])
+
+        # A clause subsuming another (possibly up to one flipped literal)
+        # shares its rarest variable with it
+        var = min(map(abs, clause), key=occurrences)
+        if occurrences(var) > SUBSUME_MAX_OCCURRENCES:
+            return
+
+        for other in self.occurs[var] | self.occurs[-var]:
+            target = self.clauses[other]
+            if other == cid or target is None or len(target) < len(clause):
+                continue
+
+            flipped = [lit for lit in clause if lit not in target]
+            if not flipped:
+                self.remove_clause(other)
+            elif len(flipped) == 1 and -flipped[0] in target:
+                # Resolving the two gives target without -flipped[0]
+                self.strengthen(other, -flipped[0])
+                if len(target) < len(clause):
+                    # ...which in turn subsumes clause
+                    self.remove_clause(cid)
+                    return
+                if self.unsat:
+                    return
+
+    @staticmethod
+    def resolve(pos: list[int], neg: list[int],
+                var: int) -> Optional[list[int]]:
+        """Return the resolvent on var, or None if it's a tautology"""
+        resolvent = [lit for lit in pos if lit != var]
+        for lit in neg:
+            if lit == -var or lit in resolvent:
+                continue
+            if -lit in resolvent:
+                return None
+            resolvent.append(lit)
+
+        return resolvent
+
+    def try_eliminate(self, var: int) -> None:
+        pos, neg = list(self.occurs[var]), list(self.occurs[-var])
+        if len(pos) + len(neg) > BVE_MAX_OCCURRENCES:
+            return
+
+        # Neither the clauses nor the literals may grow in number
+        budget = sum(len(self.clauses[cid]) for cid in pos + neg)
+        resolvents = []
+        for p in pos:
+            for n in neg:
+                resolvent = self.resolve(self.clauses[p], self.clauses[n],
+                                         var)
+                if resolvent is None:
+                    continue
+                budget -= len(resolvent)
+                if len(resolvent) > BVE_MAX_RESOLVENT or budget < 0 or \
+                        len(resolvents) == len(pos) + len(neg):
+                    return
+                resolvents.append(resolvent)
+
+        self.removed.add(var)
+        for cid, witness in [(p, var) for p in pos] + [(n, -var) for n in neg]:
+            self.stack.append((witness, self.clauses[cid]))
+            self.remove_clause(cid)
+        for resolvent in resolvents:
+            self.add_clause(resolvent)
+
+        self.propagate()
+
+    def eliminate_variables(self) -> None:
+        def cost(var: int) -> int:
+            return len(self.occurs[var]) * len(self.occurs[-var])
+
+        candidates = sorted(set(range(1, self.nvars + 1)) - self.removed,
+                            key=cost)
+        for var in candidates:
+            if self.unsat:
+                return
+            if var not in self.removed:
+                self.try_eliminate(var)
+
+    def run(self) -> tuple[Formula, Reconstruction]:
+        self.propagate()
+        for _ in range(MAX_ROUNDS):
+            if self.unsat:
+                break
+
+            nclauses = sum(clause is not None for clause in self.clauses)
+            self.eliminate_pure_literals()
+            self.subsume()
+            if not self.unsat:
+                self.eliminate_variables()
+            if sum(clause is not None for clause in self.clauses) == nclauses:
+                break
+
+        return self.result()
+
+    def result(self) -> tuple[Formula, Reconstruction]:
+        # The C solver reads neither the empty clause nor a formula without
+        # clauses, so these cases get a formula of one dummy variable, which
+        # the reconstruction ignores
+        if self.unsat:
+            phi = Formula.from_buffers(array("i", [1, -1]),
+                                       array("q", [0, 1, 2]), 1)
+            return phi, Reconstruction(self.nvars, [0], [], True)
+
+        clauses = [clause for clause in self.clauses if clause is not None]
+        if not clauses:
+            phi = Formula.from_buffers(array("i", [1]), array("q", [0, 1]), 1)
+            return phi, Reconstruction(self.nvars, [0], self.stack)
+        # Variables are renumbered densely, in their original order
+        mapping = [0] + sorted({abs(lit) for clause in clauses
+                                for lit in clause})
+        renumber = {var: new for new, var in enumerate(mapping)}
+
+        lits = array("i")
+        offsets = array("q", [0])
+        for clause in clauses:
+            lits.extend(renumber[lit] if lit > 0 else -renumber[-lit]
+                        for lit in clause)
+            offsets.append(len(lits))
+
+        phi = Formula.from_buffers(lits, offsets, len(mapping) - 1)
+        return phi, Reconstruction(self.nvars, mapping, self.stack)
+
+
+def preprocess(phi: Formula) -> tuple[Formula, Reconstruction]:
+    """Return the simplified formula and how to map its models back"""
+    return Preprocessor(phi).run()
+
+
+def parse_formula(path: str) -> Formula:
+    parser = dimacs_parser.FormulaParser()
+    parser.set_path(path)
+    phi = parser.parse()
+    assert phi is not None, f"Failed to parse {path}!"
+    return phi
+
+
+def report(levels: list[str], verify: bool) -> None:
+    """Size reduction per level; with verify, every simplified formula is
+    solved and its answer mapped back and checked against the original"""
+    print(f"{'level':<14} {'tests':>5} {'vars':>13} {'clauses':>13} "
+          f"{'literals':>15} {'reduction':>9} {'time (ms)':>9}")
+    for level in levels:
+        levelpath = os.path.join(TESTDIR, "in", level)
+        with open(os.path.join(levelpath, INFOBASENAME)) as fin:
+            tests = json.load(fin)["tests"]
+
+        before = [0, 0, 0]
+        after = [0, 0, 0]
+        elapsed = 0.0
+        for test, ref_verdict in tests.items():
+            path = os.path.join(levelpath, test)
+            phi = parse_formula(path)
+            start = time.perf_counter()
+            simplified, reconstruction = preprocess(phi)
+            elapsed += time.perf_counter() - start
+
+            for sizes, psi in ((before, phi), (after, simplified)):
+                sizes[0] += psi.nvars
+                sizes[1] += psi.nclauses
+                sizes[2] += len(psi.lits)
+
+            if verify:
+                check_answer(path, phi, simplified, reconstruction,
+                             ref_verdict)
+
+        n = len(tests)
+        cols = [f"{b / n:.0f}->{a / n:.0f}" for b, a in zip(before, after)]
+        reduction = 1 - after[2] / before[2] if before[2] else 0.0
+        print(f"{level:<14} {n:>5} {cols[0]:>13} {cols[1]:>13} "
+              f"{cols[2]:>15} {reduction:>8.1%} {1000 * elapsed / n:>9.2f}")
+
+
+def check_answer(path: str, phi: Formula, simplified: Formula,
+                 reconstruction: Reconstruction, ref_verdict: bool) -> None:
+    if reconstruction.unsat:
+        verdict, model = False, None
+    else:
+        verdict, model = reconstruction.extend_answer(cdcl.solve(simplified))
+
+    assert verdict == ref_verdict, f"Wrong verdict for {path}!"
+    assert not verdict or validate.validate_model(phi, model), \
+        f"Reconstructed model doesn't satisfy {path}!"
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="CNF preprocessing")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+
+    simplifyparser = subparsers.add_parser(
+        "simplify", help="Write the simplified formula and its "
+                         "reconstruction stack")
+    simplifyparser.add_argument("input", help="Formula in DIMACS format")
+    simplifyparser.add_argument("output", help="Simplified formula")
+    simplifyparser.add_argument("stack", help="Reconstruction stack (JSON)")
+
+    reconstructparser = subparsers.add_parser(
+        "reconstruct", help="Map an answer for the simplified formula back "
+                            "to the original one")
+    reconstructparser.add_argument("stack", help="Reconstruction stack")
+    reconstructparser.add_argument("answer", help="Answer for the simplified "
+                                                  "formula")
+    reconstructparser.add_argument("output", help="Answer for the original "
+                                                  "formula")
+
+    reportparser = subparsers.add_parser("report", help="Size reduction per "
+                                                        "level")
+    reportparser.add_argument("--levels", nargs="+",
+                              help="Levels to report on (default: all "
+                                   "levels in the tests directory)")
+    reportparser.add_argument("--verify", action="store_true",
+                              help="Solve every simplified formula and check "
+                                   "the reconstructed answer")
+
+    args = argparser.parse_args()
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    if args.command == "simplify":
+        parser = dimacs_parser.FormulaParser(logger)
+        parser.set_path(args.input)
+        phi = parser.parse()
+        assert phi is not None, "No formula was parsed!"
+
+        simplified, reconstruction = preprocess(phi)
+        with open(args.output, "w") as fout:
+            fout.write(simplified.to_dimacs())
+        with open(args.stack, "w") as fout:
+            json.dump(reconstruction.toJSON(), fout)
+    elif args.command == "reconstruct":
+        with open(args.stack) as fin:
+            reconstruction = Reconstruction.fromJSON(json.load(fin))
+
+        parser = dimacs_parser.AnswerParser(logger)
+        parser.set_path(args.answer)
+        answer = parser.parse()
+        assert answer is not None, "No answer was parsed!"
+        with open(args.output, "w") as fout:
+            fout.write(dimacs_parser.answer_to_dimacs(
+                reconstruction.extend_answer(answer)))
+    elif args.command == "report":
+        levels = args.levels
+        if levels is None:
+            with open(os.path.join(TESTDIR, "in", INFOBASENAME)) as fin:
+                levels = json.load(fin)["levels"]
+        report(levels, args.verify)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import contextlib
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import IO, Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Set by enable; while OUTDIR is None nothing is recorded and spans cost next
+# to nothing. Pool workers are forked, so they inherit the settings.
+OUTDIR: Optional[str] = None
+PYTHON = False
+MEMORY = False
+
+TRACEBASENAME = "trace.json"
+PSTATSBASENAME = "python.prof"
+# Every process appends its events to its own file, merged by finish()
+EVENTS_PATTERN = "events-{pid}.jsonl"
+# Spans of the harness phases proper; "detail" ones nest inside them and
+# "level" ones cover a whole level in the checker process
+PHASE, DETAIL, LEVEL = "phase", "detail", "level"
+TOP_ALLOCATIONS = 10
+
+# State of the current process, reset in forked children
+events_pid = 0
+events_file: Optional[IO[str]] = None
+python_profile: Optional[cProfile.Profile] = None
+# Arguments of the spans open in this process, innermost last
+open_spans: list[dict] = []
+
+
+def enable(outdir: str, python: bool = False, memory: bool = False) -> None:
+    global OUTDIR, PYTHON, MEMORY
+    os.makedirs(outdir, exist_ok=True)
+    for path in glob.glob(os.path.join(outdir,
+                                       EVENTS_PATTERN.format(pid="*"))):
+        os.remove(path)
+
+    OUTDIR, PYTHON, MEMORY = outdir, python, memory
+    if MEMORY:
+        tracemalloc.start()
+    process_state()
+
+
+def now() -> int:
+    # Monotonic across processes on Linux, so the tracks line up
+    return time.monotonic_ns()
+
+
+def process_state() -> IO[str]:
+    """The event file of this process, opened (and the profilers of the
+    parent, if forked, replaced) on first use"""
+    global events_pid, events_file, python_profile
+    pid = os.getpid()
+    if events_pid == pid and events_file is not None:
+        return events_file
+
+    assert OUTDIR is not None
+    events_pid = pid
+    events_file = open(os.path.join(OUTDIR, EVENTS_PATTERN.format(pid=pid)),
+                       "a")
+    if PYTHON:
+        if python_profile is not None:
+            python_profile.disable()
+        python_profile = cProfile.Profile()
+        python_profile.enable()
+
+    return events_file
+
+
+def emit(event: dict) -> None:
+    fout = process_state()
+    event.setdefault("pid", 1)
+    event.setdefault("tid", os.getpid())
+    # Flushed right away, pool workers exit without running any cleanup
+    fout.write(json.dumps(event) + "\n")
+    fout.flush()
+
+
+def complete(name: str, start: int, cat: str = PHASE, **args) -> None:
+    """A span from start (as returned by now) until now"""
+    if OUTDIR is None:
+        return
+
+    emit({"name": name, "cat": cat, "ph": "X", "ts": start / 1000,
+          "dur": (now() - start) / 1000, "args": args})
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str = PHASE, **args) -> Iterator[dict]:
+    """Time the block; what it adds to the yielded dict ends up in the
+    span's arguments"""
+    if OUTDIR is None:
+        yield args
+        return
+
+    process_state()
+    start = now()
+    open_spans.append(args)
+    try:
+        yield args
+    finally:
+        open_spans.pop()
+        complete(name, start, cat, **args)
+
+
+def count(key: str, amount: float) -> None:
+    """Add to an argument of the innermost open span"""
+    if open_spans:
+        open_spans[-1][key] = open_spans[-1].get(key, 0) + amount
+
+
+def checkpoint() -> None:
+    """Save what the process has measured so far; pool workers call it after
+    every test since they never get to call finish"""
+    if OUTDIR is None:
+        return
+
+    process_state()
+    if MEMORY:
+        current, peak = tracemalloc.get_traced_memory()
+        emit({"name": f"traced memory ({os.getpid()})", "ph": "C",
+              "ts": now() / 1000,
+              "args": {"current (MiB)": current / (1 << 20),
+                       "peak (MiB)": peak / (1 << 20)}})
+    if python_profile is not None:
+        # Dumping stops the profiler, the counts carry on once restarted
+        python_profile.dump_stats(os.path.join(OUTDIR,
+                                               f"python-{os.getpid()}.prof"))
+        python_profile.enable()
+
+
+def snapshot(label: str) -> None:
+    """Dump a tracemalloc snapshot of this process"""
+    if OUTDIR is None or not MEMORY:
+        return
+
+    path = os.path.join(OUTDIR, f"memory-{label.replace('/', '_')}"
+                                ".tracemalloc")
+    tracemalloc.take_snapshot().dump(path)
+
+
+def instrument_logging(log: logging.Logger) -> None:
+    """Time every record the handlers of the logger emit"""
+    for handler in log.handlers:
+        handle = handler.handle
+
+        def timed_handle(record: logging.LogRecord, handle=handle) -> bool:
+            with span("log"):
+                return handle(record)
+
+        handler.handle = timed_handle  # type: ignore[method-assign]
+
+
+def read_events() -> list[dict]:
+    assert OUTDIR is not None
+    events = []
+    for path in glob.glob(os.path.join(OUTDIR,
+                                       EVENTS_PATTERN.format(pid="*"))):
+        with open(path) as fin:
+            events.extend(map(json.loads, fin))
+        os.remove(path)
+
+    return events
+
+
+def track_names(events: list[dict]) -> list[dict]:
+    """Metadata naming the track of every process"""
+    main_pid = os.getpid()
+    tids = sorted({event["tid"] for event in events if "tid" in event})
+    return [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+             "args": {"name": "checker" if tid == main_pid
+                      else f"worker {tid}"}}
+            for tid in tids]
+
+
+def finish() -> list[dict]:
+    """Merge what every process recorded into the Chrome trace (and the
+    Python profile); return the events"""
+    if OUTDIR is None:
+        return []
+
+    if MEMORY:
+        snapshot("final")
+        top = tracemalloc.take_snapshot().statistics("lineno")
+        for stat in top[:TOP_ALLOCATIONS]:
+            logger.info(f"Allocated in the checker: {stat}")
+
+    checkpoint()
+    global events_file
+    if events_file is not None:
+        events_file.close()
+        events_file = None
+
+    events = read_events()
+    with open(os.path.join(OUTDIR, TRACEBASENAME), "w") as fout:
+        json.dump({"traceEvents": track_names(events) + events,
+                   "displayTimeUnit": "ms"}, fout)
+
+    if python_profile is not None:
+        python_profile.disable()
+        paths = glob.glob(os.path.join(OUTDIR, "python-*.prof"))
+        stats = pstats.Stats(*paths)
+        stats.dump_stats(os.path.join(OUTDIR, PSTATSBASENAME))
+        for path in paths:
+            os.remove(path)
+
+    return events
+
+
+def level_of(event: dict, levels: list[dict]) -> Optional[str]:
+    """The level of a span: that of its test, else the level span of the
+    checker process it started in"""
+    args = event.get("args", {})
+    if "level" in args:
+        return args["level"]
+    if "test" in args:
+        return args["test"].rpartition("/")[0]
+
+    for level in levels:
+        if level["ts"] <= event["ts"] < level["ts"] + level["dur"]:
+            return level["args"]["level"]
+
+    return None
+
+
+def summary(events: list[dict]) -> str:
+    """Harness overhead of every level: the share of its wall time (times the
+    number of solver slots, at most one per CPU) the solver didn't spend on
+    the CPU. Only what happens within the level counts: tests a lost level
+    leaves running finish in the background."""
+    levels = [event for event in events if event.get("cat") == LEVEL]
+    windows = {level["args"]["level"]: (level["ts"],
+                                        level["ts"] + level["dur"])
+               for level in levels}
+    phases: dict[Optional[str], dict[str, float]] = \
+        defaultdict(lambda: defaultdict(float))
+    solver: dict[str, float] = defaultdict(float)
+    for event in events:
+        if event.get("cat") != PHASE:
+            continue
+
+        level = level_of(event, levels)
+        start, end = event["ts"], event["ts"] + event["dur"]
+        if level in windows:
+            start = max(start, windows[level][0])
+            end = min(end, windows[level][1])
+        if end <= start:
+            continue
+
+        seconds = (end - start) / 1e6
+        phases[level][event["name"]] += seconds
+        if event["name"] == "solve":
+            # The share of the CPU time that falls within the level
+            cpu = event["args"].get("cpu")
+            solver[level] += seconds if cpu is None else \
+                min(cpu, event["dur"] / 1e6) * (end - start) / event["dur"]
+
+    lines = []
+    outside = phases.get(None, {})
+    if outside:
+        lines.append("Outside levels: " + ", ".join(
+            f"{name} {seconds:.3f} s" for name, seconds in outside.items()))
+
+    for level in levels:
+        name = level["args"]["level"]
+        wall = level["dur"] / 1e6
+        slots = level["args"].get("slots", 1)
+        overhead = 1 - solver[name] / (wall * slots) if wall else 0.0
+        breakdown = ", ".join(f"{phase} {seconds:.3f} s" for phase, seconds
+                              in sorted(phases[name].items()))
+        lines.append(f"{name}: wall {wall:.3f} s, solver {solver[name]:.3f} "
+                     f"s, harness overhead {100 * overhead:.1f}% "
+                     f"({breakdown})")
+
+    return "\n".join(lines)
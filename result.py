@@ -1,7 +1,72 @@
+import math
+from typing import Optional
+
+import resource
+
+import stats
+
+
+class Usage:
+    """Resources used by a solver run; memory in KiB, like ru_maxrss"""
+
+    def __init__(self, maxrss: int = 0, majflt: int = 0, minflt: int = 0,
+                 nvcsw: int = 0, nivcsw: int = 0) -> None:
+        self.maxrss: int = maxrss
+        # Major (I/O) and minor page faults
+        self.majflt: int = majflt
+        self.minflt: int = minflt
+        # Voluntary and involuntary context switches
+        self.nvcsw: int = nvcsw
+        self.nivcsw: int = nivcsw
+
+    @classmethod
+    def from_rusage(cls, rusage: resource.struct_rusage) -> "Usage":
+        return cls(rusage.ru_maxrss, rusage.ru_majflt, rusage.ru_minflt,
+                   rusage.ru_nvcsw, rusage.ru_nivcsw)
+
+    def merge(self, other: "Usage") -> "Usage":
+        """The worst of both runs, counter by counter"""
+        return Usage(max(self.maxrss, other.maxrss),
+                     max(self.majflt, other.majflt),
+                     max(self.minflt, other.minflt),
+                     max(self.nvcsw, other.nvcsw),
+                     max(self.nivcsw, other.nivcsw))
+
+    def __str__(self) -> str:
+        return f"{self.maxrss / 1024:.1f} MiB, flt {self.majflt}/" \
+               f"{self.minflt}, csw {self.nvcsw}/{self.nivcsw}"
+
+    def toJSON(self) -> dict:
+        return {
+            "maxrss": self.maxrss,
+            "majflt": self.majflt,
+            "minflt": self.minflt,
+            "nvcsw": self.nvcsw,
+            "nivcsw": self.nivcsw,
+        }
+
+    @classmethod
+    def fromJSON(cls, record: dict) -> "Usage":
+        return cls(record["maxrss"], record["majflt"], record["minflt"],
+                   record["nvcsw"], record["nivcsw"])
+
+
+def finite_or_none(time: float) -> Optional[float]:
+    """JSON has no infinity: the time of a TLE is written as null"""
+    return None if math.isinf(time) else time
+
+
+def inf_if_none(time: Optional[float]) -> float:
+    return math.inf if time is None else time
+
+
 class TestResult:
     def __init__(self, time: float = 0.0, timeout: float = 0.0,
                  verdict: bool = False, ref_verdict: bool = False,
-                 valid: bool = True):
+                 valid: bool = True, samples: Optional[list[float]] = None,
+                 name: str = "", usage: Optional[Usage] = None,
+                 mle: bool = False):
+        self.name: str = name
         self.time: float = time
         self.timeout: float = timeout
         self.verdict: bool = verdict
@@ -11,20 +76,63 @@ class TestResult:
         # correctly identified as SAT, this shows whether the model is correct.
         self.valid: bool = valid
 
+        # Every timing taken for the test when it's run repeatedly; time is
+        # then their median
+        self.samples: list[float] = samples if samples is not None else [time]
+
+        # Peak over the measured runs
+        self.usage: Usage = usage if usage is not None else Usage()
+        # Killed for going over the level's memory limit
+        self.mle: bool = mle
+
         # Everything below are just cached values that can be recalculated from
         # the test results
-        self.tle: bool = self.time > self.timeout
-        self.correct: bool = self.verdict == self.ref_verdict and self.valid
-        self.score = 2 * self.timeout if self.tle else self.time
+        self.tle: bool = not self.mle and self.time > self.timeout
+        self.correct: bool = self.verdict == self.ref_verdict and \
+            self.valid and not self.mle
+        self.score = 2 * self.timeout if self.tle or self.mle else self.time
 
     def __str__(self) -> str:
         if self.tle:
             return "TLE"
+        elif self.mle:
+            return f"MLE ({self.usage.maxrss / 1024:.1f} MiB)"
+        elif self.correct and len(self.samples) > 1:
+            return f"OK ({self.time:.2f}, " \
+                   f"IQR {stats.iqr(self.samples):.2f}, {self.usage})"
         elif self.correct:
-            return f"OK ({self.time:.2f})"
+            return f"OK ({self.time:.2f}, {self.usage})"
         else:
             return "WRONG"
 
+    def toJSON(self) -> dict:
+        record = {
+            "name": self.name,
+            "time": finite_or_none(self.time),
+            "timeout": self.timeout,
+            "verdict": self.verdict,
+            "ref_verdict": self.ref_verdict,
+            "valid": self.valid,
+            "samples": list(map(finite_or_none, self.samples)),
+            "mle": self.mle,
+            "usage": self.usage.toJSON(),
+        }
+        if len(self.samples) > 1 and not self.tle:
+            record["median"] = stats.median(self.samples)
+            record["iqr"] = stats.iqr(self.samples)
+            record["ci"] = list(stats.bootstrap_ci(self.samples))
+
+        return record
+
+    @classmethod
+    def fromJSON(cls, record: dict) -> "TestResult":
+        # Records written before memory was tracked have no usage
+        usage = Usage.fromJSON(record["usage"]) if "usage" in record else None
+        return cls(inf_if_none(record["time"]), record["timeout"],
+                   record["verdict"], record["ref_verdict"], record["valid"],
+                   list(map(inf_if_none, record["samples"])), record["name"],
+                   usage, record.get("mle", False))
+
 
 class LevelResult:
     def __init__(self) -> None:
@@ -47,6 +155,13 @@ class LevelResult:
         self.sat_tles: int = 0
         self.unsat_tles: int = 0
 
+        self.mles: int = 0
+        self.sat_mles: int = 0
+        self.unsat_mles: int = 0
+
+        # Peak RSS over all the tests, and the other counters summed up
+        self.usage: Usage = Usage()
+
         self.time: float = 0.0
         self.sat_time: float = 0.0
         self.unsat_time: float = 0.0
@@ -59,7 +174,14 @@ class LevelResult:
         self.test_results.append(test_result)
         self.tests_run += 1
         self.tles += test_result.tle
+        self.mles += test_result.mle
         self.score += test_result.score
+        usage = test_result.usage
+        self.usage = Usage(max(self.usage.maxrss, usage.maxrss),
+                           self.usage.majflt + usage.majflt,
+                           self.usage.minflt + usage.minflt,
+                           self.usage.nvcsw + usage.nvcsw,
+                           self.usage.nivcsw + usage.nivcsw)
         if test_result.tle:
             test_time = test_result.timeout
         else:
@@ -70,20 +192,23 @@ class LevelResult:
         if test_result.ref_verdict:
             self.sat_run += 1
             self.sat_tles += test_result.tle
+            self.sat_mles += test_result.mle
             self.sat_score += test_result.score
             self.sat_time += test_time
             self.sat_solved += test_result.correct
         else:
             self.unsat_run += 1
             self.unsat_tles += test_result.tle
+            self.unsat_mles += test_result.mle
             self.unsat_score += test_result.score
             self.unsat_time += test_time
             self.unsat_solved += test_result.correct
 
         self.solved += test_result.correct
 
-        # The validity of TLE tests is undefined
-        if not test_result.tle and not test_result.correct:
+        # The validity of TLE and MLE tests is undefined
+        if not test_result.tle and not test_result.mle and \
+                not test_result.correct:
             self.valid = False
             self.passed = False
 
@@ -104,6 +229,10 @@ class FinalResult(LevelResult):
                f"Tests solved: {self.solved} (SAT: {self.sat_solved}, UNSAT: {self.unsat_solved})\n" \
                f"Time: {self.time:.2f} (SAT: {self.sat_time:.2f}, UNSAT: {self.unsat_time:.2f})\n" \
                f"TLEs: {self.tles} (SAT: {self.sat_tles}, UNSAT: {self.unsat_tles})\n" \
+               f"MLEs: {self.mles} (SAT: {self.sat_mles}, UNSAT: {self.unsat_mles})\n" \
+               f"Peak RSS: {self.usage.maxrss / 1024:.1f} MiB\n" \
+               f"Page faults: {self.usage.majflt} major, {self.usage.minflt} minor\n" \
+               f"Context switches: {self.usage.nvcsw} voluntary, {self.usage.nivcsw} involuntary\n" \
                f"Score: {self.score:.2f} (SAT: {self.sat_score:.2f}, UNSAT: {self.unsat_score:.2f})"
 
     def toJSON(self) -> dict:
@@ -121,6 +250,14 @@ class FinalResult(LevelResult):
             "tle": self.tles,
             "sat_tle": self.sat_tles,
             "unsat_tle": self.unsat_tles,
+            "mle": self.mles,
+            "sat_mle": self.sat_mles,
+            "unsat_mle": self.unsat_mles,
+            "maxrss": self.usage.maxrss,
+            "majflt": self.usage.majflt,
+            "minflt": self.usage.minflt,
+            "nvcsw": self.usage.nvcsw,
+            "nivcsw": self.usage.nivcsw,
             "score": self.score,
             "sat_score": self.sat_score,
             "unsat_score": self.unsat_score,
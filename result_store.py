@@ -0,0 +1,93 @@
+import glob
+import json
+import os
+from collections.abc import Iterator
+from typing import Optional
+
+from formula_cache import hash_file
+from result import TestResult
+
+
+DEFAULT_STOREDIR = ".results"
+
+
+def read_records(path: str) -> Iterator[dict]:
+    try:
+        fin = open(path)
+    except FileNotFoundError:
+        return
+
+    with fin:
+        for line in fin:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def all_records(storedir: str = DEFAULT_STOREDIR) -> Iterator[dict]:
+    """The stored results of every solver binary"""
+    for path in sorted(glob.glob(os.path.join(storedir, "*.jsonl"))):
+        yield from read_records(path)
+
+
+class ResultStore:
+    """Persistent test results of one solver binary, keyed by the content hash
+    of the test file, the timeout and the memory limit. Results validated
+    with and without proofs are kept apart, an UNSAT answer only counts for
+    the mode it was checked in.
+
+    Results are appended to a JSON lines file named after the hash of the
+    binary, and flushed one by one, so an interrupted run loses at most the
+    test it was in the middle of."""
+
+    def __init__(self, solver: str, storedir: str = DEFAULT_STOREDIR,
+                 proofs: bool = False) -> None:
+        os.makedirs(storedir, exist_ok=True)
+        self.proofs = proofs
+        self.solver_hash = hash_file(solver).hex()
+        self.path = os.path.join(storedir, f"{self.solver_hash}.jsonl")
+        self.records: dict[tuple[str, float, Optional[int]], dict] = {}
+        self.load()
+
+        self.fout = open(self.path, "a")
+        # A run killed mid-write leaves a torn last line; start a fresh one
+        if self.fout.tell() > 0 and not self.ends_with_newline():
+            self.fout.write("\n")
+
+    def ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as fin:
+            fin.seek(-1, os.SEEK_END)
+            return fin.read(1) == b"\n"
+
+    def load(self) -> None:
+        for record in read_records(self.path):
+            if record.get("proofs", False) != self.proofs:
+                continue
+            # Later records supersede earlier ones (re-measurements); records
+            # written before memory limits were keyed on had none
+            key = (record["test_hash"], record["timeout"],
+                   record.get("memory_limit"))
+            self.records[key] = record
+
+    def get(self, test_hash: str, timeout: float,
+            memory_limit: Optional[int] = None) -> Optional[TestResult]:
+        record = self.records.get((test_hash, timeout, memory_limit))
+        if record is None:
+            return None
+
+        return TestResult.fromJSON(record)
+
+    def put(self, test_hash: str, result: TestResult,
+            memory_limit: Optional[int] = None) -> None:
+        record = result.toJSON()
+        record["test_hash"] = test_hash
+        record["proofs"] = self.proofs
+        record["memory_limit"] = memory_limit
+        self.records[(test_hash, result.timeout, memory_limit)] = record
+        self.fout.write(json.dumps(record, allow_nan=False) + "\n")
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+
+    def close(self) -> None:
+        self.fout.close()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import multiprocessing
+import random
+import sys
+import time
+from itertools import accumulate
+from typing import Optional
+
+import dimacs_parser
+import helpers
+from dimacs_parser import Answer
+from formula import Formula
+from model import Model
+
+
+# Literals are indexed 2 * var for x and 2 * var + 1 for not x, as in cdcl,
+# so with value[var] in {0, 1} the true literal of var is 2 * var + 1 -
+# value[var] and the false one is its ^ 1.
+
+# probSAT's polynomial break distribution, (EPS + break) ** -CB, with the
+# constants tuned for random 3-SAT in the probSAT paper
+PROBSAT_CB = 2.38
+PROBSAT_EPS = 1.0
+# WalkSAT/SKC noise, the best value on random 3-SAT
+WALKSAT_NOISE = 0.567
+
+DEFAULT_MAX_FLIPS = 1_000_000
+DEFAULT_TRIES = 100
+# How many flips go by between checks of the deadline and the stop signal
+CHECK_INTERVAL = 4096
+
+
+class Walker:
+    """One local search try. Every clause keeps its number of true literals
+    and the XOR of their variables, which is the critical variable whenever
+    the clause has a single true literal; from those, the break score (the
+    clauses a flip would make false) and the make score (the false clauses it
+    would make true) of every variable are kept up to date flip by flip. The
+    false clauses are kept in a list with the position of each, for O(1)
+    insertion, removal and random choice."""
+
+    def __init__(self, phi: Formula, seed: int = 0,
+                 algorithm: str = "probsat") -> None:
+        self.nvars = phi.nvars
+        self.rng = random.Random(seed)
+        self.algorithm = algorithm
+        self.flips = 0
+        # An empty clause can't be satisfied, whatever the assignment
+        self.trivially_unsat = False
+
+        # Duplicate literals are dropped and tautologies skipped, so that
+        # the true literal counts and the XORs stay meaningful
+        self.clause_vars: list[tuple[int, ...]] = []
+        self.occurrences: list[list[int]] = \
+            [[] for _ in range(2 * (self.nvars + 1))]
+        for idx in range(phi.nclauses):
+            lits = set(phi.clause(idx))
+            if not lits:
+                self.trivially_unsat = True
+            if any(-lit in lits for lit in lits):
+                continue
+
+            clause = len(self.clause_vars)
+            self.clause_vars.append(tuple(abs(lit) for lit in lits))
+            for lit in lits:
+                self.occurrences[2 * lit if lit > 0 else
+                                 -2 * lit + 1].append(clause)
+
+        nclauses = len(self.clause_vars)
+        self.value = [0] * (self.nvars + 1)
+        self.numtrue = [0] * nclauses
+        self.truexor = [0] * nclauses
+        self.breaks = [0] * (self.nvars + 1)
+        self.makes = [0] * (self.nvars + 1)
+        self.unsat: list[int] = []
+        self.where = [0] * nclauses
+
+        # Probability weights of breaks 0, 1, ... (no variable can break
+        # more clauses than it occurs in)
+        most = max(map(len, self.occurrences), default=0)
+        self.weight = [(PROBSAT_EPS + b) ** -PROBSAT_CB
+                       for b in range(most + 1)]
+
+    def randomize(self) -> None:
+        """Start over from a random assignment"""
+        rng = self.rng
+        value = self.value
+        for var in range(1, self.nvars + 1):
+            value[var] = rng.getrandbits(1)
+
+        numtrue, truexor = self.numtrue, self.truexor
+        breaks, makes = self.breaks, self.makes
+        numtrue[:] = [0] * len(numtrue)
+        truexor[:] = [0] * len(truexor)
+        breaks[:] = [0] * len(breaks)
+        makes[:] = [0] * len(makes)
+        for var in range(1, self.nvars + 1):
+            for clause in self.occurrences[2 * var + 1 - value[var]]:
+                numtrue[clause] += 1
+                truexor[clause] ^= var
+
+        self.unsat.clear()
+        for clause, vars in enumerate(self.clause_vars):
+            if numtrue[clause] == 1:
+                breaks[truexor[clause]] += 1
+            elif numtrue[clause] == 0:
+                self.where[clause] = len(self.unsat)
+                self.unsat.append(clause)
+                for var in vars:
+                    makes[var] += 1
+
+    def flip(self, var: int) -> None:
+        value, numtrue, truexor = self.value, self.numtrue, self.truexor
+        breaks, makes = self.breaks, self.makes
+        unsat, where = self.unsat, self.where
+        clause_vars = self.clause_vars
+
+        falling = 2 * var + 1 - value[var]
+        value[var] ^= 1
+        for clause in self.occurrences[falling ^ 1]:
+            count = numtrue[clause] + 1
+            numtrue[clause] = count
+            if count == 1:
+                # Satisfied now, by var alone
+                last = unsat.pop()
+                if last != clause:
+                    pos = where[clause]
+                    unsat[pos] = last
+                    where[last] = pos
+                for other in clause_vars[clause]:
+                    makes[other] -= 1
+                breaks[var] += 1
+            elif count == 2:
+                # The formerly critical variable isn't anymore
+                breaks[truexor[clause]] -= 1
+            truexor[clause] ^= var
+
+        for clause in self.occurrences[falling]:
+            count = numtrue[clause] - 1
+            numtrue[clause] = count
+            truexor[clause] ^= var
+            if count == 0:
+                where[clause] = len(unsat)
+                unsat.append(clause)
+                for other in clause_vars[clause]:
+                    makes[other] += 1
+                breaks[var] -= 1
+            elif count == 1:
+                breaks[truexor[clause]] += 1
+
+        self.flips += 1
+
+    def pick_probsat(self, vars: tuple[int, ...]) -> int:
+        weight, breaks = self.weight, self.breaks
+        cumulative = list(accumulate(weight[breaks[var]] for var in vars))
+        threshold = self.rng.random() * cumulative[-1]
+        for var, bound in zip(vars, cumulative):
+            if threshold < bound:
+                return var
+
+        return vars[-1]
+
+    def pick_walksat(self, vars: tuple[int, ...]) -> int:
+        breaks = self.breaks
+        best = min(vars, key=breaks.__getitem__)
+        # Freebie moves are always taken
+        if breaks[best] == 0 or self.rng.random() >= WALKSAT_NOISE:
+            return best
+
+        return self.rng.choice(vars)
+
+    def walk(self, max_flips: int, deadline: Optional[float] = None,
+             stop=None) -> Optional[Model]:
+        """Return a model, or None if none was found within max_flips, by the
+        deadline or before the stop event was set"""
+        if self.trivially_unsat:
+            return None
+
+        self.randomize()
+        pick = self.pick_probsat if self.algorithm == "probsat" \
+            else self.pick_walksat
+        unsat, clause_vars = self.unsat, self.clause_vars
+        rng = self.rng
+        for flips in range(max_flips):
+            if not unsat:
+                return {var: bool(self.value[var])
+                        for var in range(1, self.nvars + 1)}
+
+            if flips % CHECK_INTERVAL == 0 and flips:
+                if deadline is not None and time.monotonic() > deadline:
+                    return None
+                if stop is not None and stop.is_set():
+                    return None
+
+            clause = unsat[rng.randrange(len(unsat))]
+            self.flip(pick(clause_vars[clause]))
+
+        return None if unsat else {var: bool(self.value[var])
+                                   for var in range(1, self.nvars + 1)}
+
+
+# Per worker process: the walker, built once from the formula, and the event
+# that tells the tries still running that another one found a model
+worker_walker: Optional[Walker] = None
+worker_stop = None
+
+
+def init_worker(phi: Formula, algorithm: str, stop) -> None:
+    global worker_walker, worker_stop
+    worker_walker = Walker(phi, algorithm=algorithm)
+    worker_stop = stop
+
+
+def run_try(seed: int, max_flips: int,
+            deadline: Optional[float]) -> tuple[Optional[Model], int]:
+    """Return the model found, if any, and the number of flips made"""
+    assert worker_walker is not None
+    worker_walker.rng.seed(seed)
+    worker_walker.flips = 0
+    model = worker_walker.walk(max_flips, deadline, worker_stop)
+    if model is not None:
+        worker_stop.set()
+
+    return model, worker_walker.flips
+
+
+def solve(phi: Formula, tries: int = DEFAULT_TRIES,
+          max_flips: int = DEFAULT_MAX_FLIPS, jobs: int = 1, seed: int = 0,
+          algorithm: str = "probsat", time_limit: Optional[float] = None
+          ) -> tuple[Optional[Answer], int]:
+    """Independent tries from random assignments, several at a time with
+    jobs > 1. Returns the answer (None if no model was found; the search
+    can't tell an unsatisfiable formula apart, unless it has an empty
+    clause) and the total number of flips."""
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    if jobs == 1:
+        walker = Walker(phi, algorithm=algorithm)
+        if walker.trivially_unsat:
+            return (False, None), 0
+
+        for i in range(tries):
+            walker.rng.seed(seed + i)
+            model = walker.walk(max_flips, deadline)
+            if model is not None:
+                return (True, model), walker.flips
+            if deadline is not None and time.monotonic() > deadline:
+                break
+
+        return None, walker.flips
+
+    if any(start == end for start, end in zip(phi.offsets,
+                                               phi.offsets[1:])):
+        return (False, None), 0
+
+    stop = multiprocessing.Event()
+    flips = 0
+    answer = None
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_worker,
+            initargs=(phi, algorithm, stop)) as pool:
+        futures = [pool.submit(run_try, seed + i, max_flips, deadline)
+                   for i in range(tries)]
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            model, try_flips = future.result()
+            flips += try_flips
+            if model is not None and answer is None:
+                answer = (True, model)
+                for other in futures:
+                    other.cancel()
+
+    return answer, flips
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Stochastic local search "
+                                                    "SAT solver (probSAT, "
+                                                    "WalkSAT); it finds "
+                                                    "models but can't prove "
+                                                    "unsatisfiability")
+    argparser.add_argument("input", help="Formula in DIMACS format")
+    argparser.add_argument("output", help="Answer file")
+    argparser.add_argument("--algorithm", choices=["probsat", "walksat"],
+                           default="probsat",
+                           help="Variable selection (default: %(default)s)")
+    argparser.add_argument("--tries", type=int, default=DEFAULT_TRIES,
+                           help="Restarts from a random assignment (default: "
+                                "%(default)s)")
+    argparser.add_argument("--max-flips", type=int, default=DEFAULT_MAX_FLIPS,
+                           help="Flips per try (default: %(default)s)")
+    argparser.add_argument("--jobs", type=int, default=1,
+                           help="Tries run in parallel (default: "
+                                "%(default)s)")
+    argparser.add_argument("--seed", type=int, default=0,
+                           help="Seed of the first try, the others follow "
+                                "(default: %(default)s)")
+    argparser.add_argument("--time-limit", type=float,
+                           help="Give up after this many seconds")
+    argparser.add_argument("--logdir", type=str,
+                           help="Name of the log directory (by default no "
+                           "logs are saved)")
+    argparser.add_argument("--loglevel", type=str, default="INFO",
+                           help="Lowest log level for which to record "
+                           "messages (default: %(default)s)")
+    argparser.add_argument("--logquiet", action="store_true",
+                           help="Suppress printing to stderr")
+
+    args = argparser.parse_args()
+    logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
+
+    parser = dimacs_parser.FormulaParser(logger)
+    parser.set_path(args.input)
+    phi = parser.parse()
+    assert phi is not None, "No formula was parsed!"
+
+    answer, flips = solve(phi, args.tries, args.max_flips, args.jobs,
+                          args.seed, args.algorithm, args.time_limit)
+    if answer is None:
+        logger.error(f"No model found after {flips} flips!")
+        sys.exit(1)
+
+    with open(args.output, "w") as fout:
+        fout.write(dimacs_parser.answer_to_dimacs(answer))
+
+
+if __name__ == "__main__":
+    main()
@@ -58,6 +58,32 @@ expresie citire() {
     return ex;
 }
 
+// construirea expresiei din vectorii de literali si de offset-uri ai unei formule
+// (clauza i are literalii literali[offseturi[i]] ... literali[offseturi[i + 1] - 1])
+expresie din_buffere(int nr_op, int nr_p, const int *literali, const long long *offseturi) {
+    expresie ex;
+    ex.nr_op = nr_op;
+    ex.nr_p = nr_p;
+    ex.paranteze = calloc(ex.nr_p, sizeof(date));
+
+    for (int i = 0; i < ex.nr_p; i++) {
+        (ex.paranteze + i)->operatori = calloc(ex.nr_op, sizeof(int));
+        for (long long j = *(offseturi + i); j < *(offseturi + i + 1); j++) {
+            int lit = *(literali + j);
+            *((ex.paranteze + i)->operatori + abs(lit) - 1) = lit < 0 ? -1 : 1;
+        }
+    }
+    return ex;
+}
+
+// eliberarea memoriei unei expresii
+void eliberare(expresie ex) {
+    for (int i = 0; i < ex.nr_p; i++) {
+        free((ex.paranteze + i)->operatori);
+    }
+    free(ex.paranteze);
+}
+
 // verifica daca o singura clauza da 1 pe valorile curente
 int verif_paranteza(date *paranteza, int *satisf, int nr_op) {
     for (int i = 0; i < nr_op; i++) {
@@ -197,4 +223,15 @@ void afisare(expresie ex, int solv, int *satisf) {
     } else {
         printf("s UNSATISFIABLE\n");
     }
-}
\ No newline at end of file
+}
+
+// punctul de intrare al bibliotecii (make lib): rezolva formula data prin vectori
+// si scrie in valori 1 / -1 / 0 pentru fiecare operand; intoarce 1 daca e satisfiabila
+int rezolvare(int nr_op, int nr_p, const int *literali, const long long *offseturi, int *valori) {
+    expresie ex = din_buffere(nr_op, nr_p, literali, offseturi);
+    memset(valori, 0, ex.nr_op * sizeof(int));
+
+    int solv = bkt(ex, valori, 0);
+    eliberare(ex);
+    return solv;
+}
@@ -14,8 +14,11 @@ typedef struct expresie {
 
 int next_numar (char **string);
 expresie citire();
+expresie din_buffere(int nr_op, int nr_p, const int *literali, const long long *offseturi);
+void eliberare(expresie ex);
 int verif_paranteza(date *paranteza, int *satisf, int nr_op);
 int verif(expresie ex,int *satisf);
 int unit_propag(expresie ex, int *satisf);
 int bkt(expresie ex, int *satisf, int p);
-void afisare(expresie ex, int solv, int *satisf);
\ No newline at end of file
+void afisare(expresie ex, int solv, int *satisf);
+int rezolvare(int nr_op, int nr_p, const int *literali, const long long *offseturi, int *valori);
\ No newline at end of file
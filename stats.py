@@ -0,0 +1,72 @@
+import math
+import random
+import statistics
+from collections.abc import Sequence
+from typing import Callable, Optional
+
+
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+
+def median(samples: Sequence[float]) -> float:
+    return statistics.median(samples)
+
+
+def quantile(samples: Sequence[float], q: float) -> float:
+    """Linearly interpolated quantile, q in [0, 1]"""
+    ordered = sorted(samples)
+    pos = q * (len(ordered) - 1)
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    if lo == hi or ordered[lo] == ordered[hi]:
+        # Also keeps inf endpoints from interpolating to inf - inf = nan
+        return ordered[lo]
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def ratio(a: float, b: float) -> float:
+    """a / b, where two zero times are equally fast"""
+    if b > 0:
+        return a / b
+    return 1.0 if a == 0 else math.inf
+
+
+def iqr(samples: Sequence[float]) -> float:
+    return quantile(samples, 0.75) - quantile(samples, 0.25)
+
+
+def bootstrap_ci(samples: Sequence[float],
+                 statistic: Callable[[Sequence[float]], float] = median,
+                 resamples: int = BOOTSTRAP_RESAMPLES,
+                 confidence: float = CONFIDENCE,
+                 rng: Optional[random.Random] = None) -> tuple[float, float]:
+    """Percentile bootstrap confidence interval of the statistic"""
+    rng = rng or random.Random(0)
+    n = len(samples)
+    estimates = [statistic(rng.choices(samples, k=n))
+                 for _ in range(resamples)]
+    alpha = (1 - confidence) / 2
+    return quantile(estimates, alpha), quantile(estimates, 1 - alpha)
+
+
+def bootstrap_ratio_ci(baseline: Sequence[float], candidate: Sequence[float],
+                       resamples: int = BOOTSTRAP_RESAMPLES,
+                       confidence: float = CONFIDENCE,
+                       rng: Optional[random.Random] = None
+                       ) -> tuple[float, float]:
+    """Confidence interval of median(baseline) / median(candidate), i.e. of
+    the speedup of the candidate"""
+    rng = rng or random.Random(0)
+    estimates = []
+    for _ in range(resamples):
+        a = median(rng.choices(baseline, k=len(baseline)))
+        b = median(rng.choices(candidate, k=len(candidate)))
+        estimates.append(ratio(a, b))
+
+    alpha = (1 - confidence) / 2
+    return quantile(estimates, alpha), quantile(estimates, 1 - alpha)
+
+
+def geometric_mean(values: Sequence[float]) -> float:
+    return math.exp(sum(map(math.log, values)) / len(values))
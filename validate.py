@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 import argparse
 import logging
+import mmap
+import operator
+import os
 import sys
+from collections.abc import Iterator, Sequence
+from itertools import compress, count, repeat
+from typing import Optional
 
 import helpers
 import dimacs_parser
+import drat
+import profiler
+from formula_cache import FormulaCache
 from literal import Literal
 from clause import Clause
 from formula import Formula
@@ -13,6 +22,30 @@ from model import Model
 
 logger = logging.getLogger(__name__)
 
+# When set, formulas are loaded through the on-disk cache of parsed formulas
+cache: Optional[FormulaCache] = None
+
+# Truth values of literals, one byte each
+FALSE, TRUE, MISSING = 0, 1, 2
+NEGATE = bytes.maketrans(b"\x00\x01", b"\x01\x00")
+# Truth value given to the terminating zeros when streaming, so that the
+# truth values of a chunk split into clauses
+SEPARATOR = 3
+
+# Formulas are streamed in chunks of about this many bytes (cut at lines)
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+class BatchVerdict:
+    def __init__(self, satisfied: list[bytes], verdicts: list[bool],
+                 falsified: list[list[int]]) -> None:
+        # One row per model, one byte (0 or 1) per clause
+        self.satisfied: list[bytes] = satisfied
+        # Same as validate_model would return for every model
+        self.verdicts: list[bool] = verdicts
+        # Indices of the clauses with no true literal, for every model
+        self.falsified: list[list[int]] = falsified
+
 
 def evaluate_literal(lit: Literal, model: Model) -> bool:
     return model[lit.var.idx] == lit.pos
@@ -26,24 +59,208 @@ def evaluate_formula(phi: Formula, model: Model) -> bool:
     return all(evaluate_clause(cl, model) for cl in phi.clauses)
 
 
+def model_to_table(model: Model, nvars: int) -> bytes:
+    """Truth value of every literal, indexed by its DIMACS number (negative
+    literals wrap around to the end of the table)"""
+    values = bytearray([MISSING]) * (nvars + 1)
+    for idx, value in model.items():
+        if 0 < idx <= nvars:
+            values[idx] = value
+
+    return bytes(values) + values[:0:-1].translate(NEGATE)
+
+
+def clause_slices(phi: Formula) -> Sequence[slice]:
+    return list(map(slice, phi.offsets, phi.offsets[1:]))
+
+
+def first_failure(phi: Formula, truth: bytes,
+                  slices: Sequence[slice]) -> tuple[Optional[int], int]:
+    """Return (index of the first clause on which the sequential evaluation
+    stops, variable without a value that stopped it or 0)"""
+    for idx, chunk in enumerate(map(truth.__getitem__, slices)):
+        rest = chunk.lstrip(b"\x00")
+        if rest[:1] == b"\x01":
+            continue
+
+        if not rest:
+            return idx, 0
+
+        litpos = phi.offsets[idx] + len(chunk) - len(rest)
+        return idx, abs(phi.lits[litpos])
+
+    return None, 0
+
+
+def evaluate_models(phi: Formula, models: Sequence[Model]) -> BatchVerdict:
+    slices = clause_slices(phi)
+    satisfied, verdicts, falsified = [], [], []
+    for model in models:
+        truth = bytes(map(model_to_table(model, phi.nvars).__getitem__,
+                          phi.lits))
+        sat = bytes(map(operator.contains,
+                        map(truth.__getitem__, slices), repeat(TRUE)))
+        satisfied.append(sat)
+        falsified.append(list(compress(count(), map(operator.not_, sat))))
+
+        if MISSING not in truth:
+            verdicts.append(FALSE not in sat)
+            continue
+
+        # The sequential evaluation only fails on a missing value if it
+        # reaches the variable before finding a true literal in its clause
+        # (or a falsified clause before it).
+        failed, missing = first_failure(phi, truth, slices)
+        if missing:
+            logger.error(f"Model provides no value for variable: {missing}")
+
+        verdicts.append(failed is None)
+
+    return BatchVerdict(satisfied, verdicts, falsified)
+
+
 def validate_model(phi: Formula, model: Model) -> bool:
-    try:
-        return evaluate_formula(phi, model)
-    except KeyError as e:
-        logger.error(f"Model provides no value for variable: {e.args[0]}")
-        return False
+    return evaluate_models(phi, [model]).verdicts[0]
+
+
+def broken_clauses(phi: Formula, model: Model) -> dict[int, list[int]]:
+    """Return the falsified clauses each variable occurs in, for every
+    variable of a falsified clause"""
+    batch = evaluate_models(phi, [model])
+    satisfied = batch.satisfied[0]
+    wrong = sorted({abs(lit) for idx in batch.falsified[0]
+                    for lit in phi.clause(idx)})
+
+    index = phi.occurrences()
+    return {var: [idx for idx in index.clauses(var) if not satisfied[idx]]
+            for var in wrong}
+
+
+def stream_chunks(mm: mmap.mmap) -> Iterator[bytes]:
+    start = 0
+    while start < len(mm):
+        end = mm.find(b"\n", start + STREAM_CHUNK_SIZE) + 1 or len(mm)
+        yield mm[start:end]
+        start = end
+
+
+def stream_validate_model(formulapath: str, model: Model) -> Optional[bool]:
+    """Same as validate_model, but the clauses are evaluated as the formula
+    is tokenized and the file is only read up to the first clause on which
+    the sequential evaluation stops.
+
+    Returns None when the formula has to go through FormulaParser instead
+    (malformed input, which it reports). Input errors past the stopping
+    point go unnoticed; the answer is wrong either way."""
+    if dimacs_parser.compression_opener(formulapath) is not None:
+        with dimacs_parser.open_binary(formulapath) as fin:
+            return evaluate_stream(
+                dimacs_parser.read_chunks(fin, STREAM_CHUNK_SIZE), model)
+
+    with open(formulapath, "rb") as fin:
+        try:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files can't be mapped
+            return None
+
+    with mm:
+        return evaluate_stream(stream_chunks(mm), model)
 
 
-def validate(formulapath: str, anspath: str,
-             ref_verdict: bool) -> tuple[bool, bool]:
-    """Return (given_verdict, correct)"""
-    formula_parser = dimacs_parser.FormulaParser(logger)
-    formula_parser.set_path(formulapath)
-    formula = formula_parser.parse()
+def evaluate_stream(chunks: Iterator[bytes], model: Model) -> Optional[bool]:
+    bound = max(model, default=0)
+    table = bytearray(model_to_table(model, bound))
+    table[0] = SEPARATOR
+
+    nvars = None
+    nclauses = None
+    header_pending = True
+    carry: list[int] = []  # Literals of the clause cut by the chunk boundary
+    seen = 0
+    for chunk in chunks:
+        body = dimacs_parser.COMMENT_LINE_RE.sub(b"", chunk)
+        if header_pending:
+            if not body:
+                continue
+
+            header_pending = False
+            firstline, _, rest = body.partition(b"\n")
+            if firstline.startswith(b"p cnf "):
+                try:
+                    _, _, vs, cs = firstline.split()
+                    nvars, nclauses = int(vs), int(cs)
+                except ValueError:
+                    return None
+                body = rest
+
+        marker = dimacs_parser.END_MARKER_RE.search(body)
+        if marker is not None:
+            body = body[:marker.start()]
+
+        if body.translate(None, dimacs_parser.LITERAL_CHARS):
+            return None
+        try:
+            values = carry + list(map(int, body.split()))
+        except ValueError:
+            return None
+
+        if values:
+            top = max(max(values), -min(values))
+            if nvars is not None and top > nvars:
+                return None
+            if top > bound:
+                bound = top
+                table = bytearray(model_to_table(model, bound))
+                table[0] = SEPARATOR
+
+        truth = bytes(map(table.__getitem__, values))
+        clauses = truth.split(b"\x03")
+        # The last piece is the start of a clause cut by the chunk boundary
+        carry = values[len(values) - len(clauses[-1]):] if clauses[-1] else []
+        del clauses[-1]
+        seen += len(clauses)
+
+        # Without missing values the sequential evaluation can only stop on a
+        # clause with no true literal, which is cheap to rule out in bulk
+        if MISSING in truth or \
+                not all(map(bytes.__contains__, clauses, repeat(TRUE))):
+            pos = 0
+            for clause in clauses:
+                rest = clause.lstrip(b"\x00")
+                if rest[:1] != b"\x01":
+                    if rest:
+                        missing = abs(values[pos + len(clause) - len(rest)])
+                        logger.error("Model provides no value for variable: "
+                                     f"{missing}")
+                    return False
+                pos += len(clause) + 1
+
+        if marker is not None:
+            break
+
+    if header_pending:  # Nothing but comments
+        return None
+    if nclauses is not None and seen != nclauses:
+        return None
+
+    return True
+
+
+def load_formula(formulapath: str) -> Formula:
+    if cache is not None:
+        formula = cache.load(formulapath)
+    else:
+        formula_parser = dimacs_parser.FormulaParser(logger)
+        formula_parser.set_path(formulapath)
+        formula = formula_parser.parse()
     if formula is None:
         logger.error("Failed to parse the formula file!")
         sys.exit(1)
 
+    return formula
+
+
+def load_answer(anspath: str) -> dimacs_parser.Answer:
     ans_parser = dimacs_parser.AnswerParser(logger)
     ans_parser.set_path(anspath)
     answer = ans_parser.parse()
@@ -52,26 +269,99 @@ def validate(formulapath: str, anspath: str,
         sys.exit(1)
 
     verdict, model = answer
-    if verdict != ref_verdict:
-        logger.info("Wrong verdict given!")
-        return verdict, False
+    if verdict and model is None:
+        logger.info("No model provided!")
+        sys.exit(1)
 
-    if verdict:
-        if model is None:
-            logger.info("No model provided!")
-            sys.exit(1)
+    return answer
 
-        valid = validate_model(formula, model)
-        return verdict, valid
-    else:
-        return verdict, True
+
+def validate(formulapath: str, anspath: str, ref_verdict: bool,
+             proofpath: Optional[str] = None) -> tuple[bool, bool]:
+    """Return (given_verdict, correct). With a proof, an UNSAT answer is only
+    correct if the DRAT proof checks."""
+    return validate_answers(formulapath, [anspath], ref_verdict,
+                            [proofpath])[0]
+
+
+def validate_proof(formulapath: str, proofpath: str) -> bool:
+    if not os.path.exists(proofpath):
+        logger.info("No proof given!")
+        return False
+
+    formula = load_formula(formulapath)
+    with profiler.span("check proof", profiler.DETAIL):
+        verified = drat.check_proof(formula, proofpath)
+    if not verified:
+        logger.info("Invalid proof given!")
+        return False
+
+    return True
+
+
+def validate_answers(formulapath: str, anspaths: Sequence[str],
+                     ref_verdict: bool,
+                     proofpaths: Optional[Sequence[Optional[str]]] = None
+                     ) -> list[tuple[bool, bool]]:
+    """Same as validate, for several answers to the same formula (e.g. from
+    different solver builds); all the models are evaluated in one batch"""
+    # Answers are small, so they are read first: the formula is only needed
+    # if there's a model or a proof to check
+    with profiler.span("parse answer", profiler.DETAIL):
+        answers = [load_answer(anspath) for anspath in anspaths]
+    if proofpaths is None:
+        proofpaths = [None] * len(anspaths)
+
+    results = []
+    models = []
+    for (verdict, model), proofpath in zip(answers, proofpaths):
+        if verdict != ref_verdict:
+            logger.info("Wrong verdict given!")
+            results.append((verdict, False))
+        elif verdict:
+            results.append((verdict, True))
+            models.append((len(results) - 1, model))
+        elif proofpath is not None:
+            results.append((verdict, validate_proof(formulapath, proofpath)))
+        else:
+            results.append((verdict, True))
+
+    if not models:
+        return results
+
+    # A single model is checked while the formula streams in, unless the
+    # cache already has it parsed
+    if len(models) == 1 and cache is None:
+        idx, model = models[0]
+        with profiler.span("stream model check", profiler.DETAIL):
+            valid = stream_validate_model(formulapath, model)
+        if valid is not None:
+            results[idx] = (True, valid)
+            return results
+
+    with profiler.span("parse formula", profiler.DETAIL):
+        formula = load_formula(formulapath)
+    with profiler.span("check models", profiler.DETAIL):
+        batch = evaluate_models(formula, [model for _, model in models])
+    for (idx, _), valid in zip(models, batch.verdicts):
+        results[idx] = (True, valid)
+
+    return results
 
 
 def main():
     argparser = argparse.ArgumentParser()
-    argparser.add_argument('formula-file', type=str)
-    argparser.add_argument('answer-file', type=str)
-    argparser.add_argument('reference-answer', type=bool)
+    argparser.add_argument('formula_file', metavar='formula-file', type=str)
+    argparser.add_argument('answer_file', metavar='answer-file', type=str)
+    argparser.add_argument('reference_answer', metavar='reference-answer',
+                           type=bool)
+    argparser.add_argument("--diagnose", action="store_true",
+                           help="For an invalid model, list the falsified "
+                                "clauses of every variable involved")
+    argparser.add_argument("--proof", type=str,
+                           help="DRAT proof backing an UNSAT answer, text or "
+                                "binary; the answer is only correct if it "
+                                "checks")
     argparser.add_argument("--logdir", type=str, default="logs",
                            help="Name of the log directory (default: "
                                 "%(default)s)")
@@ -85,13 +375,23 @@ def main():
     global logger
     logger = helpers.setup_logging(args.logdir, args.logquiet, args.loglevel)
 
-    valid = validate(args.formula_file, args.answer_file,
-                     args.reference_answer)
+    verdict, valid = validate(args.formula_file, args.answer_file,
+                              args.reference_answer, args.proof)
     if valid:
         print("Answer is correct!")
     else:
         print("Answer is incorrect!")
 
+    if args.diagnose and verdict and not valid:
+        formula = load_formula(args.formula_file)
+        _, model = load_answer(args.answer_file)
+        assert model is not None
+        for var, clause_idxs in broken_clauses(formula, model).items():
+            clauses = (" ".join(map(str, formula.clause(idx)))
+                       for idx in clause_idxs)
+            print(f"{var}: " + ", ".join(f"#{idx} ({clause})" for idx, clause
+                                         in zip(clause_idxs, clauses)))
+
 
 if __name__ == "__main__":
     main()